@@ -0,0 +1,201 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+====================================================
+Micro-batching
+====================================================
+This module provides a request queue that groups concurrent calls to a model
+into a single batched call.
+
+The first request of a batch waits at most ``max_wait`` seconds for other
+requests to join it, and a batch is run as soon as it holds
+``max_batch_size`` requests. Every caller blocks until the batch is done and
+gets its own result back.
+
+Under the gevent server (without monkey patching), the requests are
+greenlets of a single thread: waiting on a thread primitive would block
+every greenlet, and no request could ever join a batch. The batches are
+always run by a thread, each caller waits on the primitive of its own kind,
+a gevent event for a greenlet (woken through its hub by the worker thread),
+a thread event otherwise. Greenlets and threads can share a batch.
+
+"""
+
+import collections
+import sys
+import threading
+import time
+
+
+def _in_greenlet():
+    """Whether the caller is a greenlet of gevent in a process whose threads
+    are not patched by gevent"""
+    gevent = sys.modules.get('gevent')
+    if gevent is None:
+        return False
+
+    from gevent import monkey
+    if monkey.is_module_patched('threading'):
+        return False
+
+    return isinstance(gevent.getcurrent(), gevent.Greenlet)
+
+
+class _Request():
+    def __init__(self, item, done):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.enqueued = time.time()
+        self.done = done
+
+
+class MicroBatcher():
+    """
+    A queue running concurrent requests through a model as one batch
+
+
+    Attributes
+    ----------
+    _process_batch : callable
+        Function mapping a list of items to the list of their results
+    _max_batch_size : int
+        Maximum number of requests per batch
+    _max_wait : float
+        Maximum number of seconds a request waits for others to join its batch
+    _pending : deque
+        Requests waiting for a batch
+    _worker : threading.Thread
+        Thread running the batches, started with the first request
+
+    Methods
+    -------
+    submit(self, item):
+        Queues an item and returns its result once its batch has run.
+
+    stats(self):
+        Returns queue depth and batch size metrics.
+
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait=0.005, name='batcher'):
+        self._process_batch = process_batch
+        self._max_batch_size = max(1, int(max_batch_size))
+        self._max_wait = max_wait
+        self._name = name
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        self._worker = None
+
+        self._num_requests = 0
+        self._num_batches = 0
+        self._max_depth = 0
+        self._total_wait = 0.0
+
+    def submit(self, item):
+        """Queues an item and blocks until its batch has been processed
+
+        :param item: Input of the model
+        :type item: object
+        :return: Result of the model for this item
+        :rtype: object
+        """
+        # A greenlet must not block the other greenlets of its thread while waiting
+        if _in_greenlet():
+            from gevent.event import Event
+            request = _Request(item, Event())
+        else:
+            request = _Request(item, threading.Event())
+
+        with self._cond:
+            if not self._worker_alive():
+                self._start_worker()
+
+            self._pending.append(request)
+            self._max_depth = max(self._max_depth, len(self._pending))
+            self._cond.notify()
+
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _worker_alive(self):
+        return self._worker is not None and self._worker.is_alive()
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._worker.start()
+
+    def _next_batch(self):
+        """Waits for the first request, then for the batch to fill up or its
+        window to close"""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            deadline = self._pending[0].enqueued + self._max_wait
+            while len(self._pending) < self._max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            size = min(len(self._pending), self._max_batch_size)
+            return [self._pending.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            t_start = time.time()
+
+            try:
+                results = self._process_batch([request.item for request in batch])
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                # Every caller of the batch gets the error
+                for request in batch:
+                    request.error = e
+
+            with self._cond:
+                self._num_requests += len(batch)
+                self._num_batches += 1
+                self._total_wait += sum(t_start - request.enqueued for request in batch)
+
+            for request in batch:
+                request.done.set()
+
+    def stats(self):
+        """Returns the metrics of the queue
+
+        :return: Current and maximum queue depth, number of requests and
+            batches, mean batch size and mean time spent waiting in the queue
+        :rtype: dict
+        """
+        with self._cond:
+            return {
+                'queue_depth': len(self._pending),
+                'max_queue_depth': self._max_depth,
+                'max_batch_size': self._max_batch_size,
+                'max_wait': self._max_wait,
+                'requests': self._num_requests,
+                'batches': self._num_batches,
+                'mean_batch_size': self._num_requests / self._num_batches if self._num_batches else 0.0,
+                'mean_wait': self._total_wait / self._num_requests if self._num_requests else 0.0}
@@ -0,0 +1,225 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+====================================================
+BM25 Retriever
+====================================================
+This module provides an in-process BM25 retriever, used by the search models
+instead of Elasticsearch for single documents and small corpora.
+
+The inverted index is stored in flat NumPy arrays (CSR layout: the postings
+of term t are doc_ids[indptr[t]:indptr[t + 1]] and their term frequencies
+are term_freqs[indptr[t]:indptr[t + 1]]) and queries are scored for all the
+documents at once.
+
+"""
+
+import re
+import numpy as np
+
+
+# Same stop words as the '_english_' analyzer used by the Elasticsearch index
+ENGLISH_STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in',
+    'into', 'is', 'it', 'no', 'not', 'of', 'on', 'or', 'such', 'that', 'the',
+    'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was', 'will',
+    'with'])
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def analyze(text):
+    """Splits a text into lowercased terms, without stop words
+
+    :param text: Input text
+    :type text: str
+    :return: List of terms
+    :rtype: list
+    """
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in ENGLISH_STOP_WORDS]
+
+
+class BM25Index():
+    """
+    A compact, array-backed BM25 inverted index
+
+
+    Attributes
+    ----------
+    _k1 : float
+        Term frequency saturation parameter
+    _b : float
+        Document length normalization parameter
+    _docs : list of str
+        The indexed documents
+    _vocabulary : dict
+        Term -> term id
+    _indptr : np.ndarray
+        Offsets of the postings of every term, (num_terms + 1,)
+    _doc_ids : np.ndarray
+        Document ids of all the postings, sorted by term id
+    _term_freqs : np.ndarray
+        Term frequencies of all the postings
+    _idf : np.ndarray
+        Inverse document frequency of every term
+    _length_norm : np.ndarray
+        k1 * (1 - b + b * doc_len / avg_doc_len) for every document
+
+    Methods
+    -------
+    search(self, query, size=1):
+        Returns the best scoring documents for a query.
+
+    """
+
+    def __init__(self, docs, k1=1.2, b=0.75):
+        self._k1 = k1
+        self._b = b
+        self._docs = list(docs)
+        self._vocabulary = {}
+
+        term_ids, doc_ids = [], []
+        doc_lengths = np.zeros(len(self._docs), dtype=np.float32)
+
+        for doc_id, doc in enumerate(self._docs):
+            terms = analyze(doc)
+            doc_lengths[doc_id] = len(terms)
+            for term in terms:
+                term_ids.append(self._vocabulary.setdefault(term, len(self._vocabulary)))
+            doc_ids.extend([doc_id] * len(terms))
+
+        num_terms = len(self._vocabulary)
+        num_docs = max(len(self._docs), 1)
+
+        # One (term, doc) pair per posting, with its term frequency
+        pairs = np.asarray(term_ids, dtype=np.int64) * num_docs + np.asarray(doc_ids, dtype=np.int64)
+        pairs, term_freqs = np.unique(pairs, return_counts=True)
+
+        posting_terms = pairs // num_docs
+        self._doc_ids = (pairs % num_docs).astype(np.int32)
+        self._term_freqs = term_freqs.astype(np.float32)
+
+        doc_freqs = np.bincount(posting_terms, minlength=num_terms)
+        self._indptr = np.zeros(num_terms + 1, dtype=np.int64)
+        np.cumsum(doc_freqs, out=self._indptr[1:])
+
+        self._idf = np.log(1 + (len(self._docs) - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+
+        avg_doc_length = doc_lengths.mean() if len(self._docs) and doc_lengths.mean() > 0 else 1
+        self._length_norm = k1 * (1 - b + b * doc_lengths / avg_doc_length)
+
+    def __len__(self):
+        return len(self._docs)
+
+    def scores(self, query):
+        """Returns the BM25 score of every document for a query
+
+        :param query: Input query
+        :type query: str
+        :return: Scores, (num_docs,)
+        :rtype: np.ndarray
+        """
+        term_ids = sorted({self._vocabulary[t] for t in analyze(query) if t in self._vocabulary})
+        if len(term_ids) == 0:
+            return np.zeros(len(self._docs), dtype=np.float32)
+
+        # Gather the postings of all the query terms
+        postings = np.concatenate(
+            [np.arange(self._indptr[t], self._indptr[t + 1]) for t in term_ids])
+        posting_idf = np.repeat(
+            self._idf[term_ids], self._indptr[np.add(term_ids, 1)] - self._indptr[term_ids])
+
+        doc_ids = self._doc_ids[postings]
+        term_freqs = self._term_freqs[postings]
+
+        contributions = posting_idf * term_freqs * (self._k1 + 1) / (term_freqs + self._length_norm[doc_ids])
+
+        return np.bincount(doc_ids, weights=contributions, minlength=len(self._docs))
+
+    def search(self, query, size=1):
+        """Returns the best scoring documents for a query, as (doc_id, score)
+        pairs sorted by decreasing score
+
+        :param query: Input query
+        :type query: str
+        :param size: Number of documents to return, defaults to 1
+        :type size: int, optional
+        :return: List of (doc_id, score)
+        :rtype: list
+        """
+        scores = self.scores(query)
+        size = min(size, int(np.count_nonzero(scores)))
+        if size == 0:
+            return []
+
+        top = np.argpartition(-scores, size - 1)[:size]
+        top = top[np.argsort(-scores[top])]
+
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in top]
+
+
+class BM25Retriever():
+    """
+    Retriever keeping one BM25 index per loaded document, with the same
+    interface as the Elasticsearch retriever (index_documents/search)
+
+    """
+
+    def __init__(self, k1=1.2, b=0.75, max_indices=10):
+        self._k1 = k1
+        self._b = b
+        self._max_indices = max_indices
+        self._indices = {}
+        self.index_name = None
+
+    def index_documents(self, docs, index_name):
+        """Builds the index of a document, or reuses it if it was already built
+
+        :param docs: Segments of the document
+        :type docs: iterable
+        :param index_name: Name of the index (hash of the document content)
+        :type index_name: str
+        """
+        if index_name in self._indices:
+            # Most recently used indices are kept at the end
+            self._indices[index_name] = self._indices.pop(index_name)
+        else:
+            self._indices[index_name] = BM25Index(docs, self._k1, self._b)
+            print(f"(BM25Retriever) > Indexed {len(self._indices[index_name])} segments")
+
+        while len(self._indices) > self._max_indices:
+            self._indices.pop(next(iter(self._indices)))
+
+        self.index_name = index_name
+
+    def search(self, query, size=1):
+        """Searches the current index, returns results shaped like the
+        response of an Elasticsearch search
+
+        :param query: Input query
+        :type query: str
+        :param size: Number of hits, defaults to 1
+        :type size: int, optional
+        :return: Results
+        :rtype: dict
+        """
+        index = self._indices[self.index_name]
+        hits = [{'_id': str(doc_id), '_score': score, '_source': {'text': index._docs[doc_id]}}
+                for doc_id, score in index.search(query, size)]
+
+        return {'hits': {'total': {'value': len(hits)}, 'hits': hits}}
@@ -0,0 +1,103 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+====================================================
+Generation Profiles
+====================================================
+This module provides the named generation settings of the summarization
+models, trading summary quality for latency.
+
+    'fast' - greedy decoding, short summaries
+    'balanced' - 2 beams
+    'quality' - 4 beams, favouring longer summaries
+
+The length of a summary is proportional to the length of its input: a
+profile gives the number of new tokens per input token, bounded by a floor
+and by the maximum length of the caller. A profile is selected by name, or
+given as a dictionary with the same keys (model_options of the YAML file).
+
+"""
+
+import math
+
+
+GENERATION_PROFILES = {
+    'fast': {
+        'num_beams': 1,
+        'early_stopping': False,
+        'length_penalty': 1.0,
+        'length_ratio': 0.15,
+        'min_new_tokens': 16},
+    'balanced': {
+        'num_beams': 2,
+        'early_stopping': True,
+        'length_penalty': 1.0,
+        'length_ratio': 0.25,
+        'min_new_tokens': 24},
+    'quality': {
+        'num_beams': 4,
+        'early_stopping': True,
+        'length_penalty': 2.0,
+        'length_ratio': 0.35,
+        'min_new_tokens': 32},
+}
+
+
+def get_generation_profile(profile):
+    """Returns the settings of a generation profile
+
+    :param profile: Name of the profile, or its settings
+    :type profile: str or dict
+    :raises ValueError: Unknown profile name
+    :return: Settings of the profile
+    :rtype: dict
+    """
+    if isinstance(profile, dict):
+        return {**GENERATION_PROFILES['balanced'], **profile}
+
+    if profile not in GENERATION_PROFILES:
+        raise ValueError(
+            f"Unknown generation profile '{profile}', expected one of {list(GENERATION_PROFILES)}")
+
+    return GENERATION_PROFILES[profile]
+
+
+def generation_kwargs(profile, num_input_tokens, max_new_tokens):
+    """Returns the arguments of generate of a profile for an input
+
+    :param profile: Name of the profile, or its settings
+    :type profile: str or dict
+    :param num_input_tokens: Number of tokens of the (longest) input
+    :type num_input_tokens: int
+    :param max_new_tokens: Maximum number of tokens of a summary
+    :type max_new_tokens: int
+    :return: num_beams, early_stopping, length_penalty, max_new_tokens and min_length
+    :rtype: dict
+    """
+    settings = get_generation_profile(profile)
+
+    budget = max(settings['min_new_tokens'], math.ceil(settings['length_ratio'] * num_input_tokens))
+    budget = max(1, min(max_new_tokens, budget))
+
+    return {
+        'num_beams': settings['num_beams'],
+        'early_stopping': settings['early_stopping'],
+        'length_penalty': settings['length_penalty'],
+        'max_new_tokens': budget,
+        # Overrides the min_length of the model config, which may exceed the budget
+        'min_length': max(1, budget // 4)}
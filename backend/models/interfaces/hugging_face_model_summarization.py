@@ -24,13 +24,18 @@ This module extends the ModelSummary interface to load Hugging Face models.
 
 """
 
-from os.path import exists
-import pandas as pd
+import hashlib
+import time
+import torch
 from tqdm.auto import tqdm
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, SummarizationPipeline
-from transformers.pipelines.base import KeyDataset
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, SummarizationPipeline, \
+    StoppingCriteria, StoppingCriteriaList
 
+from backend.models.interfaces.generation_profiles import generation_kwargs, get_generation_profile
 from backend.models.interfaces.model_summarization import ModelSummarization
+from backend.models.interfaces.model_registry import model_registry
+from backend.models.interfaces.results_store import ResultsStore
+from backend.models.interfaces.model_search import iter_segments
 
 
 class HuggingFaceModelSummarization(ModelSummarization):
@@ -47,6 +52,27 @@ class HuggingFaceModelSummarization(ModelSummarization):
         The maximum length parameter of the model
     _truncation : boolean
         Whether or not to truncate input sequences
+    _quantize : boolean
+        Whether the Linear layers of the model are quantized to int8
+    _batch_memory_budget : int
+        Memory (in MB) the batches of dataset summarization may use
+    _max_batch_size : int
+        Maximum number of examples per batch of dataset summarization
+    _checkpoint_size : int
+        Number of examples per checkpoint (results shard) of dataset summarization
+    _hierarchical : boolean
+        Whether texts longer than the input of the model are summarized with a map-reduce
+    _chunk_tokens : int
+        Maximum number of tokens of a chunk of a long text
+    _partial_summary_tokens : int
+        Maximum number of tokens of the summary of a chunk
+    _max_depth : int
+        Maximum number of map/reduce levels of the summary of a long text
+    _fan_out : int
+        Number of partial summaries summarized together, and of chunks per batch
+    _generation_profile : str or dict
+        Default generation profile (see generation_profiles), None for 4 beams
+        up to the max length of the model
     _model : AutoModelForSeq2SeqLM
         A HuggingFace model for summarization
     _tokenizer : AutoTokenizer
@@ -59,28 +85,64 @@ class HuggingFaceModelSummarization(ModelSummarization):
     _summarize_dataset(self, dataset, column):
         Summarizes a dataset and appends to it a column with the summarized text.
 
-    _summarize_text(self, text_to_summarize):
+    _summarize_text(self, text_to_summarize, profile=None):
         Summarizes a piece of text and returns it.
 
+    _summarize_text_with_timings(self, text_to_summarize, profile=None, should_stop=None):
+        Summarizes a piece of text and returns it with the time of every stage.
+
+    _summarize_long_text(self, text_to_summarize, profile=None, should_stop=None):
+        Summarizes a text longer than the input of the model (map-reduce).
+
+    _summarize_text_streaming(self, text_to_summarize, on_text, should_stop=None, profile=None):
+        Summarizes a piece of text, pushing the summary as it is generated.
+
+    _summarize_texts(self, texts_to_summarize, profile=None):
+        Summarizes several pieces of text in one batch and returns them.
+
+    _iter_summary_batches(self, texts_to_summarize, profile=None):
+        Summarizes many pieces of text in batches of similar lengths.
+
     """
 
-    def __init__(self, model_name, max_length, model_max_length, truncation, model_info, verbose=True):
+    def __init__(self, model_name, max_length, model_max_length, truncation, model_info, verbose=True,
+                 quantize=False, batch_memory_budget=2048, max_batch_size=32, checkpoint_size=256,
+                 hierarchical=True, chunk_tokens=None, partial_summary_tokens=128, max_depth=3,
+                 fan_out=8, generation_profile=None):
 
         self._info = model_info
+        self._model_name = model_name
         self._max_length = max_length
         self._truncation = truncation
+        self._quantize = quantize
+        self._batch_memory_budget = batch_memory_budget
+        self._max_batch_size = max_batch_size
+        self._checkpoint_size = checkpoint_size
+        self._hierarchical = hierarchical
+        # Chunks fit in the input of the model along with its special tokens
+        self._chunk_tokens = chunk_tokens or max_length - 4
+        self._partial_summary_tokens = partial_summary_tokens
+        self._max_depth = max_depth
+        self._fan_out = fan_out
+        if generation_profile is not None:
+            # Fails on unknown profile names at startup rather than on the first request
+            get_generation_profile(generation_profile)
+        self._generation_profile = generation_profile
 
         if verbose == True:
-            print('> Loading ' + self._info['name'] + ' model...')
+            print('> Loading ' + self._info['name'] + (' int8' if quantize else '') + ' model...')
 
-        self._model = AutoModelForSeq2SeqLM.from_pretrained(
+        self._model = model_registry.from_pretrained(
+            AutoModelForSeq2SeqLM,
             model_name,
+            quantize=quantize,
             max_length=max_length)
 
         if verbose == True:
             print('> Loading ' + self._info['name'] + ' tokenizer...')
 
-        self._tokenizer = AutoTokenizer.from_pretrained(
+        self._tokenizer = model_registry.from_pretrained(
+            AutoTokenizer,
             model_name,
             max_length=max_length,
             model_max_length=model_max_length,
@@ -100,10 +162,11 @@ class HuggingFaceModelSummarization(ModelSummarization):
     def _summarize_dataset(self, dataset):
         """ 
         Method that takes in a HuggingFace dataset and the name of the column of
-        the dataset that contains the text to summarize. It calls the 
-        summarization pipeline attribute and runs it on the whole dataset. It 
-        saves the results in a list and adds this list to the dataset object and
-        returns it.
+        the dataset that contains the text to summarize. It summarizes the whole
+        dataset in batches, checkpointing the results to a store keyed by the
+        model revision, generation config, dataset fingerprint and split (an
+        interrupted run resumes from its last checkpoint, a finished one is
+        read back). It adds the summaries to the dataset object and returns it.
 
         Parameters
         ----------
@@ -118,71 +181,500 @@ class HuggingFaceModelSummarization(ModelSummarization):
             The HuggingFace dataset to summarize with the summarized text column
         """
 
-        # Path where the summarization results are stored
-        results_file_path = 'aski/results/' + \
-            self._info['name'] + '_' + dataset._dataset_name + '.csv'
+        profile = self._generation_profile
+        num_beams = 4 if profile is None else get_generation_profile(profile)['num_beams']
+        split = dataset._dataset[dataset._split]
+
+        generation = {'num_beams': num_beams, 'max_length': self._max_length,
+                      'truncation': self._truncation, 'quantize': self._quantize}
+        if profile is not None:
+            generation['profile'] = get_generation_profile(profile)
+
+        # Results of this exact run (model, generation config, data), if any
+        store = ResultsStore.for_run(
+            self._info['class_name'] + '_' + dataset._dataset_name,
+            model=self._model_name,
+            revision=self._get_model_revision(),
+            generation=generation,
+            dataset=dataset._dataset_name,
+            fingerprint=split._fingerprint,
+            split=dataset._split,
+            column=dataset._document_column)
+        results = store.load()
+
+        # Summarize the examples missing from the store, one shard per checkpoint
+        if not store.is_complete():
+            documents = split[dataset._document_column]
+            remaining = [i for i in range(len(documents)) if i not in results]
+            if len(results) > 0:
+                print('> Resuming ' + self._info['name'] + ' run from ' + store.path + ' (' +
+                      str(len(results)) + '/' + str(len(documents)) + ' examples done)')
+
+            pending_indices, pending_summaries = [], []
+            for batch, summaries in self._iter_summary_batches(
+                    [documents[i] for i in remaining], profile=profile):
+                pending_indices += [remaining[j] for j in batch]
+                pending_summaries += summaries
+
+                if len(pending_indices) >= self._checkpoint_size:
+                    store.append(pending_indices, pending_summaries)
+                    results.update(zip(pending_indices, pending_summaries))
+                    pending_indices, pending_summaries = [], []
+
+            store.append(pending_indices, pending_summaries)
+            results.update(zip(pending_indices, pending_summaries))
+            store.mark_complete(len(documents))
+
+        summarization_outputs = [results[i] for i in range(len(split))]
+
+        # Add the column to the dataset object to be able to compute metrics
+        dataset._dataset[dataset._split] = split.add_column(
+            name=('result_' + self._info['class_name']),
+            column=summarization_outputs)
 
-        # To store the summarization results (will later be added to the dataset)
-        summarization_outputs = []
+        return dataset
 
-        # If we already ran the model for this dataset, read the saved results
-        if exists(results_file_path):
+    def _summarize_text(self, text_to_summarize, profile=None):
+        """ 
+        Method that takes in a piece of text and summarizes it by calling the 
+        tokenizer and model attributes and finally returns it. Texts longer
+        than the input of the model are summarized hierarchically (see
+        _summarize_long_text) unless hierarchical summarization is disabled.
 
-            # Read the first column of the csv file which contains the summaries
-            df = pd.read_csv(results_file_path)
-            summarization_outputs = df[df.columns[0]]
+        Parameters
+        ----------
+        text_to_summarize : str
+            The piece of text to summarize
+        profile : str or dict
+            Generation profile (defaults to the one of the model)
 
-            # Add the column to the dataset object to be able to compute metrics
-            dataset._dataset[dataset._split] = dataset._dataset[dataset._split].add_column(
-                name=('result_' + self._info['class_name']),
-                column=summarization_outputs)
-        else:
-            for output in tqdm(self._pipe(KeyDataset(dataset._dataset[dataset._split], dataset._document_column))):
+        Returns
+        -------
+        summary_text : List of str
+            The summarized text as a list of strings
+        """
 
-                answer = output[0]['summary_text']
-                summarization_outputs.append(answer)
+        return self._summarize_text_with_timings(text_to_summarize, profile=profile)[0]
 
-            # Save the results to a pandas dataframe and dump it to csv
-            df = pd.DataFrame(summarization_outputs)
-            df.to_csv(results_file_path, index=False)
+    def _summarize_text_with_timings(self, text_to_summarize, profile=None, should_stop=None,
+                                     **generate_kwargs):
+        """ 
+        Method that summarizes a piece of text like _summarize_text and also
+        returns the time spent in every stage.
 
-            # Add the column to the dataset object to be able to compute metrics
-            dataset._dataset[dataset._split] = dataset._dataset[dataset._split].add_column(
-                name=('result' + self._info['class_name']),
-                column=summarization_outputs)
+        Parameters
+        ----------
+        text_to_summarize : str
+            The piece of text to summarize
+        profile : str or dict
+            Generation profile (defaults to the one of the model)
+        should_stop : callable
+            Function returning True when the summary must be cancelled (long
+            texts only, see _summarize_long_text)
+        generate_kwargs : dict
+            Arguments of generate for the summary (of the last stage)
 
-        return dataset
+        Returns
+        -------
+        summary_text : List of str
+            The summarized text as a list of strings
+        timings : List of dict
+            One {'stage', 'depth', 'inputs', 'time'} dictionary per stage
+        """
+
+        num_tokens = len(self._tokenizer(
+            text_to_summarize, add_special_tokens=False, verbose=False)['input_ids'])
+
+        if self._hierarchical and num_tokens > self._chunk_tokens:
+            return self._summarize_long_text(
+                text_to_summarize, profile=profile, should_stop=should_stop, **generate_kwargs)
+
+        t_s = time.time()
+        summary_text = self._summarize_texts(
+            [text_to_summarize],
+            max_input_length=self._max_length,
+            max_length=self._max_length,
+            profile=profile,
+            **generate_kwargs)
+
+        return summary_text, [{'stage': 'summarize', 'depth': 0, 'inputs': 1, 'time': time.time() - t_s}]
 
-    def _summarize_text(self, text_to_summarize):
+    def _summarize_long_text(self, text_to_summarize, profile=None, should_stop=None, **generate_kwargs):
         """ 
-        Method that takes in a piece of text and summarizes it by calling the 
-        tokenizer and model attributes and finally returns it.
+        Method that summarizes a text longer than the input of the model with
+        a map-reduce: the text is split into token-bounded chunks (ending on
+        sentence boundaries), the chunks are summarized in batches (map), and
+        groups of fan_out partial summaries are concatenated and summarized
+        again (reduce) until one summary is left. After max_depth levels, all
+        the remaining partial summaries are concatenated and summarized at
+        once (truncated if they still do not fit). The cost is linear in the
+        length of the text. Once should_stop returns True, the generation of
+        the current batch stops and no other stage is run.
 
         Parameters
         ----------
         text_to_summarize : str
             The piece of text to summarize
+        profile : str or dict
+            Generation profile of every stage (defaults to the one of the model)
+        should_stop : callable
+            Function returning True when the summary must be cancelled
+        generate_kwargs : dict
+            Arguments of generate for the final summary
 
         Returns
         -------
         summary_text : List of str
-            The summarized text as a list of strings
+            The summarized text (partial summaries when cancelled) as a list of strings
+        timings : List of dict
+            One {'stage', 'depth', 'inputs', 'time'} dictionary per stage
+        """
+
+        timings = []
+
+        # Map: every chunk of the document is summarized
+        t_s = time.time()
+        chunks = list(iter_segments(
+            [text_to_summarize], self._tokenizer, max_tokens=self._chunk_tokens, stride=0))
+        summaries = self._summarize_in_batches(chunks, profile, should_stop)
+        timings.append({'stage': 'map', 'depth': 0, 'inputs': len(chunks), 'time': time.time() - t_s})
+        if _cancelled(should_stop):
+            return [" ".join(summaries)], timings
+
+        # Reduce: groups of fan_out partial summaries are summarized together
+        depth = 1
+        while len(summaries) > 1 and depth < self._max_depth:
+            t_s = time.time()
+            groups = [" ".join(summaries[i:i + self._fan_out])
+                      for i in range(0, len(summaries), self._fan_out)]
+            if len(groups) == 1:
+                break
+            summaries = self._summarize_in_batches(groups, profile, should_stop)
+            timings.append({'stage': 'reduce', 'depth': depth, 'inputs': len(groups), 'time': time.time() - t_s})
+            if _cancelled(should_stop):
+                return [" ".join(summaries)], timings
+            depth += 1
+
+        # Final summary of the remaining partial summaries
+        t_s = time.time()
+        summary_text = self._summarize_texts(
+            [" ".join(summaries)],
+            max_input_length=self._max_length,
+            max_length=self._max_length,
+            profile=profile,
+            **generate_kwargs)
+        timings.append({'stage': 'final', 'depth': depth, 'inputs': len(summaries), 'time': time.time() - t_s})
+
+        return summary_text, timings
+
+    def _summarize_text_streaming(self, text_to_summarize, on_text, should_stop=None, profile=None):
+        """ 
+        Method that summarizes a piece of text like _summarize_text_with_timings
+        and calls on_text with every new piece of the summary as soon as it is
+        generated. The summary is generated greedily, as the beams of a beam
+        search are only final at the end. Generation stops early when
+        should_stop returns True (client gone...), in whichever stage of the
+        summary of a long text it is.
+
+        Parameters
+        ----------
+        text_to_summarize : str
+            The piece of text to summarize
+        on_text : callable
+            Function called with every new piece of decoded text
+        should_stop : callable
+            Function returning True when generation must be cancelled
+        profile : str or dict
+            Generation profile, for the length of the summary (defaults to the one of the model)
+
+        Returns
+        -------
+        summary_text : List of str
+            The summarized text (possibly partial) as a list of strings
+        timings : List of dict
+            One {'stage', 'depth', 'inputs', 'time'} dictionary per stage
         """
 
+        streamer = _TextStreamer(self._tokenizer, on_text, should_stop)
+
+        summary_text, timings = self._summarize_text_with_timings(
+            text_to_summarize,
+            profile=profile,
+            should_stop=should_stop,
+            num_beams=1,
+            early_stopping=False,
+            length_penalty=1.0,
+            stopping_criteria=StoppingCriteriaList([streamer]))
+
+        # Last word of the summary (a cancelled one may end on partial summaries)
+        if not _cancelled(should_stop):
+            streamer.push(summary_text[0])
+
+        return summary_text, timings
+
+    def _summarize_in_batches(self, texts_to_summarize, profile=None, should_stop=None):
+        """ 
+        Method that summarizes the chunks (or groups of partial summaries) of
+        a long text, fan_out of them per generate call.
+
+        Parameters
+        ----------
+        texts_to_summarize : list of str
+            The pieces of text to summarize
+        profile : str or dict
+            Generation profile (defaults to the one of the model)
+        should_stop : callable
+            Function returning True when the summary must be cancelled
+
+        Returns
+        -------
+        summary_texts : List of str
+            One partial summary per piece of text (only the ones of the
+            batches run before cancellation)
+        """
+
+        generate_kwargs = {}
+        if should_stop is not None:
+            generate_kwargs['stopping_criteria'] = StoppingCriteriaList([_Cancellation(should_stop)])
+
+        summary_texts = []
+        for i in range(0, len(texts_to_summarize), self._fan_out):
+            if _cancelled(should_stop):
+                break
+            summary_texts += self._summarize_texts(
+                texts_to_summarize[i:i + self._fan_out],
+                max_input_length=self._max_length,
+                max_length=self._partial_summary_tokens,
+                profile=profile,
+                **generate_kwargs)
+
+        return summary_texts
+
+    def _summarize_texts(self, texts_to_summarize, max_input_length=None, min_length=None,
+                         max_length=None, num_beams=None, profile=None, **generate_kwargs):
+        """ 
+        Method that summarizes several pieces of text with a single batched
+        generate call. Inputs are padded to the longest one of the batch and
+        truncated to max_input_length tokens. With a generation profile, the
+        length of the summaries is proportional to the longest input, up to
+        max_length tokens.
+
+        Parameters
+        ----------
+        texts_to_summarize : list of str
+            The pieces of text to summarize
+        max_input_length : int
+            Maximum number of tokens of an input (defaults to the max length of the model)
+        min_length : int
+            Minimum number of tokens of a summary
+        max_length : int
+            Maximum number of tokens of a summary (defaults to the max length of the model)
+        num_beams : int
+            Number of beams of the beam search (defaults to the one of the profile, else 4)
+        profile : str or dict
+            Generation profile (defaults to the one of the model)
+        generate_kwargs : dict
+            Other arguments of generate (stopping_criteria...)
+
+        Returns
+        -------
+        summary_texts : List of str
+            One summary per piece of text
+        """
+
+        if len(texts_to_summarize) == 0:
+            return []
+
         inputs = self._tokenizer(
-            [text_to_summarize],
+            list(texts_to_summarize),
             return_tensors="pt",
-            max_length=self._max_length,
+            padding='longest',
+            max_length=max_input_length or self._max_length,
             truncation=self._truncation)
 
-        summary_ids = self._model.generate(
-            inputs["input_ids"],
-            num_beams=4,
-            max_length=self._max_length)
+        profile = profile or self._generation_profile
+        if profile is not None:
+            num_input_tokens = int(inputs["attention_mask"].sum(dim=1).max())
+            kwargs = generation_kwargs(profile, num_input_tokens, max_length or self._max_length)
+        else:
+            kwargs = {'num_beams': 4, 'max_length': max_length or self._max_length}
 
-        summary_text = self._tokenizer.batch_decode(
+        if num_beams is not None:
+            kwargs['num_beams'] = num_beams
+        if min_length is not None:
+            kwargs['min_length'] = min_length
+        kwargs.update(generate_kwargs)
+
+        with torch.no_grad():
+            summary_ids = self._model.generate(
+                inputs["input_ids"],
+                attention_mask=inputs["attention_mask"],
+                **kwargs)
+
+        summary_texts = self._tokenizer.batch_decode(
             summary_ids,
             skip_special_tokens=True,
             clean_up_tokenization_spaces=False)
 
-        return summary_text
+        return summary_texts
+
+    def _iter_summary_batches(self, texts_to_summarize, num_beams=4, profile=None):
+        """ 
+        Generator summarizing many pieces of text in batches. Inputs are
+        tokenized once, sorted by length so that every batch holds inputs of
+        similar lengths (little padding), and the size of each batch is chosen
+        so that it fits in the memory budget.
+
+        Parameters
+        ----------
+        texts_to_summarize : list of str
+            The pieces of text to summarize
+        num_beams : int
+            Number of beams of the beam search, without generation profile
+        profile : str or dict
+            Generation profile (defaults to the one of the model)
+
+        Yields
+        ------
+        batch : List of int
+            Indices of the pieces of text of the batch
+        summaries : List of str
+            Their summaries
+        """
+
+        if len(texts_to_summarize) == 0:
+            return
+
+        input_ids = self._tokenizer(
+            list(texts_to_summarize),
+            max_length=self._max_length,
+            truncation=self._truncation)['input_ids']
+
+        profile = profile or self._generation_profile
+        if profile is not None:
+            num_beams = get_generation_profile(profile)['num_beams']
+
+        # Longest first: the largest batches come last, and memory issues show up early
+        order = sorted(range(len(input_ids)), key=lambda i: -len(input_ids[i]))
+        max_batch_tokens = self._max_batch_tokens(num_beams)
+
+        with tqdm(total=len(order)) as progress:
+            start = 0
+            while start < len(order):
+                longest = len(input_ids[order[start]])
+                batch_size = max(1, min(self._max_batch_size, max_batch_tokens // (longest * num_beams)))
+                batch = order[start:start + batch_size]
+
+                inputs = self._tokenizer.pad(
+                    {'input_ids': [input_ids[i] for i in batch]}, return_tensors="pt")
+
+                if profile is not None:
+                    kwargs = generation_kwargs(profile, longest, self._max_length)
+                else:
+                    kwargs = {'num_beams': num_beams, 'max_length': self._max_length}
+
+                with torch.no_grad():
+                    summary_ids = self._model.generate(
+                        inputs["input_ids"],
+                        attention_mask=inputs["attention_mask"],
+                        **kwargs)
+
+                summaries = self._tokenizer.batch_decode(
+                    summary_ids,
+                    skip_special_tokens=True,
+                    clean_up_tokenization_spaces=False)
+
+                start += len(batch)
+                progress.update(len(batch))
+
+                yield batch, summaries
+
+    def _get_model_revision(self):
+        """ 
+        Method that returns what identifies the weights of the model: the
+        commit of the checkpoint on the HuggingFace hub when known, and a hash
+        of its configuration.
+
+        Returns
+        -------
+        revision : str
+            Revision of the model
+        """
+
+        config = self._model.config
+        config_hash = hashlib.sha1(config.to_json_string().encode('utf-8')).hexdigest()[:16]
+
+        return str(getattr(config, '_commit_hash', None)) + '-' + config_hash
+
+    def _max_batch_tokens(self, num_beams):
+        """ 
+        Method that returns the number of padded input tokens (times beams) a
+        batch may hold within the memory budget. The memory held per token is
+        estimated from the width and depth of the model (hidden states,
+        attention and key/value caches of every layer, in fp32).
+
+        Parameters
+        ----------
+        num_beams : int
+            Number of beams of the beam search
+
+        Returns
+        -------
+        max_batch_tokens : int
+            Maximum number of input tokens times beams per batch
+        """
+
+        config = self._model.config
+        hidden_size = getattr(config, 'd_model', None) or getattr(config, 'hidden_size', 1024)
+        num_layers = sum(getattr(config, name, None) or 0 for name in [
+            'encoder_layers', 'decoder_layers', 'num_layers', 'num_decoder_layers']) or 24
+
+        bytes_per_token = 8 * hidden_size * num_layers * 4
+
+        return max(num_beams, self._batch_memory_budget * 1024 * 1024 // bytes_per_token)
+
+
+def _cancelled(should_stop):
+    return should_stop is not None and bool(should_stop())
+
+
+class _Cancellation(StoppingCriteria):
+    """
+    Generation hook stopping generation on cancellation
+
+    """
+
+    def __init__(self, should_stop):
+        self._should_stop = should_stop
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return bool(self._should_stop())
+
+
+class _TextStreamer(StoppingCriteria):
+    """
+    Generation hook decoding the summary at every step of a greedy generate,
+    pushing the new text and stopping generation on cancellation
+
+    """
+
+    def __init__(self, tokenizer, on_text, should_stop=None):
+        self._tokenizer = tokenizer
+        self._on_text = on_text
+        self._should_stop = should_stop
+        self._text = ''
+
+    def __call__(self, input_ids, scores, **kwargs):
+        text = self._tokenizer.decode(
+            input_ids[0], skip_special_tokens=True, clean_up_tokenization_spaces=False)
+
+        # Only complete words are pushed, the last token may be part of a word
+        self.push(text[:text.rfind(' ') + 1])
+
+        return _cancelled(self._should_stop)
+
+    def push(self, text):
+        """Pushes the part of text that was not pushed yet"""
+        if text.startswith(self._text) and len(text) > len(self._text):
+            self._on_text(text[len(self._text):])
+            self._text = text
@@ -0,0 +1,526 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+====================================================
+Late Interaction
+====================================================
+This module implements ColBERT late-interaction retrieval on CPU.
+
+Passages are encoded once into one normalized embedding per token. The
+embeddings of all the passages are stored contiguously on disk and memory
+mapped at search time, and queries are scored against every passage with a
+vectorized MaxSim (sum over the query tokens of the maximum similarity with
+the tokens of the passage).
+
+Embeddings can be compressed as in ColBERTv2: the id of their nearest
+centroid plus a few bits per dimension of their residual, which makes the
+index several times smaller than float16 embeddings.
+
+https://arxiv.org/abs/2004.12832
+https://arxiv.org/abs/2112.01488
+
+"""
+
+import json
+import os
+import shutil
+import string
+
+import numpy as np
+import torch
+from torch import nn
+from transformers import BertModel, BertPreTrainedModel
+
+
+class ColBERTEncoder(BertPreTrainedModel):
+    """BERT encoder followed by the linear projection of the ColBERT
+    checkpoints (e.g. colbert-ir/colbertv2.0)"""
+
+    def __init__(self, config, dim=128):
+        super().__init__(config)
+        self.bert = BertModel(config)
+        self.linear = nn.Linear(config.hidden_size, dim, bias=False)
+        self.post_init()
+
+    def forward(self, input_ids, attention_mask):
+        embeddings = self.linear(self.bert(input_ids, attention_mask=attention_mask)[0])
+        return nn.functional.normalize(embeddings, p=2, dim=2)
+
+
+class LateInteractionEncoder():
+    """
+    Encodes queries and passages into per-token ColBERT embeddings
+
+
+    Attributes
+    ----------
+    _model : ColBERTEncoder
+        The ColBERT model
+    _tokenizer : AutoTokenizer
+        The tokenizer of the model
+    _query_maxlen : int
+        Number of tokens of a query (padded with [MASK] tokens)
+    _doc_maxlen : int
+        Maximum number of tokens of a passage
+    _skiplist : set
+        Ids of the punctuation tokens left out of the passage embeddings
+
+    """
+
+    # Markers inserted after [CLS]: [unused0] for queries, [unused1] for passages
+    QUERY_MARKER = '[unused0]'
+    DOC_MARKER = '[unused1]'
+
+    def __init__(self, model, tokenizer, query_maxlen=32, doc_maxlen=300):
+        self._model = model.eval()
+        self._tokenizer = tokenizer
+        self._query_maxlen = query_maxlen
+        self._doc_maxlen = doc_maxlen
+        self._query_marker_id = tokenizer.convert_tokens_to_ids(self.QUERY_MARKER)
+        self._doc_marker_id = tokenizer.convert_tokens_to_ids(self.DOC_MARKER)
+        self._skiplist = {tokenizer.convert_tokens_to_ids(c) for c in string.punctuation}
+
+    def _tokenize(self, texts, marker_id, max_length, padding):
+        # Leave room for the marker inserted after [CLS]
+        inputs = self._tokenizer(
+            texts, max_length=max_length - 1, truncation=True,
+            padding=padding, return_tensors='pt')
+
+        input_ids, attention_mask = inputs['input_ids'], inputs['attention_mask']
+        markers = torch.full((input_ids.size(0), 1), marker_id, dtype=input_ids.dtype)
+
+        input_ids = torch.cat([input_ids[:, :1], markers, input_ids[:, 1:]], dim=1)
+        attention_mask = torch.cat([attention_mask[:, :1], torch.ones_like(markers), attention_mask[:, 1:]], dim=1)
+
+        return input_ids, attention_mask
+
+    def encode_query(self, query):
+        """Returns the embeddings of a query, (query_maxlen, dim)
+
+        :param query: Input query
+        :type query: str
+        :rtype: np.ndarray
+        """
+        input_ids, attention_mask = self._tokenize(
+            [query], self._query_marker_id, self._query_maxlen, 'max_length')
+
+        # Query augmentation: padding becomes [MASK] tokens the model attends to
+        input_ids[input_ids == self._tokenizer.pad_token_id] = self._tokenizer.mask_token_id
+        attention_mask = torch.ones_like(attention_mask)
+
+        with torch.no_grad():
+            return self._model(input_ids, attention_mask)[0].float().numpy()
+
+    def encode_passages(self, passages, batch_size=32):
+        """Returns the embeddings of all the tokens of all the passages,
+        without padding and punctuation, and the number of embeddings of each
+        passage
+
+        :param passages: Passages to encode
+        :type passages: list
+        :param batch_size: Number of passages per forward pass, defaults to 32
+        :type batch_size: int, optional
+        :return: Embeddings (num_embeddings, dim) and passage lengths (num_passages,)
+        :rtype: tuple
+        """
+        embeddings, doclens = [], []
+
+        # Sort by length so that every batch is padded as little as possible
+        order = sorted(range(len(passages)), key=lambda i: len(passages[i]))
+        by_passage = [None] * len(passages)
+
+        for b in range(0, len(order), batch_size):
+            batch = order[b:b + batch_size]
+            input_ids, attention_mask = self._tokenize(
+                [passages[i] for i in batch], self._doc_marker_id, self._doc_maxlen, 'longest')
+
+            with torch.no_grad():
+                batch_embeddings = self._model(input_ids, attention_mask).float().numpy()
+
+            keep = attention_mask.bool()
+            for token_id in self._skiplist:
+                keep &= input_ids != token_id
+            keep = keep.numpy()
+
+            for row, i in enumerate(batch):
+                by_passage[i] = batch_embeddings[row][keep[row]]
+
+        for passage_embeddings in by_passage:
+            embeddings.append(passage_embeddings)
+            doclens.append(len(passage_embeddings))
+
+        if len(embeddings) == 0:
+            return np.zeros((0, self._model.linear.out_features), dtype=np.float16), np.zeros(0, dtype=np.int64)
+
+        return np.concatenate(embeddings).astype(np.float16), np.asarray(doclens, dtype=np.int64)
+
+
+class ResidualCodec():
+    """
+    Compresses embeddings into the id of their nearest centroid and an n-bit
+    quantization of every dimension of their residual (embedding - centroid)
+
+
+    Attributes
+    ----------
+    centroids : np.ndarray
+        Centroids of the embeddings, (num_centroids, dim)
+    bucket_cutoffs : np.ndarray
+        Boundaries of the 2 ** nbits residual buckets, (2 ** nbits - 1,)
+    bucket_weights : np.ndarray
+        Value of the residual decoded from each bucket, (2 ** nbits,)
+    nbits : int
+        Number of bits per residual dimension (1, 2, 4 or 8)
+
+    """
+
+    def __init__(self, centroids, bucket_cutoffs, bucket_weights, nbits):
+        self.centroids = centroids
+        self.bucket_cutoffs = bucket_cutoffs
+        self.bucket_weights = bucket_weights
+        self.nbits = nbits
+
+    @classmethod
+    def train(cls, embeddings, nbits=2, num_iterations=10, sample_size=1 << 16, seed=0):
+        """Fits the centroids (spherical k-means) and the residual buckets
+
+        :param embeddings: Normalized embeddings, (num_embeddings, dim)
+        :type embeddings: np.ndarray
+        :param nbits: Number of bits per residual dimension, defaults to 2
+        :type nbits: int, optional
+        :return: The codec
+        :rtype: ResidualCodec
+        """
+        if nbits not in (1, 2, 4, 8):
+            raise ValueError(f"nbits must be 1, 2, 4 or 8, got {nbits}")
+
+        rng = np.random.default_rng(seed)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+
+        if len(embeddings) > sample_size:
+            sample = embeddings[rng.choice(len(embeddings), sample_size, replace=False)]
+        else:
+            sample = embeddings
+
+        # Same number of centroids as ColBERTv2: 2 ** floor(log2(16 * sqrt(N)))
+        num_centroids = min(len(sample), 2 ** int(np.floor(np.log2(16 * np.sqrt(len(embeddings))))))
+        centroids = sample[rng.choice(len(sample), num_centroids, replace=False)]
+
+        for _ in range(num_iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=num_centroids)
+
+            # Empty clusters keep their previous centroid
+            centroids = np.where(counts[:, None] > 0, sums, centroids)
+            centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+
+        residuals = sample - centroids[np.argmax(sample @ centroids.T, axis=1)]
+
+        # Equally populated buckets, decoded to the median of each bucket
+        num_buckets = 2 ** nbits
+        bucket_cutoffs = np.quantile(residuals, np.arange(1, num_buckets) / num_buckets)
+        bucket_weights = np.quantile(residuals, (np.arange(num_buckets) + 0.5) / num_buckets)
+
+        return cls(centroids.astype(np.float32), bucket_cutoffs.astype(np.float32),
+                   bucket_weights.astype(np.float32), nbits)
+
+    def compress(self, embeddings, batch_size=1 << 14):
+        """Returns the centroid ids and the packed residuals of embeddings
+
+        :param embeddings: Embeddings, (num_embeddings, dim)
+        :type embeddings: np.ndarray
+        :return: Codes (num_embeddings,) and packed residuals (num_embeddings, dim * nbits / 8)
+        :rtype: tuple
+        """
+        codes, residuals = [], []
+        shifts = np.arange(self.nbits - 1, -1, -1, dtype=np.uint8)
+
+        for b in range(0, len(embeddings), batch_size):
+            batch = np.asarray(embeddings[b:b + batch_size], dtype=np.float32)
+            batch_codes = np.argmax(batch @ self.centroids.T, axis=1)
+
+            buckets = np.searchsorted(
+                self.bucket_cutoffs, batch - self.centroids[batch_codes]).astype(np.uint8)
+
+            # Spread the nbits of every bucket id, then pack 8 bits per byte
+            bits = (buckets[:, :, None] >> shifts) & 1
+            residuals.append(np.packbits(bits.reshape(len(batch), -1), axis=1))
+            codes.append(batch_codes.astype(np.int32))
+
+        dim = self.centroids.shape[1]
+        if len(codes) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros((0, dim * self.nbits // 8), dtype=np.uint8)
+
+        return np.concatenate(codes), np.concatenate(residuals)
+
+    def decompress(self, codes, residuals):
+        """Returns the (normalized) embeddings of codes and packed residuals
+
+        :param codes: Centroid ids, (num_embeddings,)
+        :type codes: np.ndarray
+        :param residuals: Packed residuals, (num_embeddings, dim * nbits / 8)
+        :type residuals: np.ndarray
+        :return: Embeddings, (num_embeddings, dim)
+        :rtype: np.ndarray
+        """
+        dim = self.centroids.shape[1]
+
+        bits = np.unpackbits(residuals, axis=1).reshape(len(codes), dim, self.nbits)
+        buckets = bits @ (1 << np.arange(self.nbits - 1, -1, -1))
+
+        embeddings = self.centroids[codes] + self.bucket_weights[buckets]
+        return embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12)
+
+    def save(self, path):
+        np.save(os.path.join(path, 'centroids.npy'), self.centroids)
+        np.save(os.path.join(path, 'bucket_cutoffs.npy'), self.bucket_cutoffs)
+        np.save(os.path.join(path, 'bucket_weights.npy'), self.bucket_weights)
+
+    @classmethod
+    def load(cls, path, nbits):
+        return cls(np.load(os.path.join(path, 'centroids.npy')),
+                   np.load(os.path.join(path, 'bucket_cutoffs.npy')),
+                   np.load(os.path.join(path, 'bucket_weights.npy')),
+                   nbits)
+
+
+class LateInteractionIndex():
+    """
+    A persisted, memory-mapped index of per-token passage embeddings
+
+    With nbits set, embeddings are stored compressed (see ResidualCodec) and
+    an inverted file maps every centroid to the passages using it. A query
+    then only decompresses and scores the passages sharing a centroid with
+    one of its tokens. Without nbits, float16 embeddings are stored as is and
+    every passage is scored.
+
+
+    Attributes
+    ----------
+    collection : list of str
+        The indexed passages
+    _codec : ResidualCodec
+        Codec of the compressed embeddings, None if uncompressed
+    _embeddings : np.ndarray
+        Embeddings of all the passages (memory mapped), (num_embeddings, dim)
+    _codes, _residuals : np.ndarray
+        Compressed embeddings of all the passages (memory mapped)
+    _ivf, _ivf_offsets : np.ndarray
+        Passage ids of every centroid, CSR layout
+    _doclens, _offsets : np.ndarray
+        Number of embeddings and index of the first embedding of every passage
+
+    Methods
+    -------
+    build(cls, path, passages, encoder, nbits=2):
+        Encodes (and compresses) the passages and writes the index to path.
+
+    load(cls, path):
+        Memory maps an index written by build.
+
+    search(self, query, k=3):
+        Returns the ids, ranks and scores of the best k passages.
+
+    """
+
+    def __init__(self, path, encoder=None, ncells=2):
+        self.path = path
+        self._encoder = encoder
+        self._ncells = ncells
+
+        with open(os.path.join(path, 'metadata.json')) as f:
+            self.metadata = json.load(f)
+        with open(os.path.join(path, 'collection.json')) as f:
+            self.collection = json.load(f)
+
+        self._doclens = np.load(os.path.join(path, 'doclens.npy'))
+        self._offsets = np.concatenate([[0], np.cumsum(self._doclens)[:-1]]).astype(np.int64)
+
+        if self.metadata.get('nbits'):
+            self._codec = ResidualCodec.load(path, self.metadata['nbits'])
+            self._codes = np.load(os.path.join(path, 'codes.npy'), mmap_mode='r')
+            self._residuals = np.load(os.path.join(path, 'residuals.npy'), mmap_mode='r')
+            self._ivf = np.load(os.path.join(path, 'ivf.npy'), mmap_mode='r')
+            self._ivf_offsets = np.load(os.path.join(path, 'ivf_offsets.npy'))
+        else:
+            self._codec = None
+            self._embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+
+    @staticmethod
+    def exists(path):
+        """Returns whether a complete index was written to path"""
+        return os.path.exists(os.path.join(path, 'metadata.json'))
+
+    @classmethod
+    def build(cls, path, passages, encoder, nbits=2, batch_size=32):
+        """Encodes the passages and writes the index to path
+
+        :param path: Directory of the index
+        :type path: str
+        :param passages: Passages to index
+        :type passages: list
+        :param encoder: Encoder of the passages
+        :type encoder: LateInteractionEncoder
+        :param nbits: Bits per dimension of the compressed residuals, None to
+            store uncompressed float16 embeddings, defaults to 2
+        :type nbits: int, optional
+        :return: The index
+        :rtype: LateInteractionIndex
+        """
+        passages = list(passages)
+        embeddings, doclens = encoder.encode_passages(passages, batch_size)
+
+        # Written next to the final directory, then renamed, so that an
+        # interrupted build never leaves a partial index behind
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'doclens.npy'), doclens)
+
+        if nbits and len(embeddings) > 0:
+            codec = ResidualCodec.train(embeddings, nbits)
+            codes, residuals = codec.compress(embeddings)
+
+            # Inverted file: centroid -> ids of the passages with an embedding in it
+            pids = np.repeat(np.arange(len(passages)), doclens)
+            pairs = np.unique(codes.astype(np.int64) * len(passages) + pids)
+            ivf_offsets = np.zeros(len(codec.centroids) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(pairs // len(passages), minlength=len(codec.centroids)), out=ivf_offsets[1:])
+
+            codec.save(tmp_path)
+            np.save(os.path.join(tmp_path, 'codes.npy'), codes)
+            np.save(os.path.join(tmp_path, 'residuals.npy'), residuals)
+            np.save(os.path.join(tmp_path, 'ivf.npy'), (pairs % len(passages)).astype(np.int32))
+            np.save(os.path.join(tmp_path, 'ivf_offsets.npy'), ivf_offsets)
+
+            index_bytes = codes.nbytes + residuals.nbytes + codec.centroids.nbytes
+        else:
+            nbits = None
+            np.save(os.path.join(tmp_path, 'embeddings.npy'), embeddings)
+
+            index_bytes = embeddings.nbytes
+
+        with open(os.path.join(tmp_path, 'collection.json'), 'w') as f:
+            json.dump(passages, f)
+        with open(os.path.join(tmp_path, 'metadata.json'), 'w') as f:
+            json.dump({
+                'num_passages': len(passages),
+                'num_embeddings': int(embeddings.shape[0]),
+                'dim': int(embeddings.shape[1]),
+                'nbits': nbits}, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+        print(f"(LateInteractionIndex) > {embeddings.shape[0]} embeddings stored in "
+              f"{index_bytes / 1e6:.2f} MB (float16: {embeddings.nbytes / 1e6:.2f} MB)")
+
+        return cls(path, encoder)
+
+    @classmethod
+    def load(cls, path, encoder=None):
+        """Memory maps an index written by build"""
+        return cls(path, encoder)
+
+    def _lookup(self, rows):
+        """Returns the float32 embeddings of the given rows (decompressed if needed)"""
+        if self._codec is None:
+            return np.asarray(self._embeddings[rows], dtype=np.float32)
+
+        return self._codec.decompress(
+            np.asarray(self._codes[rows]), np.asarray(self._residuals[rows])).astype(np.float32)
+
+    def candidates(self, query_embeddings):
+        """Returns the ids of the passages sharing one of the ncells nearest
+        centroids of any query token (all passages if uncompressed)
+
+        :param query_embeddings: Embeddings of the query, (query_len, dim)
+        :type query_embeddings: np.ndarray
+        :rtype: np.ndarray
+        """
+        if self._codec is None:
+            return np.arange(len(self._doclens))
+
+        ncells = min(self._ncells, len(self._codec.centroids))
+        cells = np.argpartition(-(query_embeddings @ self._codec.centroids.T), ncells - 1, axis=1)[:, :ncells]
+        cells = np.unique(cells)
+
+        return np.unique(np.concatenate(
+            [self._ivf[self._ivf_offsets[c]:self._ivf_offsets[c + 1]] for c in cells]))
+
+    def score(self, query_embeddings, pids=None, chunk_size=1024):
+        """Returns the MaxSim score of passages for a query
+
+        :param query_embeddings: Embeddings of the query, (query_len, dim)
+        :type query_embeddings: np.ndarray
+        :param pids: Ids of the passages to score, defaults to all of them
+        :type pids: np.ndarray, optional
+        :param chunk_size: Number of passages scored at once, defaults to 1024
+        :type chunk_size: int, optional
+        :return: Scores, (len(pids),)
+        :rtype: np.ndarray
+        """
+        if pids is None:
+            pids = np.arange(len(self._doclens))
+
+        scores = np.empty(len(pids), dtype=np.float32)
+
+        # Only the embeddings of chunk_size passages are read at once
+        for start in range(0, len(pids), chunk_size):
+            chunk = pids[start:start + chunk_size]
+            doclens = self._doclens[chunk]
+
+            # Rows of the embeddings of every passage of the chunk
+            local_offsets = np.concatenate([[0], np.cumsum(doclens)[:-1]])
+            rows = np.repeat(self._offsets[chunk] - local_offsets, doclens) + np.arange(doclens.sum())
+
+            # Similarity of every passage token with every query token
+            similarities = self._lookup(rows) @ query_embeddings.T
+
+            # Max over the tokens of each passage, then sum over the query tokens
+            scores[start:start + chunk_size] = np.maximum.reduceat(
+                similarities, local_offsets, axis=0).sum(axis=1)
+
+        return scores
+
+    def search(self, query, k=3):
+        """Returns the best k passages for a query
+
+        :param query: Input query
+        :type query: str
+        :param k: Number of passages, defaults to 3
+        :type k: int, optional
+        :return: Passage ids, ranks and scores
+        :rtype: tuple
+        """
+        query_embeddings = self._encoder.encode_query(query)
+
+        pids = self.candidates(query_embeddings)
+        scores = self.score(query_embeddings, pids)
+
+        k = min(k, len(scores))
+        if k == 0:
+            return [], [], []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return pids[top].tolist(), list(range(1, k + 1)), scores[top].tolist()
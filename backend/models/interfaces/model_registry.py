@@ -0,0 +1,229 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+====================================================
+Model Registry
+====================================================
+This module provides a process-wide registry of loaded models and tokenizers.
+
+Models are keyed by their checkpoint and loading options (dtype, runtime...)
+so that every object of the dashboard asking for the same weights shares a
+single instance. The registry keeps track of the memory held by each model
+and evicts the least recently used ones once a memory budget is exceeded.
+
+Only models that no other object references are evicted: evicting a model
+still held by a search or summarization object (ElasticBERT.model,
+Bart._model...) would free no memory, and the next request for it would
+load a second copy. The budget therefore bounds the memory of the models
+loaded but no longer used; models in use are kept even beyond it.
+
+"""
+
+import collections
+import gc
+import threading
+import weakref
+
+from backend.models.interfaces.quantization import load_quantized
+
+
+def get_memory_footprint(obj):
+    """Returns the number of bytes held by the parameters and buffers of a model
+
+    :param obj: A model (torch.nn.Module) or any other object (tokenizer...)
+    :type obj: object
+    :return: Memory footprint in bytes, 0 if it cannot be computed
+    :rtype: int
+    """
+    if not callable(getattr(obj, 'parameters', None)):
+        return 0
+
+    n_bytes = sum(p.nelement() * p.element_size() for p in obj.parameters())
+    if callable(getattr(obj, 'buffers', None)):
+        n_bytes += sum(b.nelement() * b.element_size() for b in obj.buffers())
+
+    # The int8 weights of quantized layers are packed outside of the parameters
+    if callable(getattr(obj, 'modules', None)):
+        for module in obj.modules():
+            if hasattr(module, '_packed_params') and callable(getattr(module, 'weight', None)):
+                n_bytes += module.weight().nelement() * module.weight().element_size()
+
+    return n_bytes
+
+
+class ModelRegistry():
+    """
+    A registry sharing loaded models between all the objects of the process
+
+
+    Attributes
+    ----------
+    _memory_budget : int
+        Maximum number of bytes of models to keep loaded, None for no limit
+    _entries : OrderedDict
+        Loaded objects and their footprint, from least to most recently used
+    _load_locks : dict
+        One lock per key so that a model is only loaded once
+
+    Methods
+    -------
+    get(self, key, loader):
+        Returns the object registered under key, loading it if needed.
+
+    from_pretrained(self, auto_class, checkpoint, **kwargs):
+        Returns a shared HuggingFace model or tokenizer.
+
+    """
+
+    def __init__(self, memory_budget=None):
+        self._memory_budget = memory_budget
+        self._entries = collections.OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def set_memory_budget(self, memory_budget):
+        """Sets the memory budget and evicts models until it is respected
+
+        :param memory_budget: Maximum number of bytes of loaded models, None for no limit
+        :type memory_budget: int
+        """
+        with self._lock:
+            self._memory_budget = memory_budget
+            self._evict()
+
+    def get(self, key, loader):
+        """Returns the object registered under key, calling loader() to load it
+        on the first request
+
+        :param key: Hashable key identifying the object (checkpoint, options...)
+        :type key: tuple
+        :param loader: Function loading the object
+        :type loader: callable
+        :return: The shared object
+        :rtype: object
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]['obj']
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have loaded it while we were waiting
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key]['obj']
+
+            obj = loader()
+
+            with self._lock:
+                self._entries[key] = {
+                    'obj': obj, 'n_bytes': get_memory_footprint(obj)}
+                self._load_locks.pop(key, None)
+                self._evict(keep=key)
+
+        return obj
+
+    def from_pretrained(self, auto_class, checkpoint, quantize=False, **kwargs):
+        """Returns a shared instance of auto_class.from_pretrained(checkpoint, **kwargs)
+
+        :param auto_class: HuggingFace class (AutoTokenizer, AutoModelForQuestionAnswering...)
+        :type auto_class: type
+        :param checkpoint: Name or path of the checkpoint
+        :type checkpoint: str
+        :param quantize: Whether to load the int8 (dynamically quantized) model, defaults to False
+        :type quantize: bool, optional
+        :return: The shared model or tokenizer
+        :rtype: object
+        """
+        key = (auto_class.__name__, checkpoint,
+               tuple(sorted((k, str(v)) for k, v in kwargs.items())))
+
+        if quantize:
+            return self.get(key + ('int8',), lambda: load_quantized(auto_class, checkpoint, **kwargs))
+
+        return self.get(key, lambda: auto_class.from_pretrained(checkpoint, **kwargs))
+
+    def evict(self, key):
+        """Removes an object from the registry
+
+        :param key: Key of the object
+        :type key: tuple
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def memory_usage(self):
+        """Returns the number of bytes held by the registered models
+
+        :return: Memory usage in bytes
+        :rtype: int
+        """
+        with self._lock:
+            return sum(entry['n_bytes'] for entry in self._entries.values())
+
+    def _evict(self, keep=None):
+        """Evicts the least recently used objects until the memory budget is
+        respected (must be called with _lock held)"""
+        if self._memory_budget is None:
+            return
+
+        total = sum(entry['n_bytes'] for entry in self._entries.values())
+        for key in list(self._entries):
+            if total <= self._memory_budget:
+                break
+            # Tokenizers and the object just loaded are kept
+            if key == keep or self._entries[key]['n_bytes'] == 0:
+                continue
+
+            # Models still used by other objects are kept
+            if self._release(key):
+                entry = self._entries.pop(key)
+                total -= entry['n_bytes']
+                print(f"(ModelRegistry) > Evicted {key} ({entry['n_bytes'] / 1e6:.0f} MB)")
+
+        if total > self._memory_budget:
+            print(f"(ModelRegistry) > {total / 1e6:.0f} MB of models in use, "
+                  f"above the budget of {self._memory_budget / 1e6:.0f} MB")
+
+    def _release(self, key):
+        """Drops the reference of the registry to an object, and returns
+        whether that freed it; the reference is restored when another
+        object still holds it (must be called with _lock held)"""
+        entry = self._entries[key]
+        try:
+            ref = weakref.ref(entry['obj'])
+        except TypeError:
+            return False
+
+        del entry['obj']
+        if ref() is not None:
+            # Models may hold reference cycles
+            gc.collect()
+
+        obj = ref()
+        if obj is not None:
+            entry['obj'] = obj
+            return False
+
+        return True
+
+
+# Registry shared by every model of the process
+model_registry = ModelRegistry()
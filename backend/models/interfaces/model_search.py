@@ -17,17 +17,22 @@
 
 
 import re
+import bisect
+import copy
 import torch
-import traceback
 import collections
+import hashlib
+import threading
 import numpy as np
 import json
 import os
+import time
 from elasticsearch import RequestsHttpConnection
 from elasticsearch import Elasticsearch
-from email.parser import Parser
-from transformers import pipeline
+from elasticsearch import helpers
 from backend.datasets.search import Squad
+from backend.models.interfaces.bm25 import BM25Retriever
+from backend.models.interfaces.batching import MicroBatcher
 from flask_socketio import send, emit
 class ModelSearch():
 
@@ -51,6 +56,81 @@ class ModelSearch():
     def _get_class_name(self):
         return self._info['class_name']
 
+    def _get_document_key(self):
+        """Returns the content hash of the loaded document, None if no document is loaded"""
+        return getattr(self, 'index_name', None)
+
+    def _select_passages(self, question, passages):
+        """Keeps the passages that go through the reader: the reader_top_k
+        best ones according to the reranker if the model has one, else the
+        reader_top_k first retrieved ones
+
+        :param question: Input question
+        :type question: str
+        :param passages: Retrieved passages, best first
+        :type passages: list
+        :return: Selected passages, best first
+        :rtype: list
+        """
+        reranker = getattr(self, 'reranker', None)
+        top_k = getattr(self, 'reader_top_k', None)
+
+        if reranker is not None:
+            return [passages[i] for i, _ in reranker.rerank(question, passages, top_k)]
+
+        return passages[:top_k] if top_k else passages
+
+    def _start_reader_queue(self, max_batch_size=8, max_wait=0.005):
+        """Groups the reader calls of concurrent searches into batches
+
+        :param max_batch_size: Maximum number of searches per batch, defaults to 8 (1 disables batching)
+        :type max_batch_size: int, optional
+        :param max_wait: Maximum number of seconds a search waits for others, defaults to 0.005
+        :type max_wait: float, optional
+        """
+        if max_batch_size <= 1 or getattr(self, '_reader_queue', None) is not None:
+            return
+
+        self._reader_queue = MicroBatcher(
+            self._read_batch, max_batch_size, max_wait, name=f"{self._get_class_name()}-reader")
+
+    def _read(self, question, passages):
+        """Extracts the answer to a question from the retrieved passages,
+        through the reader queue if batching is enabled
+
+        :param question: Input question
+        :type question: str
+        :param passages: Retrieved passages
+        :type passages: list
+        :return: One (answer, beg, end) tuple per passage
+        :rtype: list
+        """
+        reader_queue = getattr(self, '_reader_queue', None)
+        if reader_queue is None:
+            return answer_questions(question, passages, self.model, self.tokenizer)
+
+        return reader_queue.submit((question, list(passages)))
+
+    def _read_batch(self, requests):
+        """Runs the (question, passages) requests of several searches through
+        the reader at once"""
+        questions = [q for q, passages in requests for _ in passages]
+        passages = [p for _, passages in requests for p in passages]
+
+        answers = answer_questions(questions, passages, self.model, self.tokenizer)
+
+        results, i = [], 0
+        for _, request_passages in requests:
+            results.append(answers[i:i + len(request_passages)])
+            i += len(request_passages)
+
+        return results
+
+    def _get_reader_stats(self):
+        """Returns the metrics of the reader queue, None if batching is disabled"""
+        reader_queue = getattr(self, '_reader_queue', None)
+        return None if reader_queue is None else reader_queue.stats()
+
     @classmethod
     def _parse_raw_ans(self, res, time):
 
@@ -69,8 +149,9 @@ This file contains several helper functions utilized by the ASKI dashboard.
 All functions (as well as their descriptions) are listed below: 
 
     answer_question(question, answer_text, model, tokenizer) - internal 
+    answer_questions(question, answer_texts, model, tokenizer) - batched reader, internal 
     dedup(hits) - returns list of potential hits in document, internal 
-    summarize_answer(candidate_docs, summarized=None) - summarizer, internal 
+    summarize_answer(candidate_docs, summarizer=None) - batched summarizer, internal 
 
 """
 
@@ -83,85 +164,159 @@ Internal helper function used by BERT/ColBERT
 
 
 def answer_question(question, answer_text, model, tokenizer):
-    #global model, tokenizer
-
-    input_ids = tokenizer.encode(
-        question, answer_text, max_length=512, truncation=True)
-
-    # ======== Set Segment IDs ========
-    # Search the input_ids for the first instance of the `[SEP]` token.
-    sep_index = input_ids.index(tokenizer.sep_token_id)
-
-    # The number of segment A tokens includes the [SEP] token istelf.
-    num_seg_a = sep_index + 1
-
-    # The remainder are segment B.
-    num_seg_b = len(input_ids) - num_seg_a
-
-    # Construct the list of 0s and 1s.
-    segment_ids = [0]*num_seg_a + [1]*num_seg_b
-
-    # There should be a segment_id for every input token.
-    assert len(segment_ids) == len(input_ids)
-
-    outputs = model(torch.tensor([input_ids]),  # The tokens representing our input text.
-                    # The segment IDs to differentiate question from answer_text
-                    token_type_ids=torch.tensor([segment_ids]),
-                    return_dict=True)
-
-    start_scores = outputs.start_logits
-    end_scores = outputs.end_logits
-
-    # ======== Reconstruct Answer ========
-    # Find the tokens with the highest `start` and `end` scores.
-    answer_start = torch.argmax(start_scores)
-    answer_end = torch.argmax(end_scores)
-
-    # Get the string versions of the input tokens.
-    tokens = tokenizer.convert_ids_to_tokens(input_ids)
-
-    # Start with the first token.
-    answer = tokens[answer_start]
-    # print(tokens)
-    beg, end = tokens[0], tokens[answer_end+1]
-    # Select the remaining answer tokens and join them with whitespace.
-    for i in range(answer_start+1, answer_end+1):
-       # print(f'{i},{tokens[i]}')
-        # If it's a subword token, then recombine it with the previous token.
-        if len(tokens[i]) > 2 and tokens[i][0:2] == '##':
-            if 0 < i < answer_start:
-                beg += tokens[i][2:]
-            elif answer_start < i < answer_end+1:
-                answer += tokens[i][2:]
-            elif answer_end+1 < i:
-                end += tokens[i][2:]
-
-        # Otherwise, add a space then the token.
-        else:
-            if 0 < i < answer_start:
-                beg += ' ' + tokens[i]
-            elif answer_start < i < answer_end+1:
-                if tokens[i] in [',', '.', ':']:
-                    answer += tokens[i]
-                else:
-                    answer += ' ' + tokens[i]
-            elif answer_end+1 < i:
-                end += ' ' + tokens[i]
-
-    print('Answer: "' + answer + '"')
-    if answer == "[CLS]":
-        answer, beg, end = '', '', ''
-    else:
-        m = re.search(answer, answer_text, re.IGNORECASE)
-        if m:
-            beg = answer_text[:m.start()]
-            answer = answer_text[m.start():m.end()]
-            end = answer_text[m.end()+1:]
+    """Extracts the answer to a question from a single passage
+
+    :param question: Input question
+    :type question: str
+    :param answer_text: Passage to extract the answer from
+    :type answer_text: str
+    :return: Answer, text before the answer and text after the answer
+    :rtype: tuple
+    """
+    return answer_questions(question, [answer_text], model, tokenizer)[0]
+
+
+def answer_questions(question, answer_texts, model, tokenizer, max_length=512, stride=128,
+                     batch_size=16, max_answer_length=30, allow_null_answer=False):
+    """Extracts the answer to a question from several passages at once
+
+    All (question, passage) pairs are tokenized together with dynamic padding
+    (padded to the longest pair of the batch only) and go through the reader
+    in batched forward passes, instead of one forward pass per passage.
+
+    Passages that do not fit in ``max_length`` tokens are split into
+    overlapping windows (sharing ``stride`` tokens) rather than truncated,
+    and the best span across all the windows of a passage is kept.
+
+    Answers are sliced out of the passage with the character offsets of the
+    tokenizer, which therefore has to be a fast (Rust) tokenizer.
+
+    Like the single-passage reader, the best span of a passage is returned
+    even when the reader scores the null ([CLS]) answer higher, unless
+    ``allow_null_answer`` is set (SQuAD 2.0 style "no answer").
+
+    :param question: Input question, or one question per passage
+    :type question: str or list
+    :param answer_texts: Passages to extract the answer from
+    :type answer_texts: list
+    :param max_length: Maximum number of tokens of a (question, passage) window, defaults to 512
+    :type max_length: int, optional
+    :param stride: Number of overlapping tokens between two windows of a passage, defaults to 128
+    :type stride: int, optional
+    :param batch_size: Maximum number of windows per forward pass, defaults to 16
+    :type batch_size: int, optional
+    :param max_answer_length: Maximum number of tokens of an answer, defaults to 30
+    :type max_answer_length: int, optional
+    :param allow_null_answer: Whether a passage whose null answer scores better than its
+        best span gets no answer, defaults to False
+    :type allow_null_answer: bool, optional
+    :return: One (answer, beg, end) tuple per passage, ('', '', '') if no answer was found
+    :rtype: list
+    """
+    answer_texts = list(answer_texts)
+    if len(answer_texts) == 0:
+        return []
+
+    questions = [question] * len(answer_texts) if isinstance(question, str) else list(question)
+
+    inputs = tokenizer(
+        questions, answer_texts,
+        max_length=max_length,
+        stride=stride,
+        truncation='only_second',
+        return_overflowing_tokens=True,
+        return_offsets_mapping=True,
+        padding='longest',
+        return_tensors='pt')
+
+    # Window index -> passage index
+    sample_mapping = inputs.pop('overflow_to_sample_mapping').tolist()
+    # Token index -> (start, end) character offsets in the passage
+    offset_mapping = inputs.pop('offset_mapping')
+    num_windows = len(sample_mapping)
+
+    # Only tokens of the passage (segment B) can be part of an answer
+    context_mask = torch.tensor(
+        [[s == 1 for s in inputs.sequence_ids(i)] for i in range(num_windows)])
+
+    starts, ends, scores, null_scores = [], [], [], []
+    for b in range(0, num_windows, batch_size):
+        # Trim the padding of the batch down to its own longest window
+        seq_len = int(inputs['attention_mask'][b:b + batch_size].sum(dim=1).max())
+        batch = {k: v[b:b + batch_size, :seq_len] for k, v in inputs.items()}
+
+        with torch.no_grad():
+            outputs = model(**batch, return_dict=True)
+
+        b_starts, b_ends, b_scores, b_null_scores = _best_spans(
+            outputs.start_logits, outputs.end_logits,
+            context_mask[b:b + batch_size, :seq_len], max_answer_length)
+
+        starts += b_starts
+        ends += b_ends
+        scores += b_scores
+        null_scores += b_null_scores
+
+    # Keep the best window of every passage
+    best_windows = {}
+    passage_null_scores = {}
+    for w, i in enumerate(sample_mapping):
+        if i not in best_windows or scores[w] > scores[best_windows[i]]:
+            best_windows[i] = w
+        passage_null_scores[i] = min(
+            null_scores[w], passage_null_scores.get(i, null_scores[w]))
+
+    results = []
+    for i, answer_text in enumerate(answer_texts):
+        w = best_windows[i]
+
+        # The [CLS] (null) answer scores better than any span of the passage
+        if allow_null_answer and passage_null_scores[i] > scores[w]:
+            results.append(('', '', ''))
+            continue
+
+        # Slice the answer directly out of the passage
+        char_start = int(offset_mapping[w, starts[w], 0])
+        char_end = int(offset_mapping[w, ends[w], 1])
+        results.append((answer_text[char_start:char_end],
+                        answer_text[:char_start],
+                        answer_text[char_end:]))
+
+    return results
+
 
-    return answer, beg, end
+def _best_spans(start_logits, end_logits, context_mask, max_answer_length):
+    """Finds the best scoring answer span of every row of a batch of reader outputs
 
+    :param start_logits: Start logits of the reader, (batch, seq_len)
+    :type start_logits: torch.Tensor
+    :param end_logits: End logits of the reader, (batch, seq_len)
+    :type end_logits: torch.Tensor
+    :param context_mask: True for the tokens that may be part of an answer, (batch, seq_len)
+    :type context_mask: torch.Tensor
+    :param max_answer_length: Maximum number of tokens of an answer
+    :type max_answer_length: int
+    :return: Start indices, end indices, span scores and null ([CLS]) scores
+    :rtype: tuple
+    """
+    seq_len = start_logits.size(1)
 
+    null_scores = (start_logits[:, 0] + end_logits[:, 0]).tolist()
 
+    start_logits = start_logits.masked_fill(~context_mask, -1e4)
+    end_logits = end_logits.masked_fill(~context_mask, -1e4)
+
+    # scores[b, s, e] = start_logits[b, s] + end_logits[b, e], for s <= e < s + max_answer_length
+    scores = start_logits[:, :, None] + end_logits[:, None, :]
+    band = torch.ones(seq_len, seq_len, dtype=torch.bool).triu().tril(max_answer_length - 1)
+    scores = scores.masked_fill(~band, -1e4)
+
+    best_scores, best = scores.view(scores.size(0), -1).max(dim=-1)
+
+    starts = (best // seq_len).tolist()
+    ends = (best % seq_len).tolist()
+
+    return starts, ends, best_scores.tolist(), null_scores
 
 
 def dedup(hits):
@@ -178,19 +333,33 @@ def dedup(hits):
 
 
 
-def summarize_answer(candidate_docs, summarizer=None):
-    """Summarized answer found in candidate documents """
-    
-    if summarizer is None:
-        summarizer = pipeline("summarization")
-    sum_docs = []
-    for doc in candidate_docs:
-        if len(doc) > 300:
-            doc = doc[:300]
-        sum_docs.append(summarizer(
-            doc, min_length=min(len(doc), 50), max_length=min(len(doc), 300)))
+def summarize_answer(candidate_docs, summarizer=None, max_input_tokens=300, min_summary_tokens=10,
+                     max_summary_tokens=60):
+    """Summarizes the candidate documents of a search with one batched
+    generate call of an already loaded summarization model
 
-    return sum_docs
+    :param candidate_docs: Passages to summarize
+    :type candidate_docs: list
+    :param summarizer: Summarization model of the server (Bart, T5...), defaults to None (no summaries)
+    :type summarizer: HuggingFaceModelSummarization, optional
+    :param max_input_tokens: Passages are truncated to this number of tokens, defaults to 300
+    :type max_input_tokens: int, optional
+    :param min_summary_tokens: Minimum number of tokens of a summary, defaults to 10
+    :type min_summary_tokens: int, optional
+    :param max_summary_tokens: Maximum number of tokens of a summary, defaults to 60
+    :type max_summary_tokens: int, optional
+    :return: One summary per passage
+    :rtype: list
+    """
+    candidate_docs = list(candidate_docs)
+    if summarizer is None or len(candidate_docs) == 0:
+        return [''] * len(candidate_docs)
+
+    return summarizer._summarize_texts(
+        candidate_docs,
+        max_input_length=max_input_tokens,
+        min_length=min_summary_tokens,
+        max_length=max_summary_tokens)
 
 
 """
@@ -200,13 +369,22 @@ This file contains several helper functions utilized by the ASKI dashboard.
 All functions (as well as their descriptions) are listed below: 
 
     create_index() - cleans up index, creates fresh new one 
+    content_index_name(content) - name of the index of a document (content hash) 
+    index_is_complete(index_name) - whether an index was fully ingested 
+    mark_index_complete(index_name, num_docs) - records completed ingestion 
+    garbage_collect_indices() - deletes the oldest content-addressed indices 
     putMapping() - puts mapping, returns config dictionary 
     index_into_elasticsearch(contents) - indexes inputted document 
+    bulk_index_into_elasticsearch(docs) - indexes documents with the bulk API 
     basic_search(query) - converts english question into search query
     search(query) - performs a search, returns results
+    ElasticRetriever - retrieval backend of the search models (Elasticsearch)
+    get_retriever(name) - returns the 'elastic' or 'bm25' retrieval backend
+    index_lifecycle - tracks index generations, refreshes only stale indices
     print_index_dump(query) - helper function, verbose print
 
     segement_documents(doc, doc_max_length=300) - splits document into chunks
+    iter_segments(docs, tokenizer) - lazily splits documents into overlapping, token-bounded chunks
 
 
 A reference: http://praveendiary.blogspot.com/2014/10/elastic-search-experimentation-with.html
@@ -219,26 +397,182 @@ A reference: http://praveendiary.blogspot.com/2014/10/elastic-search-experimenta
 INDEX_NAME = 'text_file_search'
 es = Elasticsearch(hosts=[{'host': 'localhost', 'port': 9200, 'scheme': 'http'}],
                    verify_certs=False, timeout=60, connection_class=RequestsHttpConnection)
-p = Parser()
-count = 0
+
+# How ingested documents are made searchable:
+#   'ingest'   - refresh disabled during ingestion, one refresh once it completes (default)
+#   'wait_for' - every bulk request waits for the next scheduled refresh (near-real-time)
+#   'interval' - Elasticsearch refreshes on its own interval, searches only refresh
+#                if the index changed since the last refresh
+REFRESH_POLICIES = ['ingest', 'wait_for', 'interval']
 
 
+class IndexLifecycle():
+    """Tracks, for every index, the generation of the data written into it and
+    the generation made searchable by the last refresh, so that searches only
+    refresh an index whose content changed"""
 
-def create_index():
+    def __init__(self, refresh_policy='ingest'):
+        self.refresh_policy = refresh_policy
+        self._generations = {}
+        self._ready_generations = {}
+        self._lock = threading.Lock()
+
+    def set_refresh_policy(self, refresh_policy):
+        if refresh_policy not in REFRESH_POLICIES:
+            raise ValueError(f"Unknown refresh policy '{refresh_policy}', expected one of {REFRESH_POLICIES}")
+        self.refresh_policy = refresh_policy
+
+    def generation(self, index):
+        """Returns the generation of the data written into index"""
+        return self._generations.get(index, 0)
+
+    def is_ready(self, index):
+        """Returns whether everything written into index is searchable"""
+        return self._ready_generations.get(index, 0) == self.generation(index)
+
+    def bump(self, index):
+        """Records that the content of index changed, returns the new generation"""
+        with self._lock:
+            self._generations[index] = self.generation(index) + 1
+            return self._generations[index]
+
+    def mark_ready(self, index, generation):
+        """Records that generation of index has been made searchable"""
+        with self._lock:
+            self._ready_generations[index] = max(
+                generation, self._ready_generations.get(index, 0))
+
+    def refresh(self, index):
+        """(Elastic) Refreshes index and marks its current generation ready"""
+        generation = self.generation(index)
+        es.indices.refresh(index=index)
+        self.mark_ready(index, generation)
+
+    def wait_ready(self, index):
+        """(Elastic) Refreshes index only if its generation changed since the last refresh"""
+        if not self.is_ready(index):
+            self.refresh(index)
+
+    def forget(self, index):
+        """Drops the generations of a deleted index"""
+        with self._lock:
+            self._generations.pop(index, None)
+            self._ready_generations.pop(index, None)
+
+
+index_lifecycle = IndexLifecycle()
+
+
+
+def create_index(index_name=INDEX_NAME):
     """(Elastic) Cleans up the index if exists & then creates a fresh index
+
+    :param index_name: Name of the index, defaults to INDEX_NAME
+    :type index_name: str, optional
     """    
 
-    if es.indices.exists(index=INDEX_NAME):
-        es.indices.delete(index=INDEX_NAME)
-        print('DELETED EXISTING INDEX \'{}\' to create new one '.format(INDEX_NAME))
+    if es.indices.exists(index=index_name):
+        es.indices.delete(index=index_name)
+        index_lifecycle.forget(index_name)
+        print('DELETED EXISTING INDEX \'{}\' to create new one '.format(index_name))
     config = putMapping()
-    result = es.indices.create(index=INDEX_NAME, body=config, ignore=400)
+    result = es.indices.create(index=index_name, body=config, ignore=400)
 
     return
 
 
 
 
+def content_index_name(content, **settings):
+    """(Elastic) Returns the name of the index holding a document, derived from
+    a hash of its content and of the settings used to segment it
+
+    :param content: Content of the document
+    :type content: str
+    :return: Index name (INDEX_NAME-<hash>)
+    :rtype: str
+    """    
+    digest = hashlib.sha1(content.encode('utf-8'))
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+
+    return '{}-{}'.format(INDEX_NAME, digest.hexdigest()[:16])
+
+
+
+
+def index_is_complete(index_name):
+    """(Elastic) Returns whether an index exists and was fully ingested
+
+    :param index_name: Name of the index
+    :type index_name: str
+    :rtype: bool
+    """    
+    if not es.indices.exists(index=index_name):
+        return False
+
+    mapping = es.indices.get_mapping(index=index_name)[index_name]['mappings']
+    return mapping.get('_meta', {}).get('complete', False)
+
+
+
+
+def mark_index_complete(index_name, num_docs):
+    """(Elastic) Records in the mapping of an index that its ingestion completed
+
+    :param index_name: Name of the index
+    :type index_name: str
+    :param num_docs: Number of indexed documents
+    :type num_docs: int
+    """    
+    es.indices.put_mapping(index=index_name, body={
+        '_meta': {'complete': True, 'num_docs': num_docs}})
+
+
+
+
+def garbage_collect_indices(max_indices=10, max_age=None, keep=()):
+    """(Elastic) Deletes the oldest content-addressed indices, keeping at most
+    max_indices of them, none older than max_age
+
+    :param max_indices: Maximum number of indices to keep, defaults to 10
+    :type max_indices: int, optional
+    :param max_age: Maximum age of an index in seconds, defaults to None (no limit)
+    :type max_age: int, optional
+    :param keep: Names of indices never to delete (in use), defaults to ()
+    :type keep: iterable, optional
+    :return: Names of the deleted indices
+    :rtype: list
+    """    
+    indices = es.indices.get(index='{}-*'.format(INDEX_NAME))
+    creation_dates = {
+        index: int(info['settings']['index']['creation_date']) / 1000
+        for index, info in indices.items()}
+
+    now = time.time()
+    deleted = []
+
+    # The indices in use count against max_indices first, then from the most
+    # recent to the oldest index
+    keep = set(keep)
+    ranked = sorted(creation_dates, key=lambda index: (index in keep, creation_dates[index]), reverse=True)
+    for rank, index in enumerate(ranked):
+        if index in keep:
+            continue
+
+        too_many = max_indices is not None and rank >= max_indices
+        too_old = max_age is not None and now - creation_dates[index] > max_age
+
+        if too_many or too_old:
+            es.indices.delete(index=index)
+            index_lifecycle.forget(index)
+            deleted.append(index)
+            print('DELETED STALE INDEX \'{}\''.format(index))
+
+    return deleted
+
+
+
+
 def putMapping():
     """(Elastic) Puts new mapping and returns config dictionary 
 
@@ -272,37 +606,109 @@ def putMapping():
 
 
 
-def index_into_elasticsearch(contents):
+def index_into_elasticsearch(contents, index_name=INDEX_NAME):
     """(Elastic) Indexes into elasticsearh given the current document 
 
     :param contents: input the content of current document
     :type contents: str
+    :param index_name: Name of the index, defaults to INDEX_NAME
+    :type index_name: str, optional
     """    
-    global count
-    msg = p.parsestr(contents)
-    jsonMapDoc = {}
+    bulk_index_into_elasticsearch([contents], index_name)
+    return
 
-    jsonMapDoc["text"] = contents
+
+
+
+def bulk_index_into_elasticsearch(docs, index_name=INDEX_NAME, chunk_size=500, thread_count=1, max_retries=5, initial_backoff=2):
+    """(Elastic) Indexes all the given documents with the bulk API 
+
+    With the default 'ingest' refresh policy, refresh is turned off while
+    loading and the index is refreshed once at the end (see
+    REFRESH_POLICIES for the near-real-time alternatives). Documents
+    rejected by Elasticsearch (e.g. 429 Too Many Requests) are retried with
+    an exponential backoff, other failures are reported per document instead
+    of stopping the ingestion.
+
+    :param docs: Documents (segments) to index, can be a generator
+    :type docs: iterable
+    :param index_name: Name of the index, defaults to INDEX_NAME
+    :type index_name: str, optional
+    :param chunk_size: Number of documents sent per bulk request, defaults to 500
+    :type chunk_size: int, optional
+    :param thread_count: Number of threads sending bulk requests (parallel_bulk if > 1, 
+        which does not retry), defaults to 1
+    :type thread_count: int, optional
+    :param max_retries: Maximum number of retries of a rejected document, defaults to 5
+    :type max_retries: int, optional
+    :param initial_backoff: Seconds to wait before the first retry (doubled every retry), defaults to 2
+    :type initial_backoff: int, optional
+    :return: Number of indexed documents and list of per-document errors
+    :rtype: tuple
+    """    
+    actions = ({'_index': index_name, '_source': {'text': doc}} for doc in docs)
+
+    refresh_policy = index_lifecycle.refresh_policy
+    bulk_kwargs = {'refresh': 'wait_for'} if refresh_policy == 'wait_for' else {}
+
+    if thread_count > 1:
+        results = helpers.parallel_bulk(
+            es, actions, thread_count=thread_count, chunk_size=chunk_size,
+            raise_on_error=False, raise_on_exception=False, **bulk_kwargs)
+    else:
+        results = helpers.streaming_bulk(
+            es, actions, chunk_size=chunk_size, max_retries=max_retries,
+            initial_backoff=initial_backoff, raise_on_error=False, raise_on_exception=False,
+            **bulk_kwargs)
+
+    num_indexed = 0
+    errors = []
+
+    generation = index_lifecycle.bump(index_name)
+    if refresh_policy == 'ingest':
+        es.indices.put_settings(index=index_name, body={'index': {'refresh_interval': '-1'}})
+
+    def finish_ingestion():
+        if refresh_policy == 'ingest':
+            # Back to the default refresh interval, and make everything searchable
+            es.indices.put_settings(index=index_name, body={'index': {'refresh_interval': None}})
+            index_lifecycle.refresh(index_name)
+        elif refresh_policy == 'wait_for':
+            # Every bulk request already waited for its documents to be searchable
+            index_lifecycle.mark_ready(index_name, generation)
+        else:
+            # Documents indexed after a search refreshed the index make the
+            # next search refresh it once more
+            index_lifecycle.bump(index_name)
 
     try:
-        es.index(index=INDEX_NAME, body=jsonMapDoc)
-
-    except Exception as ex:
-        traceback.print_exc()
-        count += 1
-        if count > 5:
-            exit()
-        print("Failed to index the document {}".format(jsonMapDoc))
-    return
+        for ok, info in results:
+            if ok:
+                num_indexed += 1
+            else:
+                errors.append(info)
+                print("Failed to index the document {}".format(info))
+    except BaseException:
+        # Restore the index without masking the error that stopped the ingestion
+        try:
+            finish_ingestion()
+        except Exception as e:
+            print("Failed to restore the index '{}' after an interrupted ingestion: {}".format(index_name, e))
+        raise
+    finish_ingestion()
 
+    return num_indexed, errors
 
 
 
-def basic_search(query):
+
+def basic_search(query, size=1):
     """(Elastic) Returns an english query in the form of an elastic query
 
     :param query: input query
     :type query: str
+    :param size: Number of hits, defaults to 1
+    :type size: int, optional
     :return: Elastic query
     :rtype: dict
     """    
@@ -312,34 +718,112 @@ def basic_search(query):
                 "query": query
             }
         },
-        "size": 1
+        "size": size
     }
     return q
 
 
 
 
-def search(query):
+def search(query, index_name=INDEX_NAME, size=1):
     """(Elastic) Performs a search given an query, returns results 
 
 
     :param query: Input query
     :type query: str
+    :param index_name: Name of the index, defaults to INDEX_NAME
+    :type index_name: str, optional
+    :param size: Number of hits, defaults to 1
+    :type size: int, optional
     :return: Results
     :rtype: object
     """    
-    INDEX = 'text_file_search'
-
-    es.indices.refresh(index=INDEX)  # THIS WAS THE MAGIC LINE THAT FIXED IT!
+    # Only refreshes if documents were indexed since the last refresh
+    index_lifecycle.wait_ready(index_name)
 
-    query_body = basic_search(query)
-    res = es.search(index=INDEX, body=query_body)
+    query_body = basic_search(query, size)
+    res = es.search(index=index_name, body=query_body)
     return res
 
 
 
 
 
+class ElasticRetriever():
+    """(Elastic) Retriever storing every loaded document in its own
+    content-addressed Elasticsearch index. Searches go to the index of the
+    last loaded document only, the other indices are kept to be reused when
+    their document is loaded again
+
+    :param max_indices: Maximum number of indices to keep, defaults to 10
+    :type max_indices: int, optional
+    :param max_index_age: Maximum age of an index in seconds, defaults to None (no limit)
+    :type max_index_age: int, optional
+    """    
+
+    def __init__(self, max_indices=10, max_index_age=None):
+        self.max_indices = max_indices
+        self.max_index_age = max_index_age
+        self.index_name = None
+
+    def index_documents(self, docs, index_name):
+        """(Elastic) Indexes the segments of a document, unless an index of the
+        same content was already fully ingested
+
+        :param docs: Segments of the document
+        :type docs: iterable
+        :param index_name: Name of the index (see content_index_name)
+        :type index_name: str
+        """    
+        if index_is_complete(index_name):
+            print(f"(ElasticRetriever) > Reusing index {index_name}")
+        else:
+            create_index(index_name)
+
+            num_indexed, errors = bulk_index_into_elasticsearch(docs, index_name)
+            print(f"(ElasticRetriever) > Indexed {num_indexed} segments, {len(errors)} failed")
+
+            if not errors:
+                mark_index_complete(index_name, num_indexed)
+
+        self.index_name = index_name
+
+        garbage_collect_indices(
+            self.max_indices, self.max_index_age, keep=[self.index_name])
+
+    def search(self, query, size=1):
+        """(Elastic) Searches the index of the current document
+
+        :param query: Input query
+        :type query: str
+        :param size: Number of hits, defaults to 1
+        :type size: int, optional
+        :return: Results
+        :rtype: dict
+        """    
+        return search(query, self.index_name, size)
+
+
+
+
+def get_retriever(name, **kwargs):
+    """Returns the retrieval backend of a search model
+
+    :param name: 'elastic' (Elasticsearch) or 'bm25' (in-process BM25)
+    :type name: str
+    :return: Retriever with index_documents(docs, index_name) and search(query, size) methods
+    :rtype: object
+    """    
+    if name == 'elastic':
+        return ElasticRetriever(**kwargs)
+    elif name == 'bm25':
+        return BM25Retriever(**kwargs)
+
+    raise ValueError(f"Unknown retriever '{name}', expected 'elastic' or 'bm25'")
+
+
+
+
 def print_index_dump(query):
     """(Elastic) Helper function given a query, returns dump of retrieved index 
 
@@ -422,24 +906,89 @@ def segment_documents(docs, max_doc_length=300):
     :return: Segmented docs
     :rtype: list
     """    
-    # List containing full and segmented docs
-    segmented_docs = []
+    # Words roughly approximate the token count, segments do not overlap
+    return list(iter_segments(docs, max_tokens=max_doc_length, stride=0, snap_to_sentences=False))
 
-    for doc in docs:
-        # Split document by spaces to obtain a word count that roughly approximates the token count
-        split_to_words = doc.split(" ")
 
-        # If the document is longer than our maximum length, split it up into smaller segments and add them to the list
-        if len(split_to_words) > max_doc_length:
-            for doc_segment in range(0, len(split_to_words), max_doc_length):
-                segmented_docs.append(
-                    " ".join(split_to_words[doc_segment:doc_segment + max_doc_length]))
 
-        # If the document is shorter than our maximum length, add it to the list
+
+SENTENCE_END = re.compile(r'(?<=[.!?])["\')\]]*\s+')
+
+
+def iter_segments(docs, tokenizer=None, max_tokens=384, stride=64, snap_to_sentences=True):
+    """(General) Lazily splits documents into overlapping segments of at most
+    max_tokens tokens
+
+    Segments are sliced from the original text and end on a sentence boundary
+    when possible (a sentence longer than max_tokens is cut on a token).
+    Consecutive segments overlap by at least stride tokens, so that an answer
+    straddling two segments is fully contained in one of them, unless the
+    next segment can only start on the sentence the previous one ended at.
+
+    :param docs: Input documents
+    :type docs: iterable
+    :param tokenizer: Fast tokenizer measuring the segments, defaults to None (words)
+    :type tokenizer: PreTrainedTokenizerFast, optional
+    :param max_tokens: Maximum number of tokens of a segment, defaults to 384
+    :type max_tokens: int, optional
+    :param stride: Number of tokens shared by two consecutive segments, defaults to 64
+    :type stride: int, optional
+    :param snap_to_sentences: Whether to cut segments on sentence boundaries, defaults to True
+    :type snap_to_sentences: bool, optional
+    :return: Generator of segments
+    :rtype: generator
+    """    
+    if stride >= max_tokens:
+        raise ValueError(f"stride ({stride}) must be smaller than max_tokens ({max_tokens})")
+
+    for doc in docs:
+        # Character offsets of every token of the document
+        if tokenizer is None:
+            offsets = [m.span() for m in re.finditer(r'\S+', doc)]
         else:
-            segmented_docs.append(doc)
+            offsets = tokenizer(
+                doc, add_special_tokens=False, return_offsets_mapping=True,
+                verbose=False)['offset_mapping']
+
+        num_tokens = len(offsets)
+        if num_tokens == 0:
+            continue
+
+        # Token indices at which a sentence starts
+        boundaries = []
+        if snap_to_sentences:
+            token_starts = [start for start, _ in offsets]
+            boundaries = [bisect.bisect_left(token_starts, m.end()) for m in SENTENCE_END.finditer(doc)]
+
+        boundary_set = set(boundaries)
+
+        start, prev_end = 0, 0
+        while True:
+            end = min(start + max_tokens, num_tokens)
+
+            # Cut at the last sentence boundary that fits, if any (always past
+            # the end of the previous segment)
+            if end < num_tokens:
+                i = bisect.bisect_right(boundaries, end) - 1
+                if i >= 0 and boundaries[i] > max(start, prev_end):
+                    end = boundaries[i]
+
+            yield doc[offsets[start][0]:offsets[end - 1][1]]
+
+            if end >= num_tokens:
+                break
+
+            # Overlap the previous segment by at least stride tokens from a
+            # sentence start, else start on the sentence it was cut before,
+            # else on a token
+            next_start = max(end - stride, start + 1)
+            i = bisect.bisect_right(boundaries, next_start) - 1
+            if stride > 0 and i >= 0 and boundaries[i] > start:
+                next_start = boundaries[i]
+            elif end in boundary_set:
+                next_start = end
 
-    return segmented_docs
+            start, prev_end = next_start, end
 
 
 """
@@ -499,7 +1048,7 @@ def squad_benchmarkV2(file_name,model_obj,sio=None,channel=None):
 
     # Creating results dictionary (use to store/dump in queue)
 
-    results = CONST_RESULTS
+    results = copy.deepcopy(CONST_RESULTS)
 
     results['m_name'] = model_obj._info['class_name']
     results['f_name'] = file_name
@@ -592,6 +1141,7 @@ def squad_benchmarkV2(file_name,model_obj,sio=None,channel=None):
                         'progress':round(100.0 * results["metrics"]["correct_arr"].count(1) / (results["questions"]["num_qs"]+0.001), 2)
                     }
 
+    return results
 
 
 
@@ -16,6 +16,12 @@
 # SPDX-License-Identifier: Apache-2.0
 
 
+import time
+import numpy as np
+
+from backend.models.interfaces.generation_profiles import GENERATION_PROFILES
+
+
 class ModelSummarization():
 
     def __init__(self):
@@ -35,3 +41,61 @@ class ModelSummarization():
 
     def _get_class_name(self):
         return self._info['class_name']
+
+
+def rouge_benchmark(model_obj, dataset, num_examples=50, profile=None):
+    """Summarizes the first examples of a summarization dataset and scores the
+    summaries against the reference ones
+
+    :param model_obj: Summarization model
+    :type model_obj: ModelSummarization
+    :param dataset: Summarization dataset (CNNDailyMail, XSum...)
+    :type dataset: HuggingFaceDataset
+    :param num_examples: Number of examples to summarize, defaults to 50
+    :type num_examples: int, optional
+    :param profile: Generation profile, defaults to None (the one of the model)
+    :type profile: str or dict, optional
+    :return: ROUGE scores and average latency per example ('avg_ts')
+    :rtype: dict
+    """
+    # Only needed by the benchmarks
+    import evaluate
+
+    split = dataset._dataset[dataset._split]
+    examples = split.select(range(min(num_examples, len(split))))
+
+    predictions, times = [], []
+    for document in examples[dataset._document_column]:
+        t_s = time.time()
+        if profile is None:
+            predictions.append(model_obj._summarize_text(document)[0])
+        else:
+            predictions.append(model_obj._summarize_text(document, profile=profile)[0])
+        times.append(time.time() - t_s)
+
+    scores = evaluate.load('rouge').compute(
+        predictions=predictions, references=examples[dataset._summary_column])
+
+    results = {metric: float(score) for metric, score in scores.items()}
+    results['avg_ts'] = float(np.mean(times))
+
+    return results
+
+
+def profile_benchmark(model_obj, dataset, profiles=None, num_examples=50):
+    """Runs the ROUGE benchmark of a model with every generation profile, to
+    compare their latency/quality trade-offs
+
+    :param model_obj: Summarization model
+    :type model_obj: HuggingFaceModelSummarization
+    :param dataset: Summarization dataset (CNNDailyMail, XSum...)
+    :type dataset: HuggingFaceDataset
+    :param profiles: Names of the profiles, defaults to None (all of them)
+    :type profiles: list, optional
+    :param num_examples: Number of examples to summarize, defaults to 50
+    :type num_examples: int, optional
+    :return: Profile name -> ROUGE scores and average latency per example ('avg_ts')
+    :rtype: dict
+    """
+    return {profile: rouge_benchmark(model_obj, dataset, num_examples, profile)
+            for profile in (profiles or list(GENERATION_PROFILES))}
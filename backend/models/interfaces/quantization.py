@@ -0,0 +1,137 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+====================================================
+Quantization
+====================================================
+This module provides the int8 CPU inference mode of the models.
+
+The Linear layers of a model (most of the weights and of the compute of
+BERT and seq2seq transformers) are replaced by dynamically quantized ones:
+weights are stored as int8 and activations are quantized on the fly.
+
+Quantized weights are cached on disk, so that later startups build the
+quantized model from its configuration and load the int8 weights directly,
+without loading the fp32 checkpoint.
+
+"""
+
+import hashlib
+import os
+import time
+import torch
+from transformers import AutoConfig
+
+
+QUANTIZED_DIR = 'aski/models/quantized/'
+
+
+def quantize_dynamic_int8(model):
+    """Applies dynamic int8 quantization to the Linear layers of a model
+
+    :param model: A fp32 model
+    :type model: torch.nn.Module
+    :return: The quantized model, in eval mode
+    :rtype: torch.nn.Module
+    """
+    return torch.quantization.quantize_dynamic(
+        model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantized_path(auto_class, checkpoint, cache_dir=QUANTIZED_DIR, **kwargs):
+    """Returns the path of the cached quantized weights of a checkpoint
+
+    :param auto_class: HuggingFace class of the model
+    :type auto_class: type
+    :param checkpoint: Name or path of the checkpoint
+    :type checkpoint: str
+    :param cache_dir: Directory of the quantized weights, defaults to QUANTIZED_DIR
+    :type cache_dir: str, optional
+    :return: Path of the weights file
+    :rtype: str
+    """
+    key = repr((auto_class.__name__, checkpoint, sorted((k, str(v)) for k, v in kwargs.items()),
+                torch.__version__))
+    name = checkpoint.strip('/').replace('/', '--')
+
+    return os.path.join(cache_dir, f"{name}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}.int8.pt")
+
+
+def load_quantized(auto_class, checkpoint, cache_dir=QUANTIZED_DIR, **kwargs):
+    """Returns the int8 version of a HuggingFace model, quantizing it and
+    caching its weights on the first call
+
+    :param auto_class: HuggingFace class of the model (AutoModelForQuestionAnswering...)
+    :type auto_class: type
+    :param checkpoint: Name or path of the checkpoint
+    :type checkpoint: str
+    :param cache_dir: Directory of the quantized weights, defaults to QUANTIZED_DIR
+    :type cache_dir: str, optional
+    :return: The quantized model
+    :rtype: torch.nn.Module
+    """
+    path = quantized_path(auto_class, checkpoint, cache_dir, **kwargs)
+    t_s = time.time()
+
+    if os.path.exists(path):
+        # Same architecture as the fp32 model, without loading its weights
+        model = quantize_dynamic_int8(
+            auto_class.from_config(AutoConfig.from_pretrained(checkpoint, **kwargs)))
+        model.load_state_dict(torch.load(path))
+        print(f"(load_quantized) > Loaded {path} in {round(time.time() - t_s, 2)}s")
+        return model
+
+    model = quantize_dynamic_int8(auto_class.from_pretrained(checkpoint, **kwargs))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, path)
+    print(f"(load_quantized) > Quantized {checkpoint} to {path} in {round(time.time() - t_s, 2)}s")
+
+    return model
+
+
+def quantization_benchmark(model_class, run_benchmark, model_options=None):
+    """Runs a benchmark on the fp32 and int8 versions of a model and reports
+    the speedup next to the change of every metric
+
+    :param model_class: Class of the model (ElasticBERT, Bart...), taking a quantize argument
+    :type model_class: type
+    :param run_benchmark: Function running the benchmark on a model object and
+        returning its metrics, including the average latency 'avg_ts'
+    :type run_benchmark: callable
+    :param model_options: Other arguments of the model constructor, defaults to None
+    :type model_options: dict, optional
+    :return: Metrics of both models, speedup and int8 - fp32 deltas
+    :rtype: dict
+    """
+    model_options = dict(model_options or {})
+    model_options.pop('quantize', None)
+
+    results = {}
+    for mode, quantize in [('fp32', False), ('int8', True)]:
+        results[mode] = run_benchmark(model_class(quantize=quantize, **model_options))
+
+    results['speedup'] = results['fp32']['avg_ts'] / max(results['int8']['avg_ts'], 1e-9)
+    results['deltas'] = {
+        metric: results['int8'][metric] - value
+        for metric, value in results['fp32'].items()
+        if metric != 'avg_ts' and isinstance(value, (int, float))}
+
+    return results
@@ -0,0 +1,119 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+====================================================
+Reranker
+====================================================
+This module provides the reranking stage of the search models.
+
+The retriever returns the top N passages cheaply, a small cross-encoder
+(MiniLM by default) scores all of them against the question in one batch,
+and only the k best ones go through the expensive reader.
+
+"""
+
+import torch
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+from backend.models.interfaces.model_registry import model_registry
+
+
+DEFAULT_RERANKER = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+
+
+class CrossEncoderReranker():
+    """
+    A cross-encoder scoring (question, passage) pairs
+
+
+    Attributes
+    ----------
+    _model : AutoModelForSequenceClassification
+        The cross-encoder, shared through the model registry
+    _tokenizer : AutoTokenizer
+        Tokenizer of the cross-encoder
+    _max_length : int
+        Maximum number of tokens of a (question, passage) pair
+    _batch_size : int
+        Maximum number of pairs per forward pass
+
+    Methods
+    -------
+    scores(self, question, passages):
+        Returns the relevance score of every passage.
+
+    rerank(self, question, passages, top_k=None):
+        Returns the indices and scores of the best passages.
+
+    """
+
+    def __init__(self, checkpoint=DEFAULT_RERANKER, max_length=256, batch_size=32):
+        self._tokenizer = model_registry.from_pretrained(AutoTokenizer, checkpoint)
+        self._model = model_registry.from_pretrained(AutoModelForSequenceClassification, checkpoint)
+        self._model.eval()
+        self._max_length = max_length
+        self._batch_size = batch_size
+
+    def scores(self, question, passages):
+        """Returns the relevance score of every passage for a question
+
+        :param question: Input question
+        :type question: str
+        :param passages: Retrieved passages
+        :type passages: list
+        :return: One score per passage
+        :rtype: list
+        """
+        scores = []
+        for b in range(0, len(passages), self._batch_size):
+            batch = passages[b:b + self._batch_size]
+            inputs = self._tokenizer(
+                [question] * len(batch), batch,
+                max_length=self._max_length,
+                truncation='only_second',
+                padding='longest',
+                return_tensors='pt')
+
+            with torch.no_grad():
+                logits = self._model(**inputs, return_dict=True).logits
+
+            # Single relevance logit (ms-marco cross-encoders), else the 'relevant' class
+            scores += (logits[:, 0] if logits.size(1) == 1 else logits[:, -1]).tolist()
+
+        return scores
+
+    def rerank(self, question, passages, top_k=None):
+        """Returns the best passages for a question, as (index, score) pairs
+        sorted by decreasing score
+
+        :param question: Input question
+        :type question: str
+        :param passages: Retrieved passages
+        :type passages: list
+        :param top_k: Number of passages to keep, defaults to None (all)
+        :type top_k: int, optional
+        :return: List of (index in passages, score)
+        :rtype: list
+        """
+        passages = list(passages)
+        if len(passages) == 0:
+            return []
+
+        ranked = sorted(enumerate(self.scores(question, passages)), key=lambda x: -x[1])
+
+        return ranked[:top_k] if top_k else ranked
@@ -0,0 +1,155 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+====================================================
+Results Store
+====================================================
+This module provides the on-disk store of dataset summarization results.
+
+Results are content-addressed: the directory of a run is named after a hash
+of everything that changes its output (model revision, generation config,
+dataset fingerprint and split), so changing any of them starts a new run
+instead of returning stale results.
+
+A run is written as Parquet shards of (index, summary) rows, one shard per
+checkpoint, so an interrupted run resumes from its last checkpoint. Shards
+are written to a temporary file and renamed, so a shard is either complete
+or absent.
+
+"""
+
+import glob
+import hashlib
+import json
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+RESULTS_DIR = 'aski/results/'
+
+
+def results_key(**components):
+    """Returns the content hash identifying a summarization run
+
+    :return: Hexadecimal key
+    :rtype: str
+    """
+    return hashlib.sha1(
+        json.dumps(components, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+class ResultsStore():
+    """
+    Sharded Parquet store of the results of one summarization run
+
+
+    Attributes
+    ----------
+    path : str
+        Directory of the run
+    _num_shards : int
+        Number of shards already written
+
+    Methods
+    -------
+    load(self):
+        Returns the results already computed, by example index.
+
+    append(self, indices, summaries):
+        Writes a checkpoint shard.
+
+    mark_complete(self, num_examples):
+        Records that every example was summarized.
+
+    """
+
+    def __init__(self, path, components=None):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        self._num_shards = len(self._shard_files())
+
+        # What the key was computed from, for humans browsing the results
+        metadata_path = os.path.join(self.path, 'metadata.json')
+        if components is not None and not os.path.exists(metadata_path):
+            with open(metadata_path, 'w') as f:
+                json.dump(components, f, indent=2, sort_keys=True, default=str)
+
+    @classmethod
+    def for_run(cls, name, results_dir=RESULTS_DIR, **components):
+        """Returns the store of the run identified by components
+
+        :param name: Readable prefix of the directory (model and dataset names)
+        :type name: str
+        :param results_dir: Root directory of the results, defaults to RESULTS_DIR
+        :type results_dir: str, optional
+        :return: The store
+        :rtype: ResultsStore
+        """
+        return cls(os.path.join(results_dir, f"{name}-{results_key(**components)}"), components)
+
+    def _shard_files(self):
+        return sorted(glob.glob(os.path.join(self.path, 'shard-*.parquet')))
+
+    def is_complete(self):
+        """Whether every example of the run was summarized"""
+        return os.path.exists(os.path.join(self.path, '_COMPLETE'))
+
+    def load(self):
+        """Returns the results of the checkpoints already written
+
+        :return: Example index -> summary
+        :rtype: dict
+        """
+        shard_files = self._shard_files()
+        if len(shard_files) == 0:
+            return {}
+
+        table = pa.concat_tables([pq.read_table(f) for f in shard_files])
+
+        return dict(zip(table.column('index').to_pylist(), table.column('summary').to_pylist()))
+
+    def append(self, indices, summaries):
+        """Writes the results of a checkpoint as a new shard
+
+        :param indices: Indices of the examples in the split
+        :type indices: list
+        :param summaries: Their summaries
+        :type summaries: list
+        """
+        if len(indices) == 0:
+            return
+
+        table = pa.table({
+            'index': pa.array(indices, type=pa.int64()),
+            'summary': pa.array(summaries, type=pa.string())})
+
+        shard_path = os.path.join(self.path, f"shard-{self._num_shards:05d}.parquet")
+        tmp_path = f"{shard_path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, shard_path)
+        self._num_shards += 1
+
+    def mark_complete(self, num_examples):
+        """Records that the run summarized all its examples
+
+        :param num_examples: Number of examples of the split
+        :type num_examples: int
+        """
+        with open(os.path.join(self.path, '_COMPLETE'), 'w') as f:
+            f.write(str(num_examples))
@@ -0,0 +1,234 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+====================================================
+Runtimes
+====================================================
+This module provides the execution backends of the extractive QA reader.
+
+    'torch' - eager PyTorch (optionally int8, see
+        backend.models.interfaces.quantization)
+    'onnx' - the reader exported once to ONNX and run with ONNX Runtime,
+        with all its CPU graph optimizations and explicit thread counts
+
+Both return a callable with the interface of a HuggingFace QA model
+(model(**inputs, return_dict=True).start_logits/.end_logits), so the
+search helpers do not depend on the runtime.
+
+The exported graph is cached next to a local checkpoint, or under
+ONNX_DIR for checkpoints of the HuggingFace hub (keyed by their revision),
+and reused across restarts. onnxruntime is only needed by the 'onnx' runtime.
+
+"""
+
+import hashlib
+import inspect
+import os
+import time
+import torch
+from transformers import AutoConfig, AutoModelForQuestionAnswering
+from transformers.modeling_outputs import QuestionAnsweringModelOutput
+
+from backend.models.interfaces.model_registry import model_registry
+
+
+RUNTIMES = ['torch', 'onnx']
+
+ONNX_DIR = 'aski/models/onnx/'
+
+# Highest opset exported by torch 1.9
+ONNX_OPSET = 13
+
+
+def checkpoint_revision(checkpoint):
+    """Returns what identifies the weights of a hub checkpoint: its commit on
+    the HuggingFace hub when known, and a hash of its configuration
+
+    :param checkpoint: Name of the checkpoint
+    :type checkpoint: str
+    :return: Revision of the checkpoint
+    :rtype: str
+    """
+    config = AutoConfig.from_pretrained(checkpoint)
+    config_hash = hashlib.sha1(config.to_json_string().encode('utf-8')).hexdigest()[:16]
+
+    return str(getattr(config, '_commit_hash', None)) + '-' + config_hash
+
+
+def onnx_path(checkpoint, quantize=False, cache_dir=ONNX_DIR, revision=None):
+    """Returns the path of the exported ONNX graph of a QA checkpoint
+
+    :param checkpoint: Name or path of the checkpoint
+    :type checkpoint: str
+    :param quantize: Whether the graph has int8 weights, defaults to False
+    :type quantize: bool, optional
+    :param cache_dir: Directory of the graphs of hub checkpoints, defaults to ONNX_DIR
+    :type cache_dir: str, optional
+    :param revision: Revision of a hub checkpoint (see checkpoint_revision), defaults to None
+    :type revision: str, optional
+    :return: Path of the .onnx file
+    :rtype: str
+    """
+    file_name = 'model.int8.onnx' if quantize else 'model.onnx'
+
+    if os.path.isdir(checkpoint):
+        return os.path.join(checkpoint, 'onnx', file_name)
+
+    name = checkpoint.strip('/').replace('/', '--')
+    key = hashlib.sha1(repr((checkpoint, revision, torch.__version__, ONNX_OPSET)).encode('utf-8')).hexdigest()[:12]
+
+    return os.path.join(cache_dir, f"{name}-{key}", file_name)
+
+
+def export_onnx(model, tokenizer, path):
+    """Exports a HuggingFace QA model to ONNX, with dynamic batch and sequence axes
+
+    :param model: QA model
+    :type model: transformers.PreTrainedModel
+    :param tokenizer: Tokenizer of the model
+    :type tokenizer: transformers.PreTrainedTokenizer
+    :param path: Path of the .onnx file
+    :type path: str
+    """
+    # Padded pair of examples, so that the attention mask is part of the traced graph
+    dummy = tokenizer(["question", "question"], ["context", "context of the question"],
+                      padding=True, return_tensors='pt')
+    # Inputs are passed positionally, in the order of the forward arguments
+    input_names = [name for name in inspect.signature(model.forward).parameters if name in dummy]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes.update({name: {0: 'batch', 1: 'sequence'} for name in ['start_logits', 'end_logits']})
+
+    kwargs = {}
+    # Newer versions of torch default to the dynamo exporter
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        kwargs['dynamo'] = False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval(),
+            tuple(dummy[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=['start_logits', 'end_logits'],
+            dynamic_axes=dynamic_axes,
+            opset_version=ONNX_OPSET,
+            **kwargs)
+    os.replace(tmp_path, path)
+
+
+class OnnxQuestionAnswering():
+    """
+    A QA reader running an exported graph with ONNX Runtime, called like a
+    HuggingFace QA model
+
+
+    Attributes
+    ----------
+    _session : onnxruntime.InferenceSession
+        The inference session of the graph
+    _input_names : list of str
+        Inputs of the graph (input_ids, attention_mask, token_type_ids)
+
+    """
+
+    def __init__(self, path, intra_op_num_threads=None, inter_op_num_threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_num_threads:
+            options.intra_op_num_threads = intra_op_num_threads
+        if inter_op_num_threads:
+            options.inter_op_num_threads = inter_op_num_threads
+
+        self._session = onnxruntime.InferenceSession(
+            path, options, providers=['CPUExecutionProvider'])
+        self._input_names = [i.name for i in self._session.get_inputs()]
+
+    def __call__(self, return_dict=True, **inputs):
+        feed = {name: inputs[name].cpu().numpy() for name in self._input_names}
+        start_logits, end_logits = self._session.run(['start_logits', 'end_logits'], feed)
+
+        return QuestionAnsweringModelOutput(
+            start_logits=torch.from_numpy(start_logits),
+            end_logits=torch.from_numpy(end_logits))
+
+
+def load_onnx_reader(checkpoint, tokenizer, quantize=False, intra_op_num_threads=None,
+                     inter_op_num_threads=None):
+    """Returns an ONNX Runtime reader, exporting (and quantizing) the
+    checkpoint on the first call
+
+    :param checkpoint: Name or path of the QA checkpoint
+    :type checkpoint: str
+    :param tokenizer: Tokenizer of the checkpoint
+    :type tokenizer: transformers.PreTrainedTokenizer
+    :param quantize: Whether to run the graph with int8 weights, defaults to False
+    :type quantize: bool, optional
+    :return: The reader
+    :rtype: OnnxQuestionAnswering
+    """
+    # A new commit of a hub checkpoint is exported again
+    revision = None if os.path.isdir(checkpoint) else checkpoint_revision(checkpoint)
+    path = onnx_path(checkpoint, revision=revision)
+    t_s = time.time()
+
+    if not os.path.exists(path):
+        export_onnx(AutoModelForQuestionAnswering.from_pretrained(checkpoint), tokenizer, path)
+        print(f"(load_onnx_reader) > Exported {checkpoint} to {path} in {round(time.time() - t_s, 2)}s")
+
+    if quantize:
+        fp32_path, path = path, onnx_path(checkpoint, quantize=True, revision=revision)
+        if not os.path.exists(path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, path)
+
+    return OnnxQuestionAnswering(path, intra_op_num_threads, inter_op_num_threads)
+
+
+def load_reader(checkpoint, tokenizer, runtime='torch', quantize=False, num_threads=None):
+    """Returns the shared QA reader of a checkpoint for a runtime
+
+    :param checkpoint: Name or path of the QA checkpoint
+    :type checkpoint: str
+    :param tokenizer: Tokenizer of the checkpoint
+    :type tokenizer: transformers.PreTrainedTokenizer
+    :param runtime: 'torch' or 'onnx', defaults to 'torch'
+    :type runtime: str, optional
+    :param quantize: Whether to run the reader with int8 weights, defaults to False
+    :type quantize: bool, optional
+    :param num_threads: Number of intra-op threads of ONNX Runtime, defaults to None (all cores)
+    :type num_threads: int, optional
+    :return: A callable with the interface of a HuggingFace QA model
+    :rtype: object
+    """
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown runtime '{runtime}', expected one of {RUNTIMES}")
+
+    if runtime == 'torch':
+        return model_registry.from_pretrained(
+            AutoModelForQuestionAnswering, checkpoint, quantize=quantize)
+
+    return model_registry.get(
+        ('OnnxQuestionAnswering', checkpoint, quantize, num_threads),
+        lambda: load_onnx_reader(checkpoint, tokenizer, quantize, num_threads))
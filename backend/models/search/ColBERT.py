@@ -26,24 +26,24 @@ dashboard to use.
 This file provides an interface to the ColBERT model proposed in: 
 - https://github.com/stanford-futuredata/ColBERT/tree/new_api
 
+Passages are indexed and searched with the late-interaction engine of
+backend.models.interfaces.late_interaction.
+
 
 """
 
 
-from backend.models.interfaces.model_search import ModelSearch, segment_documents, \
-    answer_question
+from backend.models.interfaces.model_search import ModelSearch, iter_segments, \
+    content_index_name
+from backend.models.interfaces.model_registry import model_registry
+from backend.models.interfaces.runtimes import load_reader
+from backend.models.interfaces.reranker import CrossEncoderReranker
+from backend.models.interfaces.late_interaction import ColBERTEncoder, \
+    LateInteractionEncoder, LateInteractionIndex
 
-from transformers import AutoTokenizer, AutoModelForQuestionAnswering
+from transformers import AutoTokenizer
 import os
 import time
-import torch
-import shutil
-
-# sys.path.insert(0, f"{os.getcwd()}/ColBERT/")
-# from colbert.infra import Run, RunConfig, ColBERTConfig
-# from colbert import Indexer, Searcher
-# from colbert.data import Queries
-# sys.path.insert(0, f"{os.getcwd()}/")
 
 # ==============================================================================
 # =========================== AUXILIARY FUNCTIONS ==============================
@@ -68,71 +68,100 @@ def get_ColBERT_info():
 
 class ColBERT(ModelSearch):
 
-    def __init__(self):
+    def __init__(self, checkpoint='colbert-ir/colbertv2.0', experiment='notebook', nbits=2,
+                 reader_batch_size=8, reader_batch_wait=0.005, quantize=False,
+                 runtime='torch', runtime_threads=None, retrieval_size=3, reranker=None,
+                 reader_top_k=None):
         self._info = get_ColBERT_info()
 
+        # Retrieve retrieval_size passages, rerank them with the reranker
+        # checkpoint (if any) and read the reader_top_k best ones
+        self.retrieval_size = retrieval_size
+        self.reranker_checkpoint = reranker
+        self.reader_top_k = reader_top_k
+
+        # int8 reader (dynamic quantization of the Linear layers)
+        self.quantize = quantize
+
+        # Runtime of the reader ('torch' or 'onnx') and its number of threads
+        self.runtime = runtime
+        self.runtime_threads = runtime_threads
+
+        # Concurrent searches share the forward passes of the reader
+        self.reader_batch_size = reader_batch_size
+        self.reader_batch_wait = reader_batch_wait
+
+        self.checkpoint = checkpoint
+        self.experiment = experiment
+        self.nbits = nbits   # encode each dimension with 2 bits (None: no compression)
+
     def load_model(self, file_name, file_content):
         self.filename = file_name
 
         self.string = f"ColBERT for {self.filename}"
-        self.docs = segment_documents([file_content])
 
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "deepset/bert-large-uncased-whole-word-masking-squad2")
+        doc_maxlen = 300   # truncate passages at 300 tokens
+        segment_stride = 32   # tokens shared by consecutive passages
 
-        self.model = AutoModelForQuestionAnswering.from_pretrained(
-            "deepset/bert-large-uncased-whole-word-masking-squad2")
+        # Shared with the other search models, only loaded once per process
+        self.tokenizer = model_registry.from_pretrained(
+            AutoTokenizer, "deepset/bert-large-uncased-whole-word-masking-squad2")
 
-        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        self.model = load_reader(
+            "deepset/bert-large-uncased-whole-word-masking-squad2", self.tokenizer,
+            runtime=self.runtime, quantize=self.quantize, num_threads=self.runtime_threads)
 
-        nbits = 2   # encode each dimension with 2 bits
-        self.index_name = f'trial.{nbits}bits'
+        self._start_reader_queue(self.reader_batch_size, self.reader_batch_wait)
 
-        doc_maxlen = 300   # truncate passages at 300 tokens
-        self.checkpoint = 'ColBERT/docs/downloads/colbertv2.0'
+        self.reranker = CrossEncoderReranker(
+            self.reranker_checkpoint) if self.reranker_checkpoint else None
 
-        self.experiment = 'notebook'
-        self.searcher = None
-        self.indexer = None
+        encoder_tokenizer = model_registry.from_pretrained(AutoTokenizer, self.checkpoint)
+        self.encoder = LateInteractionEncoder(
+            model_registry.from_pretrained(ColBERTEncoder, self.checkpoint),
+            encoder_tokenizer,
+            doc_maxlen=doc_maxlen)
 
-        self.f_index_name = f"{os.getcwd()}/experiments/{self.experiment}/indexes/{self.index_name}"
+        # Passages fill doc_maxlen, minus [CLS], the [D] marker and [SEP]
+        self.docs = iter_segments(
+            [file_content], encoder_tokenizer, max_tokens=doc_maxlen - 3, stride=segment_stride)
+
+        # The index of a document is persisted and reused until its content changes
+        self.index_name = content_index_name(
+            file_content, checkpoint=self.checkpoint, doc_maxlen=doc_maxlen,
+            segment_stride=segment_stride, nbits=self.nbits)
 
-        if os.path.exists(self.f_index_name) and os.path.isdir(self.f_index_name):
-            shutil.rmtree(self.f_index_name)
+        self.f_index_name = f"{os.getcwd()}/experiments/{self.experiment}/indexes/{self.index_name}"
 
         t_s = time.time()
-        # Commented out to fix lint
-        # with Run().context(RunConfig(nranks=1, experiment=self.experiment)):
-        #     self.config = ColBERTConfig(doc_maxlen=doc_maxlen, nbits=nbits)
-        #
-        #     self.indexer = Indexer(
-        #         checkpoint=self.checkpoint, config=self.config)
-        #     self.indexer.index(name=self.index_name,
-        #                        collection=self.docs, overwrite=True)
-        #
-        #     self.searcher = Searcher(index=self.index_name)
+        if LateInteractionIndex.exists(self.f_index_name):
+            self.searcher = LateInteractionIndex.load(self.f_index_name, self.encoder)
+        else:
+            self.searcher = LateInteractionIndex.build(
+                self.f_index_name, self.docs, self.encoder, nbits=self.nbits)
 
         t_e = time.time()
         self.t_startup = t_e - t_s
+        print(f"(ColBERT) > Index of {len(self.searcher.collection)} passages ready in {round(self.t_startup, 2)}s")
 
     def file_search(self, search_term):
 
-        result = sum_docs = orig_w_h = new_candidate_docs = []
+        result, orig_w_h, new_candidate_docs = [], [], []
 
-        query = ""
+        query = search_term
         if search_term[-1] in '?!,.':
             query = search_term[:-1]
         query = [w.lower() for w in query.split(" ")]
         search_term = " ".join(query)
         print(query)
         t_s = time.time()
-        docs = self.searcher.search(search_term, k=3)
+        docs = self.searcher.search(search_term, k=self.retrieval_size)
 
-        for i, _, _ in zip(*docs):
-            c_d = self.searcher.collection[i]
+        candidate_docs = self._select_passages(
+            search_term, [self.searcher.collection[i] for i, _, _ in zip(*docs)])
+        answers = self._read(search_term, candidate_docs)
 
-            r, start, end = answer_question(
-                search_term, c_d, self.model, self.tokenizer)
+        for c_d, (r, start, end) in zip(candidate_docs, answers):
             if r == "":
                 continue
 
@@ -140,6 +169,7 @@ class ColBERT(ModelSearch):
             orig_w_h.append([start, r, end])
             new_candidate_docs.append(c_d)
 
+        sum_docs = ['']*len(new_candidate_docs)
         res = [{'res': r, 'sum': s, 'orig': o, 'orig_w_h': o_h}
                for r, s, o, o_h in zip(result, sum_docs, new_candidate_docs, orig_w_h)]
 
@@ -23,18 +23,37 @@ ElasticBERT
 This module loads an Elastic+BERT model and makes it available for the 
 dashboard to use.
 
-This file will work if Elasticsearch is downloaded anywhere locally
-and is currently running. In order to start Elasticsearch, simply 
-type "./bin/elasticsearch" into your terminal and execute the cmd. 
+With the default 'elastic' retriever, this file will work if Elasticsearch
+is downloaded anywhere locally and is currently running. In order to start
+Elasticsearch, simply type "./bin/elasticsearch" into your terminal and
+execute the cmd. 
 
 If on Windows, you will need to type ".\bin\elasticsearch.bat"
 
+The 'bm25' retriever (set with model_options in the pipeline YAML) runs
+in-process and does not need Elasticsearch.
+
+Concurrent searches are read in one batch: up to reader_batch_size searches
+arriving within reader_batch_wait seconds share a forward pass of the reader
+(reader_batch_size: 1 disables batching).
+
+With quantize: true, the reader runs in int8 on CPU (see
+backend.models.interfaces.quantization). With runtime: onnx, it runs with
+ONNX Runtime instead of PyTorch (see backend.models.interfaces.runtimes).
+
+Searches retrieve retrieval_size passages, optionally rerank them with a
+cross-encoder (reranker: checkpoint name) and only read the reader_top_k
+best ones.
+
 """
 
-from backend.models.interfaces.model_search import ModelSearch, answer_question, \
-    create_index, index_into_elasticsearch, search, segment_documents
+from backend.models.interfaces.model_search import ModelSearch, \
+    iter_segments, content_index_name, get_retriever
+from backend.models.interfaces.model_registry import model_registry
+from backend.models.interfaces.runtimes import load_reader
+from backend.models.interfaces.reranker import CrossEncoderReranker
 
-from transformers import AutoTokenizer, AutoModelForQuestionAnswering
+from transformers import AutoTokenizer
 import time
 
 # ==============================================================================
@@ -60,37 +79,74 @@ def get_ElasticBERT_info():
 
 class ElasticBERT(ModelSearch):
 
-    def __init__(self):
+    def __init__(self, retriever='elastic', max_segment_tokens=384, segment_stride=64,
+                 snap_to_sentences=True, reader_batch_size=8, reader_batch_wait=0.005,
+                 quantize=False, runtime='torch', runtime_threads=None, retrieval_size=1,
+                 reranker=None, reader_top_k=None, **retriever_options):
         self._info = get_ElasticBERT_info()
 
+        # Retrieve retrieval_size passages, rerank them with the reranker
+        # checkpoint (if any) and read the reader_top_k best ones
+        self.retrieval_size = retrieval_size
+        self.reranker_checkpoint = reranker
+        self.reader_top_k = reader_top_k
+
+        # int8 reader (dynamic quantization of the Linear layers)
+        self.quantize = quantize
+
+        # Runtime of the reader ('torch' or 'onnx') and its number of threads
+        self.runtime = runtime
+        self.runtime_threads = runtime_threads
+
+        self.reader_batch_size = reader_batch_size
+        self.reader_batch_wait = reader_batch_wait
+
+        # Retrieval backend ('elastic' or 'bm25'), selected in the pipeline YAML
+        self.retriever = get_retriever(retriever, **retriever_options)
+
+        # Segments fit in the 512-token reader window along with the question
+        self.segment_settings = {
+            'max_tokens': max_segment_tokens,
+            'stride': segment_stride,
+            'snap_to_sentences': snap_to_sentences}
+
     def load_model(self, file_name, file_content):
 
         self.file_name = file_name
-        self.docs = segment_documents([file_content])
 
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "deepset/bert-large-uncased-whole-word-masking-squad2")
+        # Shared with the other search models, only loaded once per process
+        self.tokenizer = model_registry.from_pretrained(
+            AutoTokenizer, "deepset/bert-large-uncased-whole-word-masking-squad2")
+
+        self.model = load_reader(
+            "deepset/bert-large-uncased-whole-word-masking-squad2", self.tokenizer,
+            runtime=self.runtime, quantize=self.quantize, num_threads=self.runtime_threads)
+
+        self._start_reader_queue(self.reader_batch_size, self.reader_batch_wait)
 
-        self.model = AutoModelForQuestionAnswering.from_pretrained(
-            "deepset/bert-large-uncased-whole-word-masking-squad2")
+        self.reranker = CrossEncoderReranker(
+            self.reranker_checkpoint) if self.reranker_checkpoint else None
 
-        create_index()
+        # Segments are only produced if the document has to be indexed
+        self.docs = iter_segments([file_content], self.tokenizer, **self.segment_settings)
 
-        for doc in self.docs:
-            index_into_elasticsearch(doc)
+        # Every document gets its own index, named after its content
+        self.index_name = content_index_name(
+            file_content, tokenizer=self.tokenizer.name_or_path, **self.segment_settings)
+        self.retriever.index_documents(self.docs, self.index_name)
 
     def file_search(self, search_term):
-        result = sum_docs = orig_w_h = new_candidate_docs = []
+        result, orig_w_h, new_candidate_docs = [], [], []
 
         t_s = time.time()
-        res = search(search_term)
+        res = self.retriever.search(search_term, size=self.retrieval_size)
         hits = res['hits']['hits']
 
-        for i in range(len(hits)):
-            c_d = hits[i]['_source']['text']
-            r, start, end = answer_question(
-                search_term, c_d, self.model, self.tokenizer)
+        candidate_docs = self._select_passages(
+            search_term, [hit['_source']['text'] for hit in hits])
+        answers = self._read(search_term, candidate_docs)
 
+        for c_d, (r, start, end) in zip(candidate_docs, answers):
             if r == '':
                 continue
             result.append(r)
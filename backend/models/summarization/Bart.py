@@ -56,11 +56,12 @@ class Bart(HuggingFaceModelSummarization):
     """BART model from 'Denoising Sequence-to-Sequence Pre-training for Natural 
     Language Generation, Translation, and Comprehension' paper"""
 
-    def __init__(self):
+    def __init__(self, **kwargs):
 
         super().__init__(
             model_name='facebook/bart-large',
             model_info=get_bart_info(),
             max_length=1020,
             model_max_length=1020,
-            truncation=True)
+            truncation=True,
+            **kwargs)
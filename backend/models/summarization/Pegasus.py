@@ -55,11 +55,12 @@ class Pegasus(HuggingFaceModelSummarization):
     """Pegasus model from 'Pre-training with Extracted Gap-sentences for 
     Abstractive Summarization' paper"""
 
-    def __init__(self):
+    def __init__(self, **kwargs):
 
         super().__init__(
             model_name='google/pegasus-xsum',
             model_info=get_pegasus_info(),
             max_length=512,
             model_max_length=512,
-            truncation=True)
+            truncation=True,
+            **kwargs)
@@ -56,11 +56,12 @@ class T5(HuggingFaceModelSummarization):
     """T5 model from 'Exploring the Limits of Transfer Learning with a Unified
      Text-to-Text Transformer' paper"""
 
-    def __init__(self):
+    def __init__(self, **kwargs):
 
         super().__init__(
             model_name='t5-base',
             model_info=get_t5_info(),
             max_length=2000,
             model_max_length=2000,
-            truncation=True)
+            truncation=True,
+            **kwargs)
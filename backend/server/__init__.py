@@ -1,5 +1,5 @@
 import copy,os
-from flask import Flask
+from flask import Flask, request
 from flask_cors import CORS, cross_origin
 from flask_socketio import SocketIO, emit
 import multiprocessing
@@ -7,9 +7,17 @@ import multiprocessing
 from flask_restful import Resource, Api
 from backend.server.core.views import Default, Models
 from backend.config import TestingConfig,ProductionConfig,DevelopmentConfig
-from backend.server.utils.helpers import get_list_objects
+from backend.server.utils.helpers import get_list_objects, get_model_object_from_name, \
+    get_object_from_name, get_generation_profile_name
+from backend.server.utils.answer_cache import AnswerCache
+from backend.server.utils.lazy_objects import MODEL_LOADING, load_all, warm_up
+from backend.server.utils.prefork import PreforkServer, SharedRequests, blocking_runner, make_listener, serve_app
 from backend.models.search.ElasticBERT import ElasticBERT
-from backend.models.interfaces.model_search import squad_benchmarkV2
+from backend.models.interfaces.model_search import squad_benchmarkV2, index_lifecycle
+from backend.models.interfaces.model_registry import model_registry
+from backend.models.interfaces.model_summarization import rouge_benchmark, profile_benchmark
+from backend.models.interfaces.generation_profiles import get_generation_profile
+from backend.models.interfaces.quantization import quantization_benchmark
 from backend.server.routes import routes
 from flasgger import Swagger
 from gevent import monkey,sleep
@@ -19,13 +27,48 @@ import time
 thread_event = Event()
 
 # monkey.patch_all()
-def run_app_server(app,socketio, port=3000, ip='0.0.0.0'):
+def run_app_server(app,socketio, port=3000, ip='0.0.0.0', workers=1):
     
     print("PID:", os.getpid())
     print("Werkzeug subprocess:", os.environ.get("WERKZEUG_RUN_MAIN"))
     print("Inherited FD:", os.environ.get("WERKZEUG_SERVER_FD"))
-    # app.run(debug=False, host=ip, port=port)
-    socketio.run(app,host=ip,port=port,debug=False)
+    if workers <= 1:
+        # app.run(debug=False, host=ip, port=port)
+        socketio.run(app,host=ip,port=port,debug=False)
+        return
+
+    # Pre-forked workers: the models are loaded once, here, and shared
+    # copy-on-write by the workers forked below. No loading thread may be
+    # running when forking (the locks it holds would stay held in the workers)
+    warm_up_thread = app.config.get('warm_up_thread')
+    if warm_up_thread is not None:
+        warm_up_thread.join()
+    server_config = app.config['server_config']
+    model_loading = server_config['function'].get('model_loading', 'eager')
+    if model_loading != 'eager':
+        print(f"(run_app_server) > model_loading '{model_loading}' is ignored with {workers} workers, "
+              "every object is loaded before forking")
+    load_all([model for model_objs in server_config['model_objs'].values() for model in model_objs] +
+             server_config['dataset_objs'],
+             int(server_config['function'].get('loading_workers', 4)))
+
+    listener = make_listener(ip, port)
+
+    # Documents loaded by one worker are loaded by the others
+    shared_requests = SharedRequests(
+        workers, sleep=socketio.sleep, run_blocking=blocking_runner(socketio.async_mode))
+    app.config['shared_requests'] = shared_requests
+
+    def serve(slot):
+        shared_requests.slot = slot
+        shared_requests.replay_log(app)
+        serve_app(app, socketio, listener, shared_requests.listeners[slot])
+
+    print(f"(run_app_server) > Serving on {ip}:{port} with {workers} workers")
+    try:
+        PreforkServer(serve, workers).run()
+    finally:
+        shared_requests.close()
 
 def json_input_validators(input_data, fields_to_be_present):
     for f in fields_to_be_present:
@@ -81,21 +124,58 @@ def create_app(server_config,config_class=TestingConfig):
         # Default
         os.environ['ASKI_PROFILING'] = "false"
 
+    # Memory budget (in MB) of the models shared through the model registry
+    if 'model_memory_budget' in server_config['function']:
+        model_registry.set_memory_budget(
+            int(server_config['function']['model_memory_budget']) * 1024 * 1024)
+
+    # How documents indexed into Elasticsearch are made searchable
+    if 'es_refresh_policy' in server_config['function']:
+        index_lifecycle.set_refresh_policy(
+            server_config['function']['es_refresh_policy'])
+
+    # Answers of /search, keyed by model, document and normalized query
+    answer_cache = AnswerCache(
+        max_size=int(server_config['function'].get('answer_cache_size', 1024)),
+        ttl=server_config['function'].get('answer_cache_ttl', 3600))
+
+    # 'eager' (default): objects are instantiated before serving, 'background':
+    # in a warm-up thread while serving, 'on_demand': on first use
+    model_loading = server_config['function'].get('model_loading', 'eager')
+    if model_loading not in MODEL_LOADING:
+        raise ValueError(f"Unknown model_loading '{model_loading}', expected one of {MODEL_LOADING}")
+    # Number of objects loaded concurrently
+    loading_workers = int(server_config['function'].get('loading_workers', 4))
+
     for task in tasks_list:
         server_config['model_objs'][task] = get_list_objects(
-            server_config['models_' + task], task, 'models')
+            server_config['models_' + task], task, 'models',
+            server_config.get('model_options'), lazy=True)
 
     server_config['dataset_objs'] = get_list_objects(
-        server_config['datasets'], server_config['function']['task'], 'datasets')
+        server_config['datasets'], server_config['function']['task'], 'datasets', lazy=True)
     server_config['processes'] = {}
 
+    # Load time and memory of every object, filled once they are all loaded
+    startup_report = {}
+    warm_up_thread = None
+    all_objects = [model for task in tasks_list for model in server_config['model_objs'][task]] + \
+        server_config['dataset_objs']
+    if model_loading == 'eager':
+        startup_report.update(load_all(all_objects, loading_workers))
+    elif model_loading == 'background':
+        warm_up_thread = warm_up(all_objects, loading_workers, startup_report)
+
     initial_server_config = copy.deepcopy(server_config)
     print("(create_app) > Server config is ", server_config)
 
     
     app.config.update(
         frontend_config=frontend_config,
-        server_config=server_config  
+        server_config=server_config,
+        answer_cache=answer_cache,
+        startup_report=startup_report,
+        warm_up_thread=warm_up_thread
     )
 
     for route in routes:
@@ -107,9 +187,58 @@ def create_app(server_config,config_class=TestingConfig):
     def test_connect():
         emit('response', {'data': 'Connected'})
     
+    # Cancellation events of the summaries being streamed, one per stream, by client
+    summary_streams = {}
+
     @socketio.on('disconnect')
     def test_disconnect():
         print('Client disconnected')
+        for cancel in list(summary_streams.get(request.sid, ())):
+            cancel.set()
+
+    @socketio.on('summary')
+    def summary_stream(data):
+        # Streams the summary of data["content"] as it is generated: 'summary'
+        # events with the new text, then one with the whole summary
+        model_obj = get_model_object_from_name(data["model"], 'summarization', server_config)
+        if not callable(getattr(model_obj, "_summarize_text_streaming", None)):
+            emit('summary', {"error": "That model doesn't exist", "done": True})
+            return
+
+        profile = get_generation_profile_name(server_config, data.get("profile"))
+        if profile is not None:
+            try:
+                get_generation_profile(profile)
+            except ValueError as e:
+                emit('summary', {"error": str(e), "done": True})
+                return
+
+        # A client may stream several summaries at once, each has its own event
+        cancel = Event()
+        streams = summary_streams.setdefault(request.sid, set())
+        streams.add(cancel)
+        t_s = time.time()
+        first_token = []
+
+        def on_text(text):
+            if not first_token:
+                first_token.append(time.time() - t_s)
+            emit('summary', {"text": text, "done": False})
+            # Lets the server send the event (and notice disconnections)
+            socketio.sleep(0)
+
+        try:
+            summary, timings = model_obj._summarize_text_streaming(
+                data["content"], on_text, cancel.is_set, profile=profile)
+        finally:
+            streams.discard(cancel)
+            if not streams:
+                summary_streams.pop(request.sid, None)
+
+        if not cancel.is_set():
+            emit('summary', {"result": summary, "done": True, "timings": timings,
+                             "time_to_first_token": first_token[0] if first_token else None,
+                             "latency": time.time() - t_s})
 
     @socketio.on('benchmark')
     def benchmark(data):
@@ -128,7 +257,46 @@ def create_app(server_config,config_class=TestingConfig):
         file = data["file"]
         model_obj = server_config["model_objs"]["search"][0]        
         squad_benchmarkV2(file_name=file,model_obj=model_obj,sio=socketio,channel="benchmark2")
-        
+
+    @socketio.on('benchmark_quantization')
+    def benchmark_quantization(data):
+        # Compares the fp32 and int8 versions of a model: accuracy (SQuAD file)
+        # for search models, ROUGE (dataset) for summarization models
+        print(data)
+        emit('benchmark_quantization',{"response":"Starting fp32/int8 benchmark of " + data["model"]})
+        socketio.sleep(1)
+        model_options = server_config.get('model_options', {}).get(data["model"])
+
+        if "file" in data:
+            model_obj = get_model_object_from_name(data["model"], 'search', server_config)
+
+            def run_benchmark(model):
+                results = squad_benchmarkV2(file_name=data["file"], model_obj=model)
+                return {'accuracy': float(results["metrics"]["accuracy_prc"]),
+                        'avg_ts': float(results["times"]["avg_ts"])}
+        else:
+            model_obj = get_model_object_from_name(data["model"], 'summarization', server_config)
+            dataset_obj = get_object_from_name(data["dataset"], server_config, 'dataset')
+
+            def run_benchmark(model):
+                return rouge_benchmark(model, dataset_obj, int(data.get("num_examples", 50)))
+
+        results = quantization_benchmark(type(model_obj), run_benchmark, model_options)
+        emit('benchmark_quantization', results)
+
+    @socketio.on('benchmark_profiles')
+    def benchmark_profiles(data):
+        # Latency/ROUGE trade-off of the generation profiles of a summarization model
+        print(data)
+        emit('benchmark_profiles',{"response":"Starting generation profiles benchmark of " + data["model"]})
+        socketio.sleep(1)
+        model_obj = get_model_object_from_name(data["model"], 'summarization', server_config)
+        dataset_obj = get_object_from_name(data["dataset"], server_config, 'dataset')
+
+        results = profile_benchmark(model_obj, dataset_obj, data.get("profiles"),
+                                    int(data.get("num_examples", 50)))
+        emit('benchmark_profiles', results)
+
 
     return app,socketio
 
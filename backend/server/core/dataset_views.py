@@ -82,7 +82,7 @@ class DatasetFilesList(Resource):
             f.write(request_data['content'])
 
         for dataset_obj in current_app.config.get("server_config")['dataset_objs']:
-            if dataset_obj._dataset_name == "User":
+            if dataset_obj._get_class_name() == "User":
                 dataset_obj._update_file(request_data['file'])
                 break
 
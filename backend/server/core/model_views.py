@@ -2,10 +2,16 @@ import json
 from glob import glob
 import os.path as path
 import string
+import time
 from flask_restful import Resource, request
 from flask import current_app
 from backend.params.specifications import Specifications
-from backend.server.utils.helpers import get_model_object_from_name
+from backend.server.utils.helpers import get_model_object_from_name, get_search_summarizer_name, \
+    get_generation_profile_name, has_model_object
+from backend.server.utils.lazy_objects import is_loaded
+from backend.server.utils.prefork import REPLAY_HEADER
+from backend.models.interfaces.generation_profiles import get_generation_profile
+from backend.models.interfaces.model_search import summarize_answer
 class ModelsList(Resource):
     
     def get(self):
@@ -106,6 +112,12 @@ class ModelInitilize(Resource):
               properties:
                 response:
                   type: string
+                warning:
+                  type: string
+                  description: set when other pre-forked workers failed to load the document
+                failed_workers:
+                  type: array
+                  description: slots of these workers
                   
         """
         request_json = request.json
@@ -127,6 +139,21 @@ class ModelInitilize(Resource):
             model.load_model(str(request_json['filename']), str(request_json['filecontent']))
             print("INITIALIZEED THE FOLLOWING MODEL", model)
 
+            # Answers about the previous document of this model are stale
+            answer_cache = current_app.config.get("answer_cache")
+            if answer_cache is not None:
+                answer_cache.invalidate(model_name, keep_document_key=model._get_document_key())
+
+            # Pre-forked workers: the other workers load the document too
+            shared_requests = current_app.config.get("shared_requests")
+            if shared_requests is not None and REPLAY_HEADER not in request.headers:
+                failed = shared_requests.broadcast(request.path, request_json, key=model_name)
+                if failed:
+                    # Loaded here all the same, the failed workers are listed
+                    return {"response": "success",
+                            "warning": f"Document not loaded by the workers {failed}",
+                            "failed_workers": failed}, 200
+
         return {"response": "success"}, 200
 
 class ModelSummary(Resource):
@@ -149,13 +176,20 @@ class ModelSummary(Resource):
                 content:
                   type: string
                   example: There was once a sweet little maid who lived with her father and mother in a pretty little cottage at the edge of the village. At the further end of the wood was another pretty cottage and in it lived her grandmother.
+                profile:
+                  type: string
+                  description: generation profile (fast, balanced or quality)
+                  example: fast
         responses:
           200:
             description: successful operation
             schema:
               properties:
-                response:
+                result:
                   type: string
+                timings:
+                  type: array
+                  description: time spent in every stage (map/reduce of long documents)
                   
         """
 
@@ -165,8 +199,20 @@ class ModelSummary(Resource):
 
         model_name = request_json['model']
         text_to_summarize = request_json['content']
-        model = get_model_object_from_name(
-            model_name, 'summarization', current_app.config.get("server_config"))
+        server_config = current_app.config.get("server_config")
+        model = get_model_object_from_name(model_name, 'summarization', server_config)
+        if callable(getattr(model, "_summarize_text_with_timings", None)):
+            profile = get_generation_profile_name(server_config, request_json.get('profile'))
+            if profile is not None:
+                try:
+                    get_generation_profile(profile)
+                except ValueError as e:
+                    return str(e), 400
+
+            summarized_text, timings = model._summarize_text_with_timings(
+                text_to_summarize, profile=profile)
+            return {'result': summarized_text, 'timings': timings}, 200
+
         summarized_text = model._summarize_text(text_to_summarize)
 
         return {'result': summarized_text}, 200
@@ -191,6 +237,9 @@ class ModelSearch(Resource):
                 query:
                   type: string
                   example: With whome did sweet little maid lived with?
+                summarizer:
+                  type: string
+                  example: Bart
         responses:
           200:
             description: successful operation
@@ -216,6 +265,63 @@ class ModelSearch(Resource):
         model = get_model_object_from_name(model_name, 'search', current_app.config.get("server_config"))
         print("SEARCHING THE FOLLOWING MODEL", model)
 
+        # Summarization model of the passages, if the request or the YAML file asks for one
+        summarizer_name = get_search_summarizer_name(
+            current_app.config.get("server_config"), request_json.get('summarizer'))
+        if summarizer_name and not has_model_object(
+                summarizer_name, 'summarization', current_app.config.get("server_config")):
+            return "Unknown summarizer '{}'".format(summarizer_name), 400
+
+        # Same question on the same document: skip retrieval and the reader
+        answer_cache = current_app.config.get("answer_cache")
+        document_key = model._get_document_key()
+        if answer_cache is not None and document_key is not None:
+            t_s = time.time()
+            res = answer_cache.get(model_name, document_key, query, summarizer_name)
+            if res is not None:
+                return {'result': res, 'latency': time.time() - t_s, 'cached': True}, 200
+
         res, latency = model.file_search(query)
 
-        return {'result': res, 'latency': latency}, 200
\ No newline at end of file
+        if summarizer_name:
+            # Loaded on cache misses only
+            summarizer = get_model_object_from_name(
+                summarizer_name, 'summarization', current_app.config.get("server_config"))
+            t_s = time.time()
+            sum_docs = summarize_answer([r['orig'] for r in res], summarizer)
+            for r, s in zip(res, sum_docs):
+                r['sum'] = s
+            latency += time.time() - t_s
+
+        if answer_cache is not None and document_key is not None:
+            answer_cache.put(model_name, document_key, query, res, summarizer_name)
+
+        return {'result': res, 'latency': latency, 'cached': False}, 200
+
+    def get(self):
+        """
+        Search Statistics
+        ---
+        tags:
+          - Model Endpoints
+        responses:
+          200:
+            description: Hit/miss counters of the answer cache and queue metrics of the readers
+            schema:
+              properties:
+                answer_cache:
+                  type: object
+                reader_queues:
+                  type: object
+        """
+        server_config = current_app.config.get("server_config")
+        answer_cache = current_app.config.get("answer_cache")
+
+        reader_queues = {}
+        for model in server_config['model_objs'].get('search', []):
+            # Statistics do not load the models still behind a handle
+            if is_loaded(model) and callable(getattr(model, "_get_reader_stats", None)):
+                reader_queues[model._get_class_name()] = model._get_reader_stats()
+
+        return {'answer_cache': None if answer_cache is None else answer_cache.stats(),
+                'reader_queues': reader_queues}, 200
\ No newline at end of file
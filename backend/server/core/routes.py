@@ -1,4 +1,4 @@
-from .views import Default,ResetServer,Models,Config
+from .views import Default,ResetServer,Models,Config,Readiness
 from .model_views import ModelsList,ModelDetail,ModelInitilize,ModelSearch,ModelSummary
 from .dataset_views import DatasetsList,DatasetFilesList,DatasetFilesDetails
 
@@ -12,6 +12,10 @@ routes_dict = [
         "endpoint": ['/config'],
         "resource":Config
     },
+    {
+        "endpoint": ['/ready'],
+        "resource":Readiness
+    },
     {
         "endpoint": ['/get_model_checklist'],
         "resource":Models
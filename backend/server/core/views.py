@@ -1,6 +1,8 @@
 import json
+import os
 from flask_restful import Resource, Api, fields, marshal_with
 from flask import current_app,request
+from backend.server.utils.lazy_objects import load_state
 
 
 class Default(Resource):
@@ -75,3 +77,52 @@ class Models(Resource):
         return {'data': select_model_options}
 
 
+class Readiness(Resource):
+
+    def get(self):
+        """
+        Readiness of the models and datasets
+        ---
+        tags:
+          - Basic
+        parameters:
+          - in: query
+            name: object
+            type: string
+            required: false
+            description: class name of a model or dataset (503 until it is loaded)
+        responses:
+          200:
+            description: Load state (pending, loading, ready or failed) and load time of every object
+            schema:
+              properties:
+                ready:
+                  type: boolean
+                objects:
+                  type: array
+                startup:
+                  type: object
+                  description: wall time, peak RSS and per-object RSS growth (approximate
+                    when loading concurrently) of the startup loading, once finished
+                pid:
+                  type: integer
+                  description: process of the server (worker) answering
+          503:
+            description: The requested object is not loaded yet
+        """
+        server_config = current_app.config["server_config"]
+
+        objects = []
+        for task, model_objs in server_config['model_objs'].items():
+            objects += [dict(load_state(model), task=task) for model in model_objs]
+        objects += [dict(load_state(dataset), task=None) for dataset in server_config['dataset_objs']]
+
+        if 'object' in request.args:
+            states = [o for o in objects if o['name'] == request.args['object']]
+            if not states:
+                return "That object doesn't exist", 404
+            ready = all(o['state'] == 'ready' for o in states)
+            return {'ready': ready, 'objects': states, 'pid': os.getpid()}, 200 if ready else 503
+
+        return {'ready': all(o['state'] == 'ready' for o in objects), 'objects': objects,
+                'startup': current_app.config.get('startup_report') or None, 'pid': os.getpid()}, 200
@@ -0,0 +1,166 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+import collections
+import threading
+import time
+
+
+def normalize_query(query):
+    """Normalizes a query so that trivially different spellings of the same
+    question share a cache entry (case and whitespace). Punctuation is kept,
+    the search models may parse it (phrases, field:value, a-b)
+
+    :param query: Input query
+    :type query: str
+    :return: Normalized query
+    :rtype: str
+    """
+    return " ".join(query.lower().split())
+
+
+class AnswerCache():
+    """
+    A bounded cache of /search answers with LRU and TTL eviction
+
+    Entries are keyed by (model class, document key, normalized query,
+    variant), where the document key is the content hash of the document
+    loaded by the model and the variant covers the other request options
+    changing the answer (summarizer...).
+
+
+    Attributes
+    ----------
+    _max_size : int
+        Maximum number of cached answers
+    _ttl : float
+        Number of seconds an answer stays valid, None for no expiration
+    _entries : OrderedDict
+        key -> (expiration time, answer), from least to most recently used
+    hits : int
+        Number of lookups answered from the cache
+    misses : int
+        Number of lookups that had to run the model
+
+    Methods
+    -------
+    get(self, model_class, document_key, query, variant=None):
+        Returns the cached answer, or None.
+
+    put(self, model_class, document_key, query, answer, variant=None):
+        Caches an answer.
+
+    invalidate(self, model_class=None, keep_document_key=None):
+        Drops the answers of a model (or all of them).
+
+    """
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(model_class, document_key, query, variant):
+        return (model_class, document_key, normalize_query(query), variant)
+
+    def get(self, model_class, document_key, query, variant=None):
+        """Returns the cached answer to a query, None on a miss
+
+        :param model_class: Class name of the search model
+        :type model_class: str
+        :param document_key: Content hash of the document loaded by the model
+        :type document_key: str
+        :param query: Input query
+        :type query: str
+        :param variant: Other options of the request, defaults to None
+        :type variant: str, optional
+        :return: The cached answer
+        :rtype: object
+        """
+        key = self._key(model_class, document_key, query, variant)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.time()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+
+        return None
+
+    def put(self, model_class, document_key, query, answer, variant=None):
+        """Caches the answer to a query, evicting the least recently used
+        answers beyond max_size
+
+        :param model_class: Class name of the search model
+        :type model_class: str
+        :param document_key: Content hash of the document loaded by the model
+        :type document_key: str
+        :param query: Input query
+        :type query: str
+        :param answer: Answer to cache
+        :type answer: object
+        :param variant: Other options of the request, defaults to None
+        :type variant: str, optional
+        """
+        if self._max_size <= 0:
+            return
+
+        key = self._key(model_class, document_key, query, variant)
+        expires = None if self._ttl is None else time.time() + self._ttl
+
+        with self._lock:
+            self._entries[key] = (expires, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, model_class=None, keep_document_key=None):
+        """Drops the cached answers of a model, or of every model
+
+        :param model_class: Class name of the search model, defaults to None (all models)
+        :type model_class: str, optional
+        :param keep_document_key: Document whose answers are kept, defaults to None
+        :type keep_document_key: str, optional
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if model_class is not None and key[0] != model_class:
+                    continue
+                if keep_document_key is not None and key[1] == keep_document_key:
+                    continue
+                del self._entries[key]
+
+    def stats(self):
+        """Returns the size of the cache and its hit/miss counters
+
+        :return: Statistics
+        :rtype: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'max_size': self._max_size, 'ttl': self._ttl,
+                    'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -22,6 +22,8 @@ import os
 import json
 import time
 
+from backend.server.utils.lazy_objects import LazyObject, unwrap
+
 
 def profile(func):
     def wrap(*args, **kwargs):
@@ -41,7 +43,7 @@ def profile(func):
 
 
 @profile
-def get_list_objects(list_objects_str, task, object_type):
+def get_list_objects(list_objects_str, task, object_type, objects_options=None, lazy=False):
     """ 
     Function that takes as input a list of strings of the models we want to use
     for the dashboard and that returns a list of the different models as 
@@ -50,6 +52,12 @@ def get_list_objects(list_objects_str, task, object_type):
     ----------
     list_models_str : list of Strings
       List of the models we want to use for the dashboard as Strings
+    objects_options : dict
+      Keyword arguments of the constructor of each object, by object name
+      (the 'model_options' section of the YAML file)
+    lazy : bool
+      Whether to return handles instantiating the objects on first use
+      (LazyObject) instead of the objects
     Returns
     -------
     list_models_obj : list of Model objects
@@ -58,24 +66,38 @@ def get_list_objects(list_objects_str, task, object_type):
 
     list_objects = []
 
+    if objects_options is None:
+        objects_options = {}
+
     for object_name in list_objects_str:
-        object_var = call_object_class_from_name(
-            object_name, task, object_type)
+        if lazy:
+            object_var = LazyObject(
+                object_name, object_type,
+                _object_factory(object_name, task, object_type, objects_options.get(object_name)),
+                info_module=("backend." + object_type + '.' + task + '.' + object_name
+                             if object_type == 'models' else None))
+        else:
+            object_var = call_object_class_from_name(
+                object_name, task, object_type, objects_options.get(object_name))
 
         list_objects.append(object_var)
 
     return list_objects
 
 
+def _object_factory(object_name, task, object_type, object_options):
+    return lambda: call_object_class_from_name(object_name, task, object_type, object_options)
+
+
 @profile
-def call_object_class_from_name(object_name, task, object_type):
+def call_object_class_from_name(object_name, task, object_type, object_options=None):
     print("calling_object_class_from_name")
     # Get the class as a variable
     object_class = import_module(
         "backend." + object_type + '.' + task + '.' + object_name).__getattribute__(object_name)
 
     # Call the class
-    object_var = object_class()
+    object_var = object_class(**(object_options or {}))
     return object_var
 
 
@@ -96,7 +118,8 @@ def get_object_from_name(object_name, params, object_type):
         if object_name == object_active:
             current_object = object_iter
 
-    return current_object
+    # Objects behind a handle are loaded on first use
+    return unwrap(current_object)
 
 
 def dump_yaml(data, path):
@@ -137,6 +160,52 @@ def get_model_object_from_name(model_name, task, data_dict):
         if model_name == model_active:
             current_model = model
 
-    return current_model
+    # Models behind a handle are loaded on first use
+    return unwrap(current_model)
+
+
+def has_model_object(model_name, task, data_dict):
+    """
+    Function that returns whether the YAML file has a model of the given class
+    name for a task, without loading it.
+    """
+
+    try:
+        list_objs = data_dict['states']['model_dict'][task]
+    except:
+        list_objs = data_dict.get('model_objs', {}).get(task, [])
+
+    return any(model._get_class_name() == model_name for model in list_objs)
+
+
+def get_search_summarizer_name(data_dict, requested_name=None):
+    """
+    Function that returns the class name of the summarization model used to
+    summarize the passages found by the search models: the one of the request,
+    else 'search_summarizer' in the 'function' section of the YAML file.
+    Returns None when neither is set (the passages are not summarized) or when
+    the dashboard has no summarization model.
+    """
+
+    summarization_objs = data_dict.get('model_objs', {}).get('summarization', [])
+    if not summarization_objs:
+        return None
+
+    if requested_name:
+        return requested_name
+
+    return data_dict.get('function', {}).get('search_summarizer') or None
+
+
+def get_generation_profile_name(data_dict, requested_name=None):
+    """
+    Function that returns the generation profile of a summarization request:
+    the one of the request, else 'generation_profile' in the 'function'
+    section of the YAML file. Returns None when neither is set, in which case
+    each model uses its own (see the 'model_options' section).
+    """
 
+    if requested_name:
+        return requested_name
 
+    return data_dict.get('function', {}).get('generation_profile') or None
@@ -0,0 +1,287 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+import resource
+import sys
+import threading
+import time
+
+
+MODEL_LOADING = ['eager', 'background', 'on_demand']
+
+# Attributes of the handle itself, never forwarded to the object
+_HANDLE_ATTRIBUTES = {'_object_name', '_object_type', '_factory', '_info_module', '_static_info',
+                      '_object', '_state', '_error', '_load_time', '_lock'}
+
+
+class LazyObject():
+    """
+    A handle on a model or dataset of the YAML file, instantiating it on
+    first use (or when warmed up in the background)
+
+    The class name and the info of a model are available without loading it.
+    Any other attribute loads the object, once, and is forwarded to it.
+
+
+    Attributes
+    ----------
+    _object_name : str
+        Class name of the object (ElasticBERT, Bart, Squad...)
+    _object_type : str
+        'models' or 'datasets'
+    _factory : callable
+        Function instantiating the object
+    _info_module : str
+        Module defining the get_*_info function of a model, defaults to None
+    _object : object
+        The object, None until loaded
+    _state : str
+        'pending', 'loading', 'ready' or 'failed'
+    _load_time : float
+        Number of seconds it took to instantiate the object
+
+    Methods
+    -------
+    _load(self):
+        Returns the object, instantiating it on the first call.
+
+    _get_load_state(self):
+        Returns the load state and load time of the object.
+
+    """
+
+    def __init__(self, object_name, object_type, factory, info_module=None):
+        self._object_name = object_name
+        self._object_type = object_type
+        self._factory = factory
+        self._info_module = info_module
+        self._static_info = None
+        self._object = None
+        self._state = 'pending'
+        self._error = None
+        self._load_time = None
+        self._lock = threading.Lock()
+
+    def _get_class_name(self):
+        return self._object_name
+
+    @property
+    def _info(self):
+        if self._object is not None or self._info_module is None:
+            return self._load()._info
+
+        # The info of a model is given by a function of its module, so the
+        # model lists of the dashboard do not load every model
+        if self._static_info is None:
+            module = import_module(self._info_module)
+            getters = [f for name, f in vars(module).items()
+                       if name.startswith('get_') and name.endswith('_info') and callable(f)]
+            if len(getters) != 1:
+                return self._load()._info
+            self._static_info = getters[0]()
+
+        return self._static_info
+
+    def _load(self):
+        """Returns the object, instantiating it on the first call (concurrent
+        callers wait for the same instantiation). An object that failed to
+        load is retried on the next call.
+
+        :return: The object
+        :rtype: object
+        """
+        if self._object is not None:
+            return self._object
+
+        with self._lock:
+            if self._object is None:
+                self._state = 'loading'
+                t_s = time.time()
+                try:
+                    self._object = self._factory()
+                except Exception as e:
+                    self._state = 'failed'
+                    self._error = repr(e)
+                    raise
+                finally:
+                    self._load_time = time.time() - t_s
+
+                self._state = 'ready'
+                self._error = None
+                print(f"(LazyObject) > Loaded {self._object_name} in {round(self._load_time, 2)}s")
+
+        return self._object
+
+    def _get_load_state(self):
+        """Returns the load state of the object
+
+        :return: name, type, state, load_time (in seconds) and error
+        :rtype: dict
+        """
+        return {'name': self._object_name, 'type': self._object_type, 'state': self._state,
+                'load_time': self._load_time, 'error': self._error}
+
+    def __getattr__(self, name):
+        # Only called for the attributes the handle does not have
+        if name.startswith('__') or name in _HANDLE_ATTRIBUTES:
+            raise AttributeError(name)
+
+        return getattr(self._load(), name)
+
+    def __deepcopy__(self, memo):
+        # Copies of the server config share the objects
+        return self
+
+
+def unwrap(obj):
+    """Returns the object behind a handle, loading it if needed
+
+    :param obj: A handle, or an object (returned as is)
+    :type obj: LazyObject or object
+    :return: The object
+    :rtype: object
+    """
+    if isinstance(obj, LazyObject):
+        return obj._load()
+
+    return obj
+
+
+def is_loaded(obj):
+    """Whether an object can be used without loading it
+
+    :param obj: A handle, or an object
+    :type obj: LazyObject or object
+    :rtype: bool
+    """
+    return not isinstance(obj, LazyObject) or obj._object is not None
+
+
+def load_state(obj):
+    """Returns the load state of an object (always 'ready' for an object that
+    is not behind a handle)
+
+    :param obj: A handle, or an object
+    :type obj: LazyObject or object
+    :rtype: dict
+    """
+    if isinstance(obj, LazyObject):
+        return obj._get_load_state()
+
+    return {'name': obj._get_class_name(), 'type': None, 'state': 'ready',
+            'load_time': None, 'error': None}
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the process
+
+    :return: Peak RSS in MB
+    :rtype: float
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def current_rss_mb():
+    """Returns the current resident set size of the process (Linux only)
+
+    :return: RSS in MB, None where /proc/self/statm does not exist
+    :rtype: float
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return None
+
+    return resident_pages * resource.getpagesize() / (1024 * 1024)
+
+
+def load_all(objects, max_workers=4):
+    """Loads handles concurrently in a bounded pool of threads (tokenizer
+    loading, weight deserialization and dataset loading release the GIL).
+    An object failing to load does not stop the others: its error is
+    recorded in its handle and in the report, and it is retried on first use.
+
+    :param objects: Handles to load
+    :type objects: list
+    :param max_workers: Number of objects loaded at the same time, defaults to 4
+    :type max_workers: int, optional
+    :return: Startup report: total wall time, peak and final RSS of the
+        process (in MB) and, per object, its load state, load time and the
+        growth of the RSS of the process while it loaded. The RSS growth is
+        approximate when objects load concurrently (it includes the memory
+        of the objects loading at the same time), see 'rss_approximate'
+    :rtype: dict
+    """
+    t_s = time.time()
+
+    def load(obj):
+        rss_before = current_rss_mb()
+        try:
+            unwrap(obj)
+        except Exception as e:
+            print(f"(load_all) > Could not load {obj._get_class_name()}: {e!r}")
+        rss_after = current_rss_mb()
+
+        rss_delta = None if rss_before is None else rss_after - rss_before
+        return dict(load_state(obj), rss_delta_mb=rss_delta)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='load') as pool:
+        objects_report = list(pool.map(load, objects))
+
+    report = {'wall_time': time.time() - t_s, 'peak_rss_mb': peak_rss_mb(), 'rss_mb': current_rss_mb(),
+              'max_workers': max_workers, 'rss_approximate': max_workers > 1 and len(objects) > 1,
+              'objects': objects_report}
+
+    print(f"(load_all) > Loaded {len(objects)} objects in {round(report['wall_time'], 2)}s "
+          f"(peak RSS {round(report['peak_rss_mb'])} MB)")
+    approximate = '~' if report['rss_approximate'] else ''
+    for o in objects_report:
+        load_time = 'n/a' if o['load_time'] is None else f"{round(o['load_time'], 2)}s"
+        rss_delta = 'n/a' if o['rss_delta_mb'] is None else f"{approximate}+{round(o['rss_delta_mb'])} MB"
+        print(f"    {o['name']:<16} {o['state']:<8} {load_time:>8}  {rss_delta}")
+
+    return report
+
+
+def warm_up(objects, max_workers=4, report=None):
+    """Loads handles in a background thread (see load_all), so that the
+    server takes requests for the objects already loaded in the meantime
+
+    :param objects: Handles to load
+    :type objects: list
+    :param max_workers: Number of objects loaded at the same time, defaults to 4
+    :type max_workers: int, optional
+    :param report: Dictionary updated with the startup report once every
+        object is loaded, defaults to None
+    :type report: dict, optional
+    :return: The warm-up thread
+    :rtype: threading.Thread
+    """
+    def run():
+        startup_report = load_all(objects, max_workers)
+        if report is not None:
+            report.update(startup_report)
+
+    thread = threading.Thread(target=run, name='warm-up', daemon=True)
+    thread.start()
+
+    return thread
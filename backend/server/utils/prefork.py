@@ -0,0 +1,400 @@
+# Copyright 2022 Cisco Systems, Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# SPDX-License-Identifier: Apache-2.0
+
+
+"""
+Pre-forked serving: the master process loads the models, opens the listening
+socket and forks the workers. The workers inherit both: model weights are
+shared copy-on-write (inference does not write to them), and every worker
+accepts connections on the same socket, so the kernel spreads the clients
+across the idle workers. A worker that dies is replaced by a new fork of the
+master, which still holds the weights, so nothing is reloaded from disk.
+
+The models are loaded, and the warm-up thread is joined, before forking: a
+fork copies the memory of the master but only its calling thread, so a lock
+held by another thread at that moment would never be released in the workers.
+The model_loading setting is therefore ignored with several workers, every
+model and dataset is loaded before serving (as with 'eager').
+
+Every worker has its own copy of the state changed by requests: the document
+loaded into a search model, its index and the answer cache. The requests
+changing the document of a search model are replayed on every other worker
+(see SharedRequests), which loads and indexes the document again (indexes
+named after the content of the document are reused when persisted), and
+invalidates its own answer cache. Any other state stays per worker: answers
+cached by one worker are not seen by the others.
+
+Socket.IO clients must use the websocket transport (a long-polling session
+would be spread across workers).
+"""
+
+import fcntl
+import gc
+import hashlib
+import http.client
+import json
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+
+# Header of the requests replayed on the other workers, which are not replayed again
+REPLAY_HEADER = 'X-Prefork-Replay'
+
+
+def make_listener(ip, port, backlog=2048):
+    """Returns a listening TCP socket, to be shared by the workers
+
+    :param ip: Address to listen on
+    :type ip: str
+    :param port: Port to listen on
+    :type port: int
+    :param backlog: Maximum number of pending connections, defaults to 2048
+    :type backlog: int, optional
+    :return: The socket
+    :rtype: socket.socket
+    """
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((ip, port))
+    listener.listen(backlog)
+    listener.set_inheritable(True)
+    # Every worker waits for connections on the socket, only one gets each of them
+    listener.setblocking(False)
+
+    return listener
+
+
+def serve_app(app, socketio, listener, private_listener=None):
+    """Serves a Flask-SocketIO application on an already listening socket,
+    with the server of the async mode of Socket.IO
+
+    :param app: Flask application
+    :type app: flask.Flask
+    :param socketio: Socket.IO server of the application
+    :type socketio: flask_socketio.SocketIO
+    :param listener: Listening socket
+    :type listener: socket.socket
+    :param private_listener: Listening socket of this worker only (replays of
+        the other workers), defaults to None
+    :type private_listener: socket.socket, optional
+    """
+    if socketio.async_mode == 'eventlet':
+        import eventlet
+        import eventlet.greenio
+        import eventlet.wsgi
+
+        if private_listener is not None:
+            eventlet.spawn(eventlet.wsgi.server, eventlet.greenio.GreenSocket(private_listener),
+                           app, log_output=False)
+        eventlet.wsgi.server(eventlet.greenio.GreenSocket(listener), app, log_output=False)
+
+    elif socketio.async_mode == 'gevent':
+        import gevent
+        from gevent import pywsgi
+
+        # The worker was forked without gevent knowing it
+        gevent.reinit()
+
+        try:
+            from geventwebsocket.handler import WebSocketHandler
+            kwargs = {'handler_class': WebSocketHandler}
+        except ImportError:
+            kwargs = {}
+
+        if private_listener is not None:
+            pywsgi.WSGIServer(private_listener, app, log=None, **kwargs).start()
+        pywsgi.WSGIServer(listener, app, log=None, **kwargs).serve_forever()
+
+    else:
+        from werkzeug.serving import make_server
+
+        def serve(sock):
+            host, port = sock.getsockname()[:2]
+            make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+
+        if private_listener is not None:
+            threading.Thread(target=serve, args=(private_listener,), daemon=True).start()
+        serve(listener)
+
+
+def blocking_runner(async_mode):
+    """Returns a function running a blocking call (sockets of the standard
+    library...) without blocking the other requests of a worker: in a thread
+    of the hub under gevent (not monkey patched), of the thread pool of
+    eventlet, or directly with threads
+
+    :param async_mode: Async mode of Socket.IO (gevent, eventlet, threading)
+    :type async_mode: str
+    :return: Function called with a function and its arguments
+    :rtype: callable
+    """
+    if async_mode == 'gevent':
+        import gevent
+        # The hub of the calling worker, created after the fork
+        return lambda function, *args: gevent.get_hub().threadpool.apply(function, args)
+
+    if async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute
+
+    return lambda function, *args: function(*args)
+
+
+class SharedRequests():
+    """
+    Requests changing the state of a worker (the document of a search
+    model...), replayed on every other worker
+
+    Every worker also serves the application on a private listener of the
+    loopback interface. The worker handling such a request replays it on the
+    private listeners of the others before answering, so that the next
+    request finds the same state whichever worker gets it. Replays are
+    serialized by a file lock: two workers replaying on each other at the
+    same time would wait for each other forever. The last request of every
+    key is logged, and replayed by the workers started later (restarts).
+
+
+    Attributes
+    ----------
+    listeners : list
+        Private listening socket of every worker slot
+    slot : int
+        Slot of the current worker, None in the master
+    _log_dir : str
+        Directory of the logged requests and of the lock
+    _sleep : callable
+        Sleep function of the async mode, so that a worker waiting for the
+        lock keeps serving the replays of the others
+    _run_blocking : callable
+        Runs the replays (blocking HTTP requests) without blocking the other
+        requests of the worker, see blocking_runner
+    _timeout : float
+        Maximum number of seconds a worker takes to replay a request
+
+    Methods
+    -------
+    broadcast(self, path, payload, key):
+        Logs a request and replays it on every other worker.
+
+    replay_log(self, app):
+        Replays the logged requests on the application of a new worker.
+
+    close(self):
+        Closes the private listeners and removes the log.
+
+    """
+
+    def __init__(self, num_workers, sleep=time.sleep, timeout=600, run_blocking=None):
+        self.listeners = [make_listener('127.0.0.1', 0) for _ in range(num_workers)]
+        self.slot = None
+        self._log_dir = tempfile.mkdtemp(prefix='prefork-')
+        self._sleep = sleep
+        self._run_blocking = run_blocking or blocking_runner('threading')
+        self._timeout = timeout
+
+    def broadcast(self, path, payload, key):
+        """Logs a POST request and replays it on every other worker, once the
+        requests replayed before it are done
+
+        :param path: Path of the request
+        :type path: str
+        :param payload: JSON body of the request
+        :type payload: dict
+        :param key: Requests with the same key replace each other in the log
+            (model name...)
+        :type key: str
+        :return: Slots of the workers that failed to replay it
+        :rtype: list
+        """
+        # Each worker opens the lock itself, a file inherited from the master
+        # would share its lock with every worker
+        with open(os.path.join(self._log_dir, 'lock'), 'a') as lock:
+            while True:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    self._sleep(0.05)
+
+            # Logged first: a worker starting now either replays the log or
+            # gets the request on its private listener (or both)
+            self._log(key, {'path': path, 'payload': payload, 'time': time.time()})
+
+            return [slot for slot, listener in enumerate(self.listeners)
+                    if slot != self.slot and not self._run_blocking(self._replay_on, listener, path, payload)]
+
+    def _log(self, key, entry):
+        file_path = os.path.join(self._log_dir, hashlib.sha256(key.encode()).hexdigest() + '.json')
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump(entry, f)
+        os.replace(file_path + '.tmp', file_path)
+
+    def _replay_on(self, listener, path, payload):
+        host, port = listener.getsockname()[:2]
+        connection = http.client.HTTPConnection(host, port, timeout=self._timeout)
+        try:
+            connection.request('POST', path, json.dumps(payload),
+                               {'Content-Type': 'application/json', REPLAY_HEADER: '1'})
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 300:
+                print(f"(SharedRequests) > Replay of {path} on port {port} failed: {response.status}")
+            return response.status < 300
+        except OSError as e:
+            print(f"(SharedRequests) > Replay of {path} on port {port} failed: {e!r}")
+            return False
+        finally:
+            connection.close()
+
+    def replay_log(self, app):
+        """Replays the logged requests, oldest first, on the application of a
+        worker before it serves
+
+        :param app: Flask application
+        :type app: flask.Flask
+        """
+        entries = []
+        for file_name in os.listdir(self._log_dir):
+            if file_name.endswith('.json'):
+                with open(os.path.join(self._log_dir, file_name)) as f:
+                    entries.append(json.load(f))
+
+        client = app.test_client()
+        for entry in sorted(entries, key=lambda e: e['time']):
+            response = client.post(entry['path'], json=entry['payload'], headers={REPLAY_HEADER: '1'})
+            if response.status_code >= 300:
+                print(f"(SharedRequests) > Replay of {entry['path']} failed: {response.status_code}")
+
+    def close(self):
+        """Closes the private listeners and removes the log"""
+        for listener in self.listeners:
+            listener.close()
+
+        for file_name in os.listdir(self._log_dir):
+            os.remove(os.path.join(self._log_dir, file_name))
+        os.rmdir(self._log_dir)
+
+
+class PreforkServer():
+    """
+    Master process of the pre-forked serving
+
+
+    Attributes
+    ----------
+    _serve : callable
+        Function serving requests, run by every worker with its slot
+    _num_workers : int
+        Number of worker processes
+    _threads_per_worker : int
+        Number of intra-op threads of torch in a worker, defaults to the
+        number of cores divided by the number of workers
+    _workers : dict
+        pid -> worker slot of the running workers
+    restarts : int
+        Number of workers restarted after a crash
+
+    Methods
+    -------
+    run(self):
+        Forks the workers and restarts the ones that die, until SIGINT/SIGTERM.
+
+    """
+
+    # Workers dying sooner than this after their start are restarted with a delay
+    MIN_WORKER_LIFETIME = 1.0
+
+    def __init__(self, serve, num_workers, threads_per_worker=None):
+        self._serve = serve
+        self._num_workers = num_workers
+        self._threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self._workers = {}
+        self._started_at = {}
+        self._stopping = False
+        self.restarts = 0
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            self._run_worker(slot)
+
+        self._workers[pid] = slot
+        self._started_at[pid] = time.time()
+        print(f"(PreforkServer) > Worker {slot} started (pid {pid})")
+
+    def _run_worker(self, slot):
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        code = 0
+        try:
+            # Workers share the cores instead of each spawning one thread per core
+            import torch
+            torch.set_num_threads(self._threads_per_worker)
+
+            self._serve(slot)
+        except BaseException as e:
+            print(f"(PreforkServer) > Worker {slot} (pid {os.getpid()}) failed: {e!r}")
+            code = 1
+        finally:
+            # Never return into the code of the master
+            os._exit(code)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+        for pid in list(self._workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        """Forks the workers, then waits for them and replaces the ones that
+        exit, until the master gets SIGINT or SIGTERM"""
+        # Objects allocated so far (models...) are left alone by the garbage
+        # collector of the workers, which would otherwise write to their pages
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+
+        for slot in range(self._num_workers):
+            self._spawn(slot)
+
+        while self._workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            slot = self._workers.pop(pid, None)
+            started_at = self._started_at.pop(pid, time.time())
+            if slot is None or self._stopping:
+                continue
+
+            print(f"(PreforkServer) > Worker {slot} (pid {pid}) exited with status {status}, restarting it")
+            if time.time() - started_at < self.MIN_WORKER_LIFETIME:
+                time.sleep(self.MIN_WORKER_LIFETIME)
+            self.restarts += 1
+            self._spawn(slot)
@@ -0,0 +1,54 @@
+import time
+import unittest
+
+from backend.server.utils.answer_cache import AnswerCache, normalize_query
+
+
+class AnswerCacheTestcase(unittest.TestCase):
+    def test_normalized_query(self):
+        cache = AnswerCache()
+        cache.put('ElasticBERT', 'doc-1', 'Who lived with the maid?', ['answer'])
+
+        assert normalize_query('  WHO lived with   the maid ') == 'who lived with the maid'
+        assert cache.get('ElasticBERT', 'doc-1', ' who lived with  the MAID?') == ['answer']
+        assert cache.get('ColBERT', 'doc-1', 'who lived with the maid?') is None
+        assert cache.get('ElasticBERT', 'doc-2', 'who lived with the maid?') is None
+        assert cache.get('ElasticBERT', 'doc-1', 'who lived with the maid?', 'Bart') is None
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def test_punctuation_is_kept(self):
+        # Queries the retrievers parse differently do not share an answer
+        assert normalize_query('little-maid') != normalize_query('little maid')
+        assert normalize_query('"little maid"') != normalize_query('little maid')
+        assert normalize_query('text:maid') != normalize_query('text maid')
+        assert normalize_query('Who lived with the maid?') != normalize_query('who lived with the maid')
+
+    def test_lru_eviction(self):
+        cache = AnswerCache(max_size=2)
+        cache.put('m', 'd', 'a', 1)
+        cache.put('m', 'd', 'b', 2)
+        cache.get('m', 'd', 'a')
+        cache.put('m', 'd', 'c', 3)
+
+        assert cache.get('m', 'd', 'b') is None
+        assert cache.get('m', 'd', 'a') == 1
+        assert cache.get('m', 'd', 'c') == 3
+
+    def test_ttl(self):
+        cache = AnswerCache(ttl=0.05)
+        cache.put('m', 'd', 'a', 1)
+        time.sleep(0.1)
+
+        assert cache.get('m', 'd', 'a') is None
+        assert cache.stats()['size'] == 0
+
+    def test_invalidate(self):
+        cache = AnswerCache()
+        cache.put('m', 'old', 'a', 1)
+        cache.put('m', 'new', 'a', 2)
+        cache.put('other', 'old', 'a', 3)
+        cache.invalidate('m', keep_document_key='new')
+
+        assert cache.get('m', 'old', 'a') is None
+        assert cache.get('m', 'new', 'a') == 2
+        assert cache.get('other', 'old', 'a') == 3
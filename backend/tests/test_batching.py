@@ -0,0 +1,103 @@
+import threading
+import unittest
+
+from backend.models.interfaces.batching import MicroBatcher
+
+
+class MicroBatcherTestcase(unittest.TestCase):
+    def test_concurrent_requests_share_a_batch(self):
+        batches = []
+
+        def process_batch(items):
+            batches.append(list(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait=0.5)
+        results = {}
+
+        def search(i):
+            results[i] = batcher.submit(i)
+
+        threads = [threading.Thread(target=search, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == {0: 0, 1: 2, 2: 4, 3: 6}
+        assert len(batches) == 1
+        stats = batcher.stats()
+        assert stats['requests'] == 4 and stats['batches'] == 1
+        assert stats['max_queue_depth'] == 4
+
+    def test_greenlets_share_a_batch(self):
+        import gevent
+
+        batches = []
+
+        def process_batch(items):
+            batches.append(list(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait=0.5)
+        greenlets = [gevent.spawn(batcher.submit, i) for i in range(4)]
+        gevent.joinall(greenlets, timeout=5)
+
+        assert [g.value for g in greenlets] == [0, 2, 4, 6]
+        assert len(batches) == 1
+        assert batcher.stats()['batches'] == 1
+
+        # The batcher keeps serving greenlets after its first batch
+        assert gevent.spawn(batcher.submit, 5).get(timeout=5) == 10
+
+    def test_greenlets_and_threads_share_a_batch(self):
+        import gevent
+
+        batches = []
+
+        def process_batch(items):
+            batches.append(sorted(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(process_batch, max_batch_size=8, max_wait=0.3)
+        results = {}
+
+        def search(i):
+            results[i] = batcher.submit(i)
+
+        # The first request comes from a thread, the others join its batch
+        threads = [threading.Thread(target=search, args=(i,)) for i in (0, 1)]
+        for t in threads:
+            t.start()
+
+        # The hub keeps running the other greenlets while two of them wait
+        # for the window of the batch to close
+        ticks = []
+
+        def tick():
+            while len(batches) == 0:
+                ticks.append(1)
+                gevent.sleep(0.01)
+
+        greenlets = [gevent.spawn(search, i) for i in (2, 3)] + [gevent.spawn(tick)]
+        gevent.joinall(greenlets, timeout=5)
+        for t in threads:
+            t.join(timeout=5)
+
+        assert results == {0: 0, 1: 2, 2: 4, 3: 6}
+        assert batches == [[0, 1, 2, 3]]
+        assert len(ticks) > 1
+
+        # Either kind of caller keeps being served, one after the other
+        assert gevent.spawn(batcher.submit, 5).get(timeout=5) == 10
+        assert batcher.submit(6) == 12
+        assert gevent.spawn(batcher.submit, 7).get(timeout=5) == 14
+
+    def test_errors_reach_the_callers(self):
+        def process_batch(items):
+            raise ValueError('reader failed')
+
+        batcher = MicroBatcher(process_batch, max_batch_size=2, max_wait=0)
+
+        with self.assertRaises(ValueError):
+            batcher.submit(1)
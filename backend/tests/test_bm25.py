@@ -0,0 +1,49 @@
+import math
+import unittest
+
+from backend.models.interfaces.bm25 import BM25Index, BM25Retriever, analyze
+
+
+DOCS = [
+    "Little Red Riding Hood lived with her mother at the edge of the village.",
+    "Her grandmother lived at the further end of the wood in a pretty cottage.",
+    "The wolf ate the grandmother and put on her cap, the wolf was hungry.",
+    "Everybody was happy that Little Red Riding Hood had escaped the wolf.",
+]
+
+
+def naive_bm25(query, docs, k1=1.2, b=0.75):
+    docs = [analyze(doc) for doc in docs]
+    avg_len = sum(len(doc) for doc in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        score = 0
+        for term in set(analyze(query)):
+            df = sum(term in d for d in docs)
+            if df == 0:
+                continue
+            tf = doc.count(term)
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avg_len))
+        scores.append(score)
+    return scores
+
+
+class BM25Testcase(unittest.TestCase):
+    def test_scores_match_reference(self):
+        index = BM25Index(DOCS)
+        for query in ["grandmother wolf", "Little Red Riding Hood", "cottage", "zebra"]:
+            for score, expected in zip(index.scores(query), naive_bm25(query, DOCS)):
+                self.assertAlmostEqual(float(score), expected, places=4)
+
+    def test_search_ranking(self):
+        index = BM25Index(DOCS)
+        hits = index.search("hungry wolf", size=2)
+        assert [doc_id for doc_id, _ in hits] == [2, 3]
+        assert index.search("zebra") == []
+
+    def test_retriever_response(self):
+        retriever = BM25Retriever()
+        retriever.index_documents(DOCS, 'red-riding-hood')
+        res = retriever.search("pretty cottage")
+        assert res['hits']['hits'][0]['_source']['text'] == DOCS[1]
@@ -0,0 +1,105 @@
+import os
+import random
+import tempfile
+import unittest
+
+import datasets
+from transformers import BartConfig, BertTokenizerFast
+
+from backend.models.interfaces.hugging_face_model_summarization import HuggingFaceModelSummarization
+
+
+WORDS = "there was once a sweet little maid who lived with her father and mother in cottage".split()
+
+
+class EchoModel():
+    """Seq2seq model whose summary of an input is the input itself"""
+
+    def __init__(self):
+        # 8 * 32 * 2 * 4 = 2048 bytes per token
+        self.config = BartConfig(d_model=32, encoder_layers=1, decoder_layers=1)
+        self.batches = []
+
+    def generate(self, input_ids, attention_mask=None, **kwargs):
+        self.batches.append({'shape': tuple(input_ids.shape), 'num_beams': kwargs['num_beams']})
+        return input_ids
+
+
+class Dataset():
+    """Dataset object of the datasets modules, with an in-memory split"""
+
+    def __init__(self, texts):
+        self._dataset_name = 'Stories'
+        self._split = 'test'
+        self._document_column = 'document'
+        self._dataset = {'test': datasets.Dataset.from_dict({'document': texts})}
+
+
+class DatasetSummarizationTestcase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        vocab_file = os.path.join(self.tmp.name, 'vocab.txt')
+        with open(vocab_file, 'w') as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+        tokenizer = BertTokenizerFast(vocab_file)
+
+        self.summarizer = HuggingFaceModelSummarization.__new__(HuggingFaceModelSummarization)
+        self.summarizer._info = {'name': 'Echo', 'class_name': 'Echo'}
+        self.summarizer._model_name = 'echo'
+        self.summarizer._model = EchoModel()
+        self.summarizer._tokenizer = tokenizer
+        self.summarizer._max_length = 64
+        self.summarizer._truncation = True
+        self.summarizer._quantize = False
+        self.summarizer._generation_profile = None
+        # 1 MB: 512 tokens times beams per batch
+        self.summarizer._batch_memory_budget = 1
+        self.summarizer._max_batch_size = 32
+        self.summarizer._checkpoint_size = 8
+
+        rng = random.Random(0)
+        self.texts = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 40))) for _ in range(30)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_batches_are_bucketed_by_length(self):
+        assert self.summarizer._max_batch_tokens(4) == 512
+
+        batches = list(self.summarizer._iter_summary_batches(self.texts))
+        lengths = [[len(self.texts[i].split()) + 2 for i in batch] for batch, _ in batches]
+
+        # Longest first, every batch sized for its longest input within the budget
+        flat = [length for batch in lengths for length in batch]
+        assert flat == sorted(flat, reverse=True)
+        for n, (batch, generated) in enumerate(zip(lengths, self.summarizer._model.batches)):
+            batch_size = max(1, min(32, 512 // (batch[0] * 4)))
+            # Only the last batch holds fewer inputs than fit
+            assert len(batch) == batch_size or (n == len(lengths) - 1 and len(batch) < batch_size)
+            assert generated['shape'] == (len(batch), batch[0]) and generated['num_beams'] == 4
+            assert len(batch) == 1 or len(batch) * batch[0] * 4 <= 512
+
+        # Short inputs share larger batches, each summary goes with its input
+        assert max(len(batch) for batch in lengths) > len(lengths[0])
+        assert sorted(i for batch, _ in batches for i in batch) == list(range(30))
+        for batch, summaries in batches:
+            assert summaries == [self.texts[i] for i in batch]
+
+        # A larger budget fits every input in one batch
+        self.summarizer._batch_memory_budget = 64
+        assert [len(batch) for batch, _ in self.summarizer._iter_summary_batches(self.texts)] == [30]
+
+    def test_summaries_are_written_in_the_order_of_the_examples(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            dataset = self.summarizer._summarize_dataset(Dataset(self.texts))
+            assert dataset._dataset['test']['result_Echo'] == self.texts
+
+            # A finished run is read back from the store, without generating
+            num_batches = len(self.summarizer._model.batches)
+            dataset = self.summarizer._summarize_dataset(Dataset(self.texts))
+            assert dataset._dataset['test']['result_Echo'] == self.texts
+            assert len(self.summarizer._model.batches) == num_batches
+        finally:
+            os.chdir(cwd)
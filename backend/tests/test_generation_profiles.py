@@ -0,0 +1,24 @@
+import unittest
+
+from backend.models.interfaces.generation_profiles import generation_kwargs, get_generation_profile
+
+
+class GenerationProfilesTestcase(unittest.TestCase):
+    def test_length_is_proportional_to_the_input(self):
+        short = generation_kwargs('balanced', 100, 142)
+        long = generation_kwargs('balanced', 400, 142)
+        assert short['max_new_tokens'] == 25
+        assert long['max_new_tokens'] == 100
+        assert short['min_length'] <= short['max_new_tokens']
+
+        # Bounded by the floor of the profile and the max length of the caller
+        assert generation_kwargs('balanced', 10, 142)['max_new_tokens'] == 24
+        assert generation_kwargs('balanced', 4000, 142)['max_new_tokens'] == 142
+        assert generation_kwargs('balanced', 10, 8)['max_new_tokens'] == 8
+
+    def test_profiles(self):
+        assert generation_kwargs('fast', 100, 142)['num_beams'] == 1
+        assert generation_kwargs('quality', 100, 142)['num_beams'] == 4
+        assert generation_kwargs({'num_beams': 3}, 100, 142)['num_beams'] == 3
+        with self.assertRaises(ValueError):
+            get_generation_profile('slow')
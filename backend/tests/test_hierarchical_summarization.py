@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+
+from transformers import BertTokenizerFast
+
+from backend.models.interfaces.hugging_face_model_summarization import HuggingFaceModelSummarization
+
+
+WORDS = "there was once a sweet little maid who lived with her father and mother in cottage".split()
+
+
+def make_summarizer(tokenizer, chunk_tokens, fan_out, max_depth):
+    """Summarization model with a tokenizer only, its generation being stubbed"""
+    summarizer = HuggingFaceModelSummarization.__new__(HuggingFaceModelSummarization)
+    summarizer._tokenizer = tokenizer
+    summarizer._max_length = 64
+    summarizer._hierarchical = True
+    summarizer._chunk_tokens = chunk_tokens
+    summarizer._partial_summary_tokens = 16
+    summarizer._fan_out = fan_out
+    summarizer._max_depth = max_depth
+    summarizer._generation_profile = None
+    summarizer.calls = []
+
+    def summarize_texts(texts, max_input_length=None, max_length=None, profile=None, **kwargs):
+        summarizer.calls.append({'texts': list(texts), 'max_length': max_length})
+        return ["summary %d" % len(summarizer.calls)] * len(texts)
+
+    summarizer._summarize_texts = summarize_texts
+    return summarizer
+
+
+class HierarchicalSummarizationTestcase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        vocab_file = os.path.join(self.tmp.name, 'vocab.txt')
+        with open(vocab_file, 'w') as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "."] + WORDS))
+        self.tokenizer = BertTokenizerFast(vocab_file)
+
+        # 20 sentences of 8 tokens
+        self.text = " ".join(["there was once a sweet little maid ."] * 20)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_map_reduce(self):
+        summarizer = make_summarizer(self.tokenizer, chunk_tokens=10, fan_out=2, max_depth=3)
+        summary, timings = summarizer._summarize_long_text(self.text)
+
+        # Map: one chunk per sentence (two do not fit), summarized fan_out at a time
+        map_calls = summarizer.calls[:10]
+        chunks = [text for call in map_calls for text in call['texts']]
+        assert len(chunks) == 20
+        assert all(len(call['texts']) == 2 and call['max_length'] == 16 for call in map_calls)
+        assert all(len(self.tokenizer(c, add_special_tokens=False)['input_ids']) <= 10 for c in chunks)
+        assert " ".join(chunks) == self.text
+
+        # Reduce: 20 -> 10 -> 5 partial summaries, then max_depth is reached
+        assert [(t['stage'], t['depth'], t['inputs']) for t in timings] == [
+            ('map', 0, 20), ('reduce', 1, 10), ('reduce', 2, 5), ('final', 3, 5)]
+        assert all(t['time'] >= 0 for t in timings)
+        assert len(summarizer.calls) == 10 + 5 + 3 + 1
+
+        # Final: the remaining partial summaries in a single input
+        final_call = summarizer.calls[-1]
+        assert len(final_call['texts']) == 1 and final_call['max_length'] == 64
+        assert summary == ["summary %d" % len(summarizer.calls)]
+
+    def test_reduce_stops_at_a_single_group(self):
+        summarizer = make_summarizer(self.tokenizer, chunk_tokens=10, fan_out=4, max_depth=10)
+        summary, timings = summarizer._summarize_long_text(self.text)
+
+        # 20 -> 5 -> 2 partial summaries, which fit in one group for the final summary
+        assert [(t['stage'], t['depth'], t['inputs']) for t in timings] == [
+            ('map', 0, 20), ('reduce', 1, 5), ('reduce', 2, 2), ('final', 3, 2)]
+
+        # Chunks of 16 tokens hold two sentences
+        summarizer = make_summarizer(self.tokenizer, chunk_tokens=16, fan_out=4, max_depth=10)
+        summary, timings = summarizer._summarize_long_text(self.text)
+        assert timings[0]['inputs'] == 10
+
+    def test_short_texts_are_summarized_at_once(self):
+        summarizer = make_summarizer(self.tokenizer, chunk_tokens=10, fan_out=2, max_depth=3)
+        summary, timings = summarizer._summarize_text_with_timings("there was once a maid .")
+
+        assert [(t['stage'], t['inputs']) for t in timings] == [('summarize', 1)]
+        assert summary == ["summary 1"]
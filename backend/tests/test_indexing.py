@@ -0,0 +1,285 @@
+import fnmatch
+import time
+import unittest
+
+from backend.models.interfaces import model_search
+from backend.models.interfaces.model_search import INDEX_NAME, ElasticRetriever, IndexLifecycle, \
+    bulk_index_into_elasticsearch, content_index_name, garbage_collect_indices, index_is_complete, search
+
+
+class FakeIndices():
+    """Indices API of the Elasticsearch client, recording the calls"""
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.fail_settings = False
+        # Mapping and creation date (ms) of every index
+        self.store = {}
+
+    def exists(self, index):
+        return index in self.store
+
+    def create(self, index, body=None, ignore=None):
+        self.calls.append(('create', index))
+        self.store[index] = {'mappings': {}, 'creation_date': str(int(time.time() * 1000))}
+
+    def delete(self, index):
+        self.calls.append(('delete', index))
+        del self.store[index]
+
+    def get(self, index):
+        return {name: {'settings': {'index': {'creation_date': info['creation_date']}}}
+                for name, info in self.store.items() if fnmatch.fnmatch(name, index)}
+
+    def get_mapping(self, index):
+        return {index: {'mappings': self.store[index]['mappings']}}
+
+    def put_mapping(self, index, body):
+        self.store[index]['mappings'].update(body)
+
+    def put_settings(self, index, body):
+        self.calls.append(('put_settings', index, body['index']['refresh_interval']))
+        if self.fail_settings and body['index']['refresh_interval'] is None:
+            raise ConnectionError("Elasticsearch went away")
+
+    def refresh(self, index):
+        self.calls.append(('refresh', index))
+
+
+class FakeElasticsearch():
+    def __init__(self):
+        self.calls = []
+        self.indices = FakeIndices(self.calls)
+
+    def search(self, index, body):
+        self.calls.append(('search', index))
+        return {'hits': {'hits': []}}
+
+
+class FakeBulk():
+    """streaming_bulk / parallel_bulk, sending the actions chunk by chunk, and
+    rejecting the documents containing 'reject'"""
+
+    def __init__(self, fail_after=None):
+        self.chunks = []
+        self.kwargs = []
+        self.fail_after = fail_after
+
+    def __call__(self, client, actions, chunk_size=500, **kwargs):
+        self.kwargs.append(kwargs)
+        actions = list(actions)
+        for start in range(0, len(actions), chunk_size):
+            chunk = actions[start:start + chunk_size]
+            self.chunks.append(len(chunk))
+            for action in chunk:
+                if self.fail_after is not None and sum(self.chunks) > self.fail_after:
+                    raise ConnectionError("Bulk request failed")
+                text = action['_source']['text']
+                if 'reject' in text:
+                    yield False, {'index': {'_index': action['_index'], 'status': 400, 'error': text}}
+                else:
+                    yield True, {'index': {'_index': action['_index'], 'status': 201}}
+
+
+class BulkIndexingTestcase(unittest.TestCase):
+    def setUp(self):
+        self.saved = model_search.es, model_search.index_lifecycle, \
+            model_search.helpers.streaming_bulk, model_search.helpers.parallel_bulk
+        model_search.es = self.es = FakeElasticsearch()
+        model_search.index_lifecycle = self.lifecycle = IndexLifecycle()
+        model_search.helpers.streaming_bulk = self.streaming_bulk = FakeBulk()
+        model_search.helpers.parallel_bulk = self.parallel_bulk = FakeBulk()
+
+        self.docs = ["doc %d" % i for i in range(10)] + ["reject me", "doc 11"]
+
+    def tearDown(self):
+        model_search.es, model_search.index_lifecycle, \
+            model_search.helpers.streaming_bulk, model_search.helpers.parallel_bulk = self.saved
+
+    def test_streaming_bulk(self):
+        num_indexed, errors = bulk_index_into_elasticsearch(
+            iter(self.docs), index_name='idx', chunk_size=5, max_retries=3, initial_backoff=1)
+
+        assert num_indexed == 11
+        assert [e['index']['error'] for e in errors] == ["reject me"]
+        assert self.streaming_bulk.chunks == [5, 5, 2]
+        assert self.streaming_bulk.kwargs[0]['max_retries'] == 3
+        assert self.parallel_bulk.chunks == []
+
+        # Refresh off while loading, then a single refresh
+        assert self.es.calls == [('put_settings', 'idx', '-1'), ('put_settings', 'idx', None), ('refresh', 'idx')]
+        assert self.lifecycle.is_ready('idx')
+
+    def test_parallel_bulk(self):
+        num_indexed, errors = bulk_index_into_elasticsearch(
+            self.docs, index_name='idx', chunk_size=4, thread_count=2)
+
+        assert (num_indexed, len(errors)) == (11, 1)
+        assert self.parallel_bulk.chunks == [4, 4, 4]
+        assert self.parallel_bulk.kwargs[0]['thread_count'] == 2
+        assert self.streaming_bulk.chunks == []
+
+    def test_wait_for_refresh_policy(self):
+        self.lifecycle.set_refresh_policy('wait_for')
+        bulk_index_into_elasticsearch(self.docs, index_name='idx')
+
+        assert self.streaming_bulk.kwargs[0]['refresh'] == 'wait_for'
+        assert self.es.calls == []
+        assert self.lifecycle.is_ready('idx')
+
+    def test_interrupted_ingestion_restores_the_index(self):
+        model_search.helpers.streaming_bulk = FakeBulk(fail_after=5)
+        with self.assertRaisesRegex(ConnectionError, "Bulk request failed"):
+            bulk_index_into_elasticsearch(self.docs, index_name='idx', chunk_size=5)
+        assert self.es.calls[-2:] == [('put_settings', 'idx', None), ('refresh', 'idx')]
+
+        # A failure while restoring does not mask the original error
+        self.es.indices.fail_settings = True
+        with self.assertRaisesRegex(ConnectionError, "Bulk request failed"):
+            bulk_index_into_elasticsearch(self.docs, index_name='idx', chunk_size=5)
+
+        # Without an original error, the failure to restore is raised
+        model_search.helpers.streaming_bulk = FakeBulk()
+        with self.assertRaisesRegex(ConnectionError, "Elasticsearch went away"):
+            bulk_index_into_elasticsearch(self.docs, index_name='idx', chunk_size=5)
+
+
+class IndexLifecycleTestcase(unittest.TestCase):
+    def setUp(self):
+        self.saved = model_search.es, model_search.index_lifecycle, model_search.helpers.streaming_bulk
+        model_search.es = self.es = FakeElasticsearch()
+        model_search.index_lifecycle = self.lifecycle = IndexLifecycle()
+        model_search.helpers.streaming_bulk = FakeBulk()
+
+    def tearDown(self):
+        model_search.es, model_search.index_lifecycle, model_search.helpers.streaming_bulk = self.saved
+
+    def test_generations(self):
+        assert self.lifecycle.is_ready('idx')
+        generation = self.lifecycle.bump('idx')
+        assert generation == 1 and not self.lifecycle.is_ready('idx')
+
+        # A refresh makes the current generation searchable
+        self.lifecycle.refresh('idx')
+        assert self.es.calls == [('refresh', 'idx')]
+        assert self.lifecycle.is_ready('idx')
+
+        # An older generation made ready does not hide a newer one
+        self.lifecycle.bump('idx')
+        self.lifecycle.mark_ready('idx', generation)
+        assert not self.lifecycle.is_ready('idx')
+        self.lifecycle.mark_ready('idx', 2)
+        self.lifecycle.mark_ready('idx', generation)
+        assert self.lifecycle.is_ready('idx')
+
+        self.lifecycle.wait_ready('idx')
+        assert self.es.calls == [('refresh', 'idx')]
+        self.lifecycle.forget('idx')
+        assert self.lifecycle.generation('idx') == 0
+
+        with self.assertRaises(ValueError):
+            self.lifecycle.set_refresh_policy('never')
+
+    def test_ingest_policy(self):
+        bulk_index_into_elasticsearch(["a", "b"], index_name='idx')
+        del self.es.calls[:]
+
+        # The ingestion already refreshed the index
+        search("a", index_name='idx')
+        search("b", index_name='idx')
+        assert self.es.calls == [('search', 'idx'), ('search', 'idx')]
+
+    def test_wait_for_policy(self):
+        self.lifecycle.set_refresh_policy('wait_for')
+        bulk_index_into_elasticsearch(["a", "b"], index_name='idx')
+
+        search("a", index_name='idx')
+        assert self.es.calls == [('search', 'idx')]
+
+    def test_interval_policy(self):
+        self.lifecycle.set_refresh_policy('interval')
+        bulk_index_into_elasticsearch(["a", "b"], index_name='idx')
+        assert self.es.calls == []
+
+        # A search right after the ingestion refreshes once
+        search("a", index_name='idx')
+        search("b", index_name='idx')
+        assert self.es.calls == [('refresh', 'idx'), ('search', 'idx'), ('search', 'idx')]
+
+        # Until new documents are indexed
+        bulk_index_into_elasticsearch(["c"], index_name='idx')
+        search("c", index_name='idx')
+        assert self.es.calls[3:] == [('refresh', 'idx'), ('search', 'idx')]
+
+        # Other indices are refreshed on their own
+        self.lifecycle.bump('other')
+        search("a", index_name='other')
+        assert self.es.calls[5:] == [('refresh', 'other'), ('search', 'other')]
+
+
+class ContentIndicesTestcase(unittest.TestCase):
+    def setUp(self):
+        self.saved = model_search.es, model_search.index_lifecycle, model_search.helpers.streaming_bulk
+        model_search.es = self.es = FakeElasticsearch()
+        model_search.index_lifecycle = IndexLifecycle()
+        model_search.helpers.streaming_bulk = self.streaming_bulk = FakeBulk()
+
+    def tearDown(self):
+        model_search.es, model_search.index_lifecycle, model_search.helpers.streaming_bulk = self.saved
+
+    def add_index(self, name, age):
+        self.es.indices.store[name] = {
+            'mappings': {}, 'creation_date': str(int((time.time() - age) * 1000))}
+
+    def test_content_index_name(self):
+        name = content_index_name("red riding hood", max_tokens=384, stride=64)
+        assert name.startswith(INDEX_NAME + '-') and len(name) == len(INDEX_NAME) + 17
+
+        # Same content and settings, whatever their order
+        assert content_index_name("red riding hood", stride=64, max_tokens=384) == name
+        assert content_index_name("red riding hood!", max_tokens=384, stride=64) != name
+        assert content_index_name("red riding hood", max_tokens=384, stride=32) != name
+
+    def test_index_completeness(self):
+        retriever = ElasticRetriever()
+        name = content_index_name("red riding hood")
+        assert not index_is_complete(name)
+
+        # An ingestion with failed documents is not complete, so it is done again
+        retriever.index_documents(["red", "reject riding hood"], name)
+        assert not index_is_complete(name)
+        retriever.index_documents(["red", "riding hood"], name)
+        assert index_is_complete(name)
+        assert self.es.indices.store[name]['mappings']['_meta'] == {'complete': True, 'num_docs': 2}
+        assert [c for c in self.es.calls if c[0] != 'put_settings'] == [
+            ('create', name), ('refresh', name), ('delete', name), ('create', name), ('refresh', name)]
+
+        # A complete index is reused without indexing
+        retriever.index_documents(["red", "riding hood"], name)
+        assert len(self.streaming_bulk.chunks) == 2
+        assert retriever.index_name == name
+
+    def test_garbage_collection(self):
+        for i in range(5):
+            self.add_index('{}-{}'.format(INDEX_NAME, i), age=100 * i)
+        self.add_index('other', age=1000)
+
+        # The oldest ones go first, never an index in use, which counts against the limit
+        deleted = garbage_collect_indices(max_indices=3, keep=['{}-4'.format(INDEX_NAME)])
+        assert deleted == ['{}-2'.format(INDEX_NAME), '{}-3'.format(INDEX_NAME)]
+        assert sorted(self.es.indices.store) == ['other'] + ['{}-{}'.format(INDEX_NAME, i) for i in (0, 1, 4)]
+
+        deleted = garbage_collect_indices(max_indices=None, max_age=50, keep=['{}-4'.format(INDEX_NAME)])
+        assert deleted == ['{}-1'.format(INDEX_NAME)]
+        assert garbage_collect_indices(max_indices=None, max_age=None) == []
+
+    def test_retriever_keeps_the_index_in_use(self):
+        retriever = ElasticRetriever(max_indices=1)
+        self.add_index('{}-old'.format(INDEX_NAME), age=0)
+        name = content_index_name("red riding hood")
+
+        # The new index is kept even though it is not the most recent one, the
+        # other one goes
+        self.es.indices.create = lambda index, body=None, ignore=None: self.add_index(index, age=100)
+        retriever.index_documents(["red riding hood"], name)
+        assert sorted(self.es.indices.store) == [name]
@@ -0,0 +1,116 @@
+import os
+import string
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+from transformers import BertConfig, BertTokenizerFast
+
+from backend.models.interfaces.late_interaction import ColBERTEncoder, LateInteractionEncoder, \
+    LateInteractionIndex, ResidualCodec
+
+
+WORDS = ("there was once a sweet little maid who lived with her father and mother in cottage "
+         "wolf forest grandmother basket").split()
+
+
+class ResidualCodecTestcase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(32, 64))
+        self.embeddings = centers[rng.integers(0, 32, 4000)] + 0.2 * rng.normal(size=(4000, 64))
+        self.embeddings /= np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+
+    def test_round_trip(self):
+        for nbits in (1, 2, 4):
+            codec = ResidualCodec.train(self.embeddings, nbits)
+            codes, residuals = codec.compress(self.embeddings)
+
+            assert residuals.shape == (len(self.embeddings), 64 * nbits // 8)
+
+            decompressed = codec.decompress(codes, residuals)
+            similarity = (decompressed * self.embeddings).sum(axis=1).mean()
+            assert similarity > 0.95
+
+    def test_invalid_nbits(self):
+        with self.assertRaises(ValueError):
+            ResidualCodec.train(self.embeddings, 3)
+
+
+class LateInteractionIndexTestcase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        vocab_file = os.path.join(self.tmp.name, 'vocab.txt')
+        with open(vocab_file, 'w') as f:
+            f.write("\n".join(["[PAD]", "[unused0]", "[unused1]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+                              + list(string.punctuation) + WORDS))
+        tokenizer = BertTokenizerFast(vocab_file)
+
+        config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=32, num_hidden_layers=1,
+                            num_attention_heads=2, intermediate_size=64, max_position_embeddings=128)
+        torch.manual_seed(0)
+        self.encoder = LateInteractionEncoder(
+            ColBERTEncoder(config, dim=16), tokenizer, query_maxlen=8, doc_maxlen=32)
+
+        rng = np.random.default_rng(0)
+        self.passages = [" ".join(rng.choice(WORDS, rng.integers(3, 20))) + "." for _ in range(60)]
+        self.queries = ["the wolf in the forest", "grandmother basket"]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def brute_force(self, query):
+        """MaxSim of the query with every passage, encoded one at a time"""
+        query_embeddings = self.encoder.encode_query(query).astype(np.float32)
+        scores = []
+        for passage in self.passages:
+            embeddings, _ = self.encoder.encode_passages([passage])
+            scores.append((embeddings.astype(np.float32) @ query_embeddings.T).max(axis=0).sum())
+        return np.asarray(scores)
+
+    def build_and_reload(self, nbits):
+        path = os.path.join(self.tmp.name, 'index-{}'.format(nbits))
+        assert not LateInteractionIndex.exists(path)
+
+        built = LateInteractionIndex.build(path, self.passages, self.encoder, nbits=nbits, batch_size=16)
+        assert LateInteractionIndex.exists(path) and not os.path.exists(path + '.tmp')
+
+        index = LateInteractionIndex.load(path, self.encoder)
+        assert index.collection == self.passages
+        for query in self.queries:
+            assert index.search(query, k=5) == built.search(query, k=5)
+        return index
+
+    def test_uncompressed_index_is_exact(self):
+        index = self.build_and_reload(nbits=None)
+
+        for query in self.queries:
+            expected = self.brute_force(query)
+            pids, ranks, scores = index.search(query, k=5)
+
+            assert pids == np.argsort(-expected, kind='stable')[:5].tolist()
+            assert ranks == [1, 2, 3, 4, 5]
+            np.testing.assert_allclose(scores, expected[pids], rtol=1e-5)
+
+    def test_compressed_index(self):
+        index = self.build_and_reload(nbits=2)
+
+        for query in self.queries:
+            expected = self.brute_force(query)
+            top = np.argsort(-expected)[:5].tolist()
+            pids, ranks, scores = index.search(query, k=5)
+
+            # Approximate scores of the candidates sharing a centroid with the query
+            assert pids[0] in top[:3]
+            assert len(set(pids) & set(top)) >= 3
+            np.testing.assert_allclose(scores, expected[pids], atol=0.02 * self.encoder._query_maxlen)
+
+        # Scoring every passage with 8 bits gives the ranking of the brute force
+        index = self.build_and_reload(nbits=8)
+        index._ncells = len(index._codec.centroids)
+        for query in self.queries:
+            expected = self.brute_force(query)
+            pids, _, scores = index.search(query, k=5)
+            assert pids == np.argsort(-expected)[:5].tolist()
+            np.testing.assert_allclose(scores, expected[pids], atol=0.02)
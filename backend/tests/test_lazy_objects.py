@@ -0,0 +1,76 @@
+import copy
+import threading
+import time
+import unittest
+
+from backend.server.utils.lazy_objects import LazyObject, current_rss_mb, load_all, unwrap, warm_up
+
+
+class Model():
+    def __init__(self):
+        time.sleep(0.05)
+        self.loads = 1
+
+    def _get_class_name(self):
+        return 'Model'
+
+
+class LazyObjectTestcase(unittest.TestCase):
+    def test_loads_once_on_first_use(self):
+        calls = []
+        handle = LazyObject('Model', 'models', lambda: calls.append(1) or Model())
+        assert handle._get_class_name() == 'Model'
+        assert handle._get_load_state()['state'] == 'pending'
+        assert copy.deepcopy({'objs': [handle]})['objs'][0] is handle
+
+        threads = [threading.Thread(target=unwrap, args=(handle,)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(calls) == 1
+        assert handle.loads == 1
+        state = handle._get_load_state()
+        assert state['state'] == 'ready' and state['load_time'] >= 0.05
+
+    def test_failures_are_isolated(self):
+        def fail():
+            raise OSError('no weights')
+
+        broken = LazyObject('Broken', 'models', fail)
+        handle = LazyObject('Model', 'models', Model)
+        report = {}
+        warm_up([broken, handle], report=report).join()
+
+        assert [o['state'] for o in report['objects']] == ['failed', 'ready']
+        assert 'no weights' in report['objects'][0]['error']
+        assert report['peak_rss_mb'] > 0
+        assert report['rss_approximate']
+        with self.assertRaises(OSError):
+            broken.loads
+
+    def test_loads_concurrently(self):
+        handles = [LazyObject('Model', 'models', Model) for _ in range(4)]
+        report = load_all(handles, max_workers=4)
+
+        assert all(o['state'] == 'ready' for o in report['objects'])
+        assert report['wall_time'] < sum(o['load_time'] for o in report['objects'])
+
+    @unittest.skipUnless(current_rss_mb(), "/proc/self/statm is not available")
+    def test_memory_of_each_object(self):
+        class LargeModel(Model):
+            def __init__(self):
+                super().__init__()
+                # 64 MB, touched so that it is resident
+                self.weights = bytearray(b'x' * (64 * 1024 * 1024))
+
+        handles = [LazyObject('Large', 'models', LargeModel), LazyObject('Model', 'models', Model)]
+        report = load_all(handles, max_workers=1)
+
+        # One at a time, the RSS growth is the memory of each object
+        assert not report['rss_approximate']
+        large, small = report['objects']
+        assert 60 <= large['rss_delta_mb'] < 128
+        assert small['rss_delta_mb'] < 16
+        assert report['rss_mb'] <= report['peak_rss_mb'] + 1
@@ -0,0 +1,73 @@
+import unittest
+
+from backend.models.interfaces.model_registry import ModelRegistry
+
+
+class FakeParameter():
+    def __init__(self, n_bytes):
+        self._n_bytes = n_bytes
+
+    def nelement(self):
+        return self._n_bytes
+
+    def element_size(self):
+        return 1
+
+
+class FakeModel():
+    def __init__(self, n_bytes):
+        self._params = [FakeParameter(n_bytes)]
+
+    def parameters(self):
+        return self._params
+
+
+class ModelRegistryTestcase(unittest.TestCase):
+    def setUp(self):
+        self.registry = ModelRegistry()
+        self.loads = []
+
+    def loader(self, name, n_bytes):
+        def load():
+            self.loads.append(name)
+            return FakeModel(n_bytes)
+        return load
+
+    def test_shared_instance(self):
+        first = self.registry.get(('a',), self.loader('a', 10))
+        second = self.registry.get(('a',), self.loader('a', 10))
+        assert first is second
+        assert self.loads == ['a']
+        assert self.registry.memory_usage() == 10
+
+    def test_lru_eviction(self):
+        self.registry.set_memory_budget(25)
+        self.registry.get(('a',), self.loader('a', 10))
+        self.registry.get(('b',), self.loader('b', 10))
+        # 'a' becomes the most recently used
+        self.registry.get(('a',), self.loader('a', 10))
+        self.registry.get(('c',), self.loader('c', 10))
+
+        assert self.registry.memory_usage() == 20
+        self.registry.get(('a',), self.loader('a', 10))
+        self.registry.get(('b',), self.loader('b', 10))
+        assert self.loads == ['a', 'b', 'c', 'b']
+
+    def test_models_in_use_are_kept(self):
+        self.registry.set_memory_budget(25)
+        # 'a' is held by an object of the dashboard, 'b' is not anymore
+        model_a = self.registry.get(('a',), self.loader('a', 10))
+        self.registry.get(('b',), self.loader('b', 10))
+        self.registry.get(('c',), self.loader('c', 10))
+
+        assert self.registry.memory_usage() == 20
+        assert self.registry.get(('a',), self.loader('a', 10)) is model_a
+        assert self.loads == ['a', 'b', 'c']
+
+        # Over budget while every model is in use, rather than loading copies
+        model_b = self.registry.get(('b',), self.loader('b', 10))
+        model_c = self.registry.get(('c',), self.loader('c', 10))
+        assert self.registry.memory_usage() == 30
+        assert self.registry.get(('b',), self.loader('b', 10)) is model_b
+        assert self.registry.get(('c',), self.loader('c', 10)) is model_c
+        assert self.loads == ['a', 'b', 'c', 'b', 'c']
@@ -0,0 +1,161 @@
+import http.client
+import json
+import os
+import signal
+import threading
+import time
+import unittest
+
+from flask import Flask, request
+from flask_restful import Api
+from flask_socketio import SocketIO
+
+from backend.server.core.model_views import ModelInitilize, ModelSearch
+from backend.server.utils.answer_cache import AnswerCache
+from backend.server.utils.prefork import REPLAY_HEADER, PreforkServer, SharedRequests, blocking_runner, \
+    make_listener, serve_app
+
+
+class DocumentModel():
+    """Search model answering with its document, which every worker holds in memory"""
+
+    def _get_class_name(self):
+        return 'Document'
+
+    def _get_document_key(self):
+        return getattr(self, 'index_name', None)
+
+    def load_model(self, file_name, file_content):
+        # Documents the other workers are slow to load, or fail to load
+        if REPLAY_HEADER in request.headers:
+            if file_content.startswith('slow'):
+                time.sleep(1.5)
+            elif file_content.startswith('broken'):
+                raise OSError('no space left on device')
+
+        self.index_name = file_name
+        self.content = file_content
+
+    def file_search(self, search_term):
+        # Like a retriever without index for the document
+        if self._get_document_key() is None:
+            raise KeyError(None)
+        return [{'answer': self.content, 'worker': os.getpid()}], 0.0
+
+
+def post(port, path, payload):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or 'null')
+    finally:
+        connection.close()
+
+
+class PreforkTestcase(unittest.TestCase):
+    async_mode = 'threading'
+
+    def setUp(self):
+        # Set by create_app
+        os.environ.setdefault('ASKI_PROFILING', 'false')
+
+        app = Flask(__name__)
+        api = Api(app)
+        api.add_resource(ModelInitilize, '/models/model/initialize')
+        api.add_resource(ModelSearch, '/search')
+        socketio = SocketIO(app, async_mode=self.async_mode)
+
+        self.shared_requests = SharedRequests(
+            2, sleep=socketio.sleep, timeout=30, run_blocking=blocking_runner(self.async_mode))
+        app.config.update(
+            server_config={'model_objs': {'search': [DocumentModel()]}, 'function': {}},
+            answer_cache=AnswerCache(),
+            shared_requests=self.shared_requests)
+        listener = make_listener('127.0.0.1', 0)
+
+        def serve(slot):
+            self.shared_requests.slot = slot
+            self.shared_requests.replay_log(app)
+            serve_app(app, socketio, listener, self.shared_requests.listeners[slot])
+
+        # The master of the workers runs in its own process
+        self.master = os.fork()
+        if self.master == 0:
+            try:
+                PreforkServer(serve, 2, threads_per_worker=1).run()
+            finally:
+                os._exit(0)
+
+        # Private port of each worker
+        self.ports = [l.getsockname()[1] for l in self.shared_requests.listeners]
+
+    def tearDown(self):
+        os.kill(self.master, signal.SIGTERM)
+        os.waitpid(self.master, 0)
+        self.shared_requests.close()
+
+    def search(self, slot):
+        return post(self.ports[slot], '/search', {'model': 'Document', 'query': 'who?'})
+
+    def initialize(self, slot, file_name, content):
+        return post(self.ports[slot], '/models/model/initialize',
+                    {'model': 'Document', 'filename': file_name, 'filecontent': content})
+
+    def test_documents_are_loaded_by_every_worker(self):
+        assert self.search(1)[0] == 500
+
+        assert self.initialize(0, 'hood.txt', 'red riding hood') == (200, {'response': 'success'})
+        status, response = self.search(1)
+        assert status == 200
+        assert response['result'][0]['answer'] == 'red riding hood'
+        worker = response['result'][0]['worker']
+        assert self.search(0)[1]['result'][0]['worker'] != worker
+
+        # The other way around, the answer cached by the first document is stale
+        assert self.initialize(1, 'wolf.txt', 'the big bad wolf')[0] == 200
+        assert self.search(0)[1]['result'][0]['answer'] == 'the big bad wolf'
+        assert self.search(1)[1]['result'][0]['answer'] == 'the big bad wolf'
+
+        # A restarted worker loads the last document before serving
+        os.kill(worker, signal.SIGKILL)
+        for _ in range(100):
+            status, response = self.search(1)
+            if status == 200 and not response['cached']:
+                break
+            time.sleep(0.1)
+        assert response['result'][0]['worker'] != worker
+        assert response['result'][0]['answer'] == 'the big bad wolf'
+
+    def test_workers_serve_while_the_others_load(self):
+        assert self.initialize(0, 'hood.txt', 'red riding hood')[0] == 200
+
+        # The first worker keeps answering while the second one loads the document
+        results = []
+        initialize = threading.Thread(
+            target=lambda: results.append(self.initialize(0, 'slow.txt', 'slow wolf')))
+        initialize.start()
+        time.sleep(0.5)
+
+        t_s = time.time()
+        status, response = self.search(0)
+        assert status == 200 and time.time() - t_s < 0.5
+        assert response['result'][0]['answer'] == 'slow wolf'
+
+        initialize.join()
+        assert results == [(200, {'response': 'success'})]
+        assert self.search(1)[1]['result'][0]['answer'] == 'slow wolf'
+
+    def test_failed_replays_are_reported(self):
+        status, response = self.initialize(0, 'broken.txt', 'broken record')
+
+        # Loaded by the worker that got the request
+        assert status == 200
+        assert response['failed_workers'] == [1]
+        assert '[1]' in response['warning']
+        assert self.search(0)[1]['result'][0]['answer'] == 'broken record'
+        assert self.search(1)[0] == 500
+
+
+class GeventPreforkTestcase(PreforkTestcase):
+    async_mode = 'gevent'
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+import torch
+from transformers import AutoModelForQuestionAnswering, BertConfig, BertForQuestionAnswering
+
+from backend.models.interfaces.model_registry import get_memory_footprint
+from backend.models.interfaces.quantization import load_quantized, quantized_path
+
+
+class QuantizationTestcase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.tmp.name, 'reader')
+        config = BertConfig(vocab_size=100, hidden_size=64, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=128)
+        torch.manual_seed(0)
+        self.model = BertForQuestionAnswering(config).eval()
+        self.model.save_pretrained(self.checkpoint)
+        self.cache_dir = os.path.join(self.tmp.name, 'quantized')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_quantized_weights_are_cached(self):
+        input_ids = torch.randint(0, 100, (2, 16))
+
+        quantized = load_quantized(AutoModelForQuestionAnswering, self.checkpoint, self.cache_dir)
+        assert os.path.exists(quantized_path(
+            AutoModelForQuestionAnswering, self.checkpoint, self.cache_dir))
+        assert get_memory_footprint(quantized) < get_memory_footprint(self.model)
+
+        # Second load: built from the config and the cached int8 weights
+        reloaded = load_quantized(AutoModelForQuestionAnswering, self.checkpoint, self.cache_dir)
+
+        with torch.no_grad():
+            expected = self.model(input_ids).start_logits
+            first = quantized(input_ids).start_logits
+            second = reloaded(input_ids).start_logits
+
+        assert torch.equal(first, second)
+        assert torch.allclose(first, expected, atol=0.1)
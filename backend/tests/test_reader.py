@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+import torch
+from transformers import BertConfig, BertForQuestionAnswering, BertTokenizerFast
+from transformers.modeling_outputs import QuestionAnsweringModelOutput
+
+from backend.models.interfaces.model_search import answer_question, answer_questions
+
+
+WORDS = "there was once a sweet little maid who lived with her father and mother in cottage".split()
+PUNCTUATION = list(".,?!'()[]{}*+$^|\\")
+
+
+class SpanReader():
+    """Reader scoring one (start word, end word) span above everything else"""
+
+    def __init__(self, tokenizer, start_word, end_word):
+        self._start_id = tokenizer.convert_tokens_to_ids(start_word)
+        self._end_id = tokenizer.convert_tokens_to_ids(end_word)
+
+    def __call__(self, return_dict=True, **inputs):
+        input_ids = inputs['input_ids']
+        return QuestionAnsweringModelOutput(
+            start_logits=(input_ids == self._start_id).float() * 10,
+            end_logits=(input_ids == self._end_id).float() * 10)
+
+
+class ReaderTestcase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        vocab_file = os.path.join(self.tmp.name, 'vocab.txt')
+        with open(vocab_file, 'w') as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + PUNCTUATION + WORDS))
+        self.tokenizer = BertTokenizerFast(vocab_file)
+
+        config = BertConfig(vocab_size=len(WORDS) + len(PUNCTUATION) + 5, hidden_size=32,
+                            num_hidden_layers=2, num_attention_heads=2, intermediate_size=64)
+        torch.manual_seed(0)
+        self.model = BertForQuestionAnswering(config).eval()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_batched_equals_single(self):
+        question = "who lived with her father?"
+        passages = [" ".join(WORDS), "a sweet little maid", "mother in cottage . there was once",
+                    " ".join(WORDS[::-1] * 3)]
+
+        batched = answer_questions(question, passages, self.model, self.tokenizer, batch_size=3)
+        single = [answer_question(question, p, self.model, self.tokenizer) for p in passages]
+        assert batched == single
+
+        for (answer, before, after), passage in zip(batched, passages):
+            assert answer == '' or before + answer + after == passage
+
+    def test_long_passage_picks_the_best_window(self):
+        # The answer is far beyond the first window (truncation would miss it)
+        filler = " ".join(WORDS[:7] * 120)
+        passage = filler + " her father and mother in cottage " + filler
+        reader = SpanReader(self.tokenizer, 'father', 'cottage')
+
+        answer, before, after = answer_question("where?", passage, reader, self.tokenizer)
+        assert answer == "father and mother in cottage"
+        assert before + answer + after == passage
+
+        # Same answer with windows much shorter than the passage
+        assert answer_questions("where?", [passage], reader, self.tokenizer,
+                                max_length=32, stride=8)[0] == (answer, before, after)
+
+        # A random reader still returns a span of the passage for 900-word passages
+        long_passage = " ".join((WORDS * 60)[:900])
+        answer, before, after = answer_question("who?", long_passage, self.model, self.tokenizer)
+        assert before + answer + after == long_passage
+
+    def test_offsets_around_punctuation(self):
+        passage = "(the maid's) [father] cost $5.* ^mother| in {cottage}? a\\b +her+ sweet!"
+        reader = SpanReader(self.tokenizer, 'father', 'mother')
+
+        answer, before, after = answer_question("who?", passage, reader, self.tokenizer)
+        assert answer == "father] cost $5.* ^mother"
+        assert before == "(the maid's) ["
+        assert after == "| in {cottage}? a\\b +her+ sweet!"
+
+        answers = answer_questions("who?", [passage] * 3, self.model, self.tokenizer)
+        for answer, before, after in answers:
+            assert answer == '' or before + answer + after == passage
+
+    def test_null_answer_is_opt_in(self):
+        passage = "there was once a sweet little maid"
+        reader = SpanReader(self.tokenizer, '[CLS]', '[CLS]')
+
+        # A span of the passage, as the single-passage reader always returned
+        answer, before, after = answer_questions("who?", [passage], reader, self.tokenizer)[0]
+        assert answer != '' and before + answer + after == passage
+
+        assert answer_questions("who?", [passage], reader, self.tokenizer,
+                                allow_null_answer=True) == [('', '', '')]
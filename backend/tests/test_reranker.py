@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+from backend.models.interfaces.model_search import ModelSearch
+from backend.models.interfaces.reranker import CrossEncoderReranker
+
+
+WORDS = "there was once a sweet little maid who lived with her father and mother in cottage".split()
+
+
+class FakeReranker():
+    def rerank(self, question, passages, top_k=None):
+        ranked = sorted(enumerate(len(p) for p in passages), key=lambda x: -x[1])
+        return ranked[:top_k]
+
+
+class RerankerTestcase(unittest.TestCase):
+    def test_cross_encoder(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            vocab_file = os.path.join(tmp, 'vocab.txt')
+            with open(vocab_file, 'w') as f:
+                f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+            BertTokenizerFast(vocab_file).save_pretrained(tmp)
+
+            torch.manual_seed(0)
+            config = BertConfig(vocab_size=len(WORDS) + 5, hidden_size=32, num_hidden_layers=1,
+                                num_attention_heads=2, intermediate_size=64, num_labels=1)
+            BertForSequenceClassification(config).save_pretrained(tmp)
+
+            reranker = CrossEncoderReranker(tmp, batch_size=2)
+
+        passages = ["a sweet little maid", "her father", "mother in cottage", "there was once"]
+        scores = reranker.scores("who lived with her father", passages)
+        single = [reranker.scores("who lived with her father", [p])[0] for p in passages]
+        assert all(abs(a - b) < 1e-4 for a, b in zip(scores, single))
+
+        ranked = reranker.rerank("who lived with her father", passages, top_k=2)
+        assert [i for i, _ in ranked] == sorted(range(4), key=lambda i: -scores[i])[:2]
+
+    def test_select_passages(self):
+        model = ModelSearch()
+        passages = ["a", "abc", "ab"]
+        assert model._select_passages("q", passages) == passages
+
+        model.reader_top_k = 2
+        assert model._select_passages("q", passages) == ["a", "abc"]
+
+        model.reranker = FakeReranker()
+        assert model._select_passages("q", passages) == ["abc", "ab"]
@@ -0,0 +1,31 @@
+import tempfile
+import unittest
+
+from backend.models.interfaces.results_store import ResultsStore, results_key
+
+
+class ResultsStoreTestcase(unittest.TestCase):
+    def test_key_covers_the_run(self):
+        key = results_key(model='bart', generation={'num_beams': 4}, split='validation')
+        assert key == results_key(split='validation', generation={'num_beams': 4}, model='bart')
+        assert key != results_key(model='bart', generation={'num_beams': 2}, split='validation')
+        assert key != results_key(model='bart', generation={'num_beams': 4}, split='test')
+
+    def test_resume_from_shards(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ResultsStore.for_run('Bart_xsum', results_dir=tmp, split='validation')
+            store.append([3, 0], ['d', 'a'])
+            store.append([1], ['b'])
+            assert not store.is_complete()
+
+            # A new process finds the checkpoints of the interrupted run
+            store = ResultsStore.for_run('Bart_xsum', results_dir=tmp, split='validation')
+            assert store.load() == {0: 'a', 1: 'b', 3: 'd'}
+
+            store.append([2], ['c'])
+            store.mark_complete(4)
+            assert store.is_complete()
+            assert store.load() == {0: 'a', 1: 'b', 2: 'c', 3: 'd'}
+
+            other = ResultsStore.for_run('Bart_xsum', results_dir=tmp, split='test')
+            assert other.load() == {}
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+import torch
+from transformers import BertConfig, BertForQuestionAnswering, BertTokenizerFast
+
+from backend.models.interfaces.model_search import answer_questions
+from backend.models.interfaces.runtimes import checkpoint_revision, load_onnx_reader, onnx_path
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+WORDS = "there was once a sweet little maid who lived with her father and mother in cottage".split()
+
+
+class OnnxPathTestcase(unittest.TestCase):
+    def test_hub_checkpoints_are_keyed_by_revision(self):
+        path = onnx_path('org/reader', revision='abc-123')
+        assert path.startswith(os.path.join('aski/models/onnx', 'org--reader-'))
+        assert onnx_path('org/reader', revision='abc-123') == path
+        assert onnx_path('org/reader', revision='def-123') != path
+        assert os.path.dirname(onnx_path('org/reader', quantize=True, revision='abc-123')) == os.path.dirname(path)
+
+    def test_revision_follows_the_configuration(self):
+        with tempfile.TemporaryDirectory() as checkpoint:
+            BertConfig(hidden_size=32).save_pretrained(checkpoint)
+            revision = checkpoint_revision(checkpoint)
+            assert checkpoint_revision(checkpoint) == revision
+
+            BertConfig(hidden_size=64).save_pretrained(checkpoint)
+            assert checkpoint_revision(checkpoint) != revision
+
+
+@unittest.skipIf(onnxruntime is None, "onnxruntime is not installed")
+class OnnxRuntimeTestcase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.tmp.name, 'reader')
+        os.makedirs(self.checkpoint)
+
+        vocab_file = os.path.join(self.checkpoint, 'vocab.txt')
+        with open(vocab_file, 'w') as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "?", "."] + WORDS))
+        self.tokenizer = BertTokenizerFast(vocab_file)
+
+        config = BertConfig(vocab_size=len(WORDS) + 7, hidden_size=32, num_hidden_layers=2,
+                            num_attention_heads=2, intermediate_size=64)
+        torch.manual_seed(0)
+        self.model = BertForQuestionAnswering(config).eval()
+        self.model.save_pretrained(self.checkpoint)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_answers_as_torch(self):
+        reader = load_onnx_reader(self.checkpoint, self.tokenizer)
+        assert os.path.exists(onnx_path(self.checkpoint))
+
+        inputs = self.tokenizer(["who lived with her father?"] * 2,
+                                ["there was once a sweet little maid", "mother in cottage"],
+                                padding=True, return_tensors='pt')
+        with torch.no_grad():
+            expected = self.model(**inputs)
+        outputs = reader(**inputs, return_dict=True)
+
+        assert torch.allclose(outputs.start_logits, expected.start_logits, atol=1e-4)
+        assert torch.allclose(outputs.end_logits, expected.end_logits, atol=1e-4)
+
+        passages = [" ".join(WORDS), "a sweet little maid"]
+        assert answer_questions("who lived with her father?", passages, reader, self.tokenizer) == \
+            answer_questions("who lived with her father?", passages, self.model, self.tokenizer)
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+from flask import Flask
+from flask_restful import Api
+from transformers import BartConfig, BertTokenizerFast
+
+from backend.models.interfaces.hugging_face_model_summarization import HuggingFaceModelSummarization
+from backend.models.interfaces.model_search import summarize_answer
+from backend.server.core.model_views import ModelSearch
+from backend.server.utils.answer_cache import AnswerCache
+
+
+WORDS = "there was once a sweet little maid who lived with her father and mother in cottage".split()
+
+
+class EchoModel():
+    """Seq2seq model whose summary of an input is the input itself"""
+
+    def __init__(self):
+        self.config = BartConfig(d_model=32, encoder_layers=1, decoder_layers=1)
+        self.calls = []
+
+    def generate(self, input_ids, attention_mask=None, **kwargs):
+        self.calls.append({'shape': tuple(input_ids.shape), 'kwargs': kwargs})
+        return input_ids
+
+
+class SearchModel():
+    def _get_class_name(self):
+        return 'Document'
+
+    def _get_document_key(self):
+        return 'doc-1'
+
+    def file_search(self, search_term):
+        passages = ["there was once a sweet little maid", "who lived with her father",
+                    "and mother in cottage"]
+        return [{'answer': p, 'orig': p} for p in passages], 0.0
+
+
+class SearchSummarizationTestcase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        vocab_file = os.path.join(self.tmp.name, 'vocab.txt')
+        with open(vocab_file, 'w') as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + WORDS))
+
+        self.summarizer = HuggingFaceModelSummarization.__new__(HuggingFaceModelSummarization)
+        self.summarizer._model_name = 'echo'
+        self.summarizer._model = EchoModel()
+        self.summarizer._tokenizer = BertTokenizerFast(vocab_file)
+        self.summarizer._max_length = 64
+        self.summarizer._truncation = True
+        self.summarizer._generation_profile = None
+        self.summarizer._get_class_name = lambda: 'Echo'
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_passages_are_summarized_in_one_batch(self):
+        passages = ["there was once a sweet little maid who lived with her father", "a maid", "mother in cottage"]
+        summaries = summarize_answer(passages, self.summarizer, max_input_tokens=6)
+
+        # One generate call, inputs padded to the longest one and truncated
+        assert len(self.summarizer._model.calls) == 1
+        call = self.summarizer._model.calls[0]
+        assert call['shape'] == (3, 6)
+        assert (call['kwargs']['min_length'], call['kwargs']['max_length']) == (10, 60)
+
+        # One summary per passage, in the order of the passages
+        assert summaries == ["there was once a", "a maid", "mother in cottage"]
+
+    def test_without_summarizer(self):
+        assert summarize_answer(["a maid", "a wolf"]) == ['', '']
+        assert summarize_answer([], self.summarizer) == []
+        assert self.summarizer._model.calls == []
+
+    def test_search_endpoint(self):
+        # Set by create_app
+        os.environ.setdefault('ASKI_PROFILING', 'false')
+
+        app = Flask(__name__)
+        Api(app).add_resource(ModelSearch, '/search')
+        app.config.update(
+            server_config={'model_objs': {'search': [SearchModel()], 'summarization': [self.summarizer]},
+                           'function': {}},
+            answer_cache=AnswerCache())
+        client = app.test_client()
+
+        response = client.post('/search', json={'model': 'Document', 'query': 'who?', 'summarizer': 'Echo'})
+        assert response.status_code == 200
+        assert [r['sum'] for r in response.get_json()['result']] == [
+            "there was once a sweet little maid", "who lived with her father", "and mother in cottage"]
+
+        # An unknown summarizer is an error, whose answer is not cached
+        response = client.post('/search', json={'model': 'Document', 'query': 'who?', 'summarizer': 'Bart'})
+        assert response.status_code == 400
+        assert app.config['answer_cache'].stats()['size'] == 1
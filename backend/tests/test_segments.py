@@ -0,0 +1,23 @@
+import unittest
+
+from backend.models.interfaces.model_search import iter_segments, segment_documents
+
+
+class SegmentsTestcase(unittest.TestCase):
+    def test_word_budget_without_overlap(self):
+        doc = " ".join(str(i) for i in range(25))
+        segments = segment_documents([doc], max_doc_length=10)
+        assert [len(s.split()) for s in segments] == [10, 10, 5]
+        assert " ".join(segments) == doc
+
+    def test_overlap(self):
+        segments = list(iter_segments(["a b c d e f g h"], max_tokens=3, stride=1))
+        assert segments == ['a b c', 'c d e', 'e f g', 'g h']
+
+    def test_sentence_snapping(self):
+        segments = list(iter_segments(["A b. C d. E f. G h."], max_tokens=4, stride=2))
+        assert segments == ['A b. C d.', 'C d. E f.', 'E f. G h.']
+
+    def test_is_lazy(self):
+        segments = iter_segments(["a b c d"], max_tokens=2, stride=0)
+        assert next(segments) == 'a b'
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import threading
+import unittest
+
+import torch
+from transformers import BartConfig, BartForConditionalGeneration, BertTokenizerFast
+
+from backend.models.interfaces.hugging_face_model_summarization import HuggingFaceModelSummarization, \
+    _TextStreamer
+
+
+WORDS = "there was once a sweet little maid who lived with her father and mother in cottage".split()
+
+
+class SummaryStreamingTestcase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        vocab_file = os.path.join(self.tmp.name, 'vocab.txt')
+        with open(vocab_file, 'w') as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "."] + WORDS))
+        self.tokenizer = BertTokenizerFast(vocab_file)
+
+        config = BartConfig(vocab_size=len(WORDS) + 6, d_model=32, encoder_layers=1, decoder_layers=1,
+                            encoder_attention_heads=2, decoder_attention_heads=2, encoder_ffn_dim=64,
+                            decoder_ffn_dim=64, max_position_embeddings=128, pad_token_id=0,
+                            bos_token_id=2, eos_token_id=3, decoder_start_token_id=3,
+                            forced_bos_token_id=None, forced_eos_token_id=None)
+        torch.manual_seed(0)
+        model = BartForConditionalGeneration(config).eval()
+
+        self.summarizer = HuggingFaceModelSummarization.__new__(HuggingFaceModelSummarization)
+        self.summarizer._model = model
+        self.summarizer._tokenizer = self.tokenizer
+        self.summarizer._max_length = 64
+        self.summarizer._truncation = True
+        self.summarizer._hierarchical = True
+        self.summarizer._chunk_tokens = 10
+        self.summarizer._partial_summary_tokens = 16
+        self.summarizer._fan_out = 2
+        self.summarizer._max_depth = 3
+        self.summarizer._generation_profile = None
+
+        # 20 sentences of 8 tokens, one chunk each
+        self.text = " ".join(["there was once a sweet little maid ."] * 20)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_text_streamer_pushes_complete_words(self):
+        pieces = []
+        streamer = _TextStreamer(self.tokenizer, pieces.append)
+        ids = self.tokenizer("there was once a sweet maid", add_special_tokens=False)['input_ids']
+
+        for step in range(1, len(ids) + 1):
+            assert streamer(torch.tensor([[3] + ids[:step]]), None) is False
+        assert "".join(pieces) == "there was once a sweet "
+
+        streamer.push("there was once a sweet maid")
+        streamer.push("there was once a sweet maid")
+        assert pieces == ["there ", "was ", "once ", "a ", "sweet ", "maid"]
+
+        cancel = threading.Event()
+        streamer = _TextStreamer(self.tokenizer, pieces.append, cancel.is_set)
+        assert streamer(torch.tensor([[3] + ids]), None) is False
+        cancel.set()
+        assert streamer(torch.tensor([[3] + ids]), None) is True
+
+    def test_streamed_pieces_make_the_summary(self):
+        pieces = []
+        summary, timings = self.summarizer._summarize_text_streaming(
+            "there was once a sweet little maid", pieces.append)
+
+        assert [t['stage'] for t in timings] == ['summarize']
+        assert "".join(pieces) == summary[0]
+
+    def test_cancellation_during_the_map_stage(self):
+        cancel = threading.Event()
+        generate = self.summarizer._model.generate
+        lengths = []
+
+        def cancelled_generate(*args, **kwargs):
+            # The client goes away once the first batch of chunks has started
+            cancel.set()
+            output = generate(*args, **kwargs)
+            lengths.append(output.shape[1])
+            return output
+
+        self.summarizer._model.generate = cancelled_generate
+        pieces = []
+        summary, timings = self.summarizer._summarize_text_streaming(
+            self.text, pieces.append, cancel.is_set)
+
+        # The first batch stops after one step, the other batches and stages are skipped
+        assert len(lengths) == 1 and lengths[0] <= 2
+        assert [t['stage'] for t in timings] == ['map']
+        assert pieces == []
+        assert isinstance(summary[0], str)
+
+        # Without cancellation every stage runs
+        self.summarizer._model.generate = generate
+        summary, timings = self.summarizer._summarize_text_streaming(self.text, pieces.append)
+        assert [t['stage'] for t in timings] == ['map', 'reduce', 'reduce', 'final']
+        assert "".join(pieces) == summary[0]
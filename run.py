@@ -35,6 +35,9 @@ if __name__ == "__main__":
                         )
     parser.add_argument('-p', type=int, default=5001,
                         required=False, help="defines port ot be used")
+    parser.add_argument('-w', type=int, default=None,
+                        required=False, help="number of pre-forked server workers "
+                        "(defaults to 'workers' in the function section of the YAML file, else 1)")
 
     args = parser.parse_args()
 
@@ -42,18 +45,18 @@ if __name__ == "__main__":
         data = yaml.safe_load(file)
 
     config = create_server_config(data)
-    app = create_app(data)
+    workers = args.w or int(data['function'].get('workers', 1))
+    app, socketio = create_app(data)
     port = args.p
 
     # p_dash = Process(target=run_client, args=(data, port, '0.0.0.0'))
-    p_serv = Process(target=run_app_server, args=(app, 3000, '0.0.0.0'))
 
     # p_dash.start()
 
+    # The server runs in this process, which holds the models being warmed up
     try:
-        p_serv.start()
-        p_serv.join()
-    except:
+        run_app_server(app, socketio, 3000, '0.0.0.0', workers)
+    except OSError:
         print("Flask server may already be running!")
 
     # p_dash.join()